@@ -1,39 +1,62 @@
-import nibabel as nib
-import numpy as np
-import plotly.graph_objects as go
-
-# Load the .nii file (update the filename with your actual .nii path)
-nii_img = nib.load("BraTS20_Training_001_seg .nii")
-data = nii_img.get_fdata()
-
-# Get coordinates of non-zero voxels
-x, y, z = np.nonzero(data)
-
-# Get intensity values at those coordinates
-intensity = data[x, y, z]
-
-# Normalize intensity (for colorscale)
-intensity = (intensity - intensity.min()) / (intensity.max() - intensity.min())
-
-# Create 3D scatter plot
-fig = go.Figure(data=go.Scatter3d(
-    x=x, y=y, z=z,
-    mode='markers',
-    marker=dict(
-        size=2,
-        color=intensity,
-        colorscale='Viridis',
-        opacity=0.1
-    )
-))
-
-fig.update_layout(
-    title="3D MRI Visualization (.nii)",
-    scene=dict(
-        xaxis_title='X',
-        yaxis_title='Y',
-        zaxis_title='Z'
+import os
+import sys
+
+# Mesh extraction lives in the backend (modules/mesh.py), shared with the /meshes API
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+from modules.mesh import build_meshes, load_segmentation, unpack_mesh  # noqa: E402
+
+# BraTS labels: 1 necrotic core, 2 edema, 4 enhancing tumor
+COLORS = {1: "crimson", 2: "gold", 4: "royalblue"}
+
+
+def label_meshes(path, level=-1):
+    """(label, vertices, faces) per label at one level of detail (0 = coarsest), in mm."""
+    # One isosurface per label instead of one marker per voxel
+    labels, spacing = load_segmentation(path)
+    manifest, blobs = build_meshes(labels, spacing=spacing)
+
+    meshes = []
+    for entry in manifest["labels"]:
+        label = entry["label"]
+        chosen = entry["levels"][level]
+        verts, faces = unpack_mesh(blobs[(label, chosen["level"])])
+        print(f"Label {label}: {chosen['vertices']} vertices, {chosen['faces']} faces")
+        meshes.append((label, verts, faces))
+    return meshes
+
+
+def main():
+    import plotly.graph_objects as go
+
+    # Segmentation to show (update the filename with your actual .nii path) and level of detail (0 = coarsest)
+    path = sys.argv[1] if len(sys.argv) > 1 else "BraTS20_Training_001_seg .nii"
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else -1
+
+    traces = []
+    for label, verts, faces in label_meshes(path, level):
+        traces.append(go.Mesh3d(
+            x=verts[:, 0], y=verts[:, 1], z=verts[:, 2],
+            i=faces[:, 0], j=faces[:, 1], k=faces[:, 2],
+            color=COLORS.get(label, "gray"),
+            opacity=0.5 if label == 2 else 0.9,
+            name=f"label {label}",
+            showlegend=True,
+        ))
+
+    fig = go.Figure(data=traces)
+
+    fig.update_layout(
+        title="3D Tumor Segmentation (.nii)",
+        scene=dict(
+            xaxis_title='X',
+            yaxis_title='Y',
+            zaxis_title='Z',
+            aspectmode='data'
+        )
     )
-)
 
-fig.show()
+    fig.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,136 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form  # ✅ Added Form here
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request  # ✅ Added Form here
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import torch
-import shutil
 from datetime import datetime
-from supabase import create_client
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import inch
+import time
 import uuid
-import cv2
-import numpy as np
-from PIL import Image
 import traceback
+import logging
+import functools
+import threading
+from typing import List
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import os
 
 # Load environment variables from .env file
 load_dotenv()
 
 # === Local modules ===
-from modules.input_loader import load_mri
-from modules.preprocessing import preprocess_volume, preprocess_slice
-from modules.inference import load_model, predict_scan
-from modules.visualization import generate_gradcam, overlay_heatmap_on_slice
+from modules.result_cache import ResultCache, hash_source, make_cache_key
+from modules.workers import StagedExecutor, PipelineBusyError
+from modules.storage import SupabaseStorage, LocalStorage
+from modules.database import SupabaseDatabase, SQLiteDatabase
+from modules.publisher import ArtifactPublisher, Artifact
+from modules.jobs import JobStore, JobRunner, sse_event
+from modules.slice_store import SliceStore
+from modules.tracing import Trace, Span, StageMetrics, run_traced, current_rss_bytes
+from utils.lazy import LazyFunction, LazyModule
+from utils.config import (
+    SCHEDULER_MAX_BATCH_SIZE,
+    SCHEDULER_MAX_WAIT_MS,
+    PIPELINE_POOL,
+    PIPELINE_CPU_WORKERS,
+    PIPELINE_IO_WORKERS,
+    PIPELINE_MAX_PENDING,
+    MODEL_FORMAT,
+    INFERENCE_BACKEND,
+    QUANT_CALIBRATION_DIR,
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_ENTRIES,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_MB,
+    SLICE_STORE_ENABLED,
+    SLICE_STORE_DIR,
+    SLICE_STORE_MAX_MB,
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    STORAGE_BACKEND,
+    DB_BACKEND,
+    LOCAL_DB_PATH,
+    LOCAL_STORAGE_DIR,
+    LOCAL_STORAGE_URL,
+    STORAGE_MAX_CONNECTIONS,
+    PUBLISH_RETRIES,
+    PUBLISH_RETRY_BACKOFF_MS,
+    JOBS_DIR,
+    JOBS_DB,
+    JOB_WORKERS,
+    UPLOADS_DIR,
+    UPLOAD_CHUNK_MAX_MB,
+    UPLOAD_MAX_MB,
+    UPLOAD_TTL_H,
+    JOB_POLL_MS,
+    LOG_LEVEL,
+    ADAPTIVE_INFERENCE,
+    ADAPTIVE_STRIDE,
+    ADAPTIVE_MIN_CONFIDENCE,
+    ADAPTIVE_MIN_SLICES,
+    CROP_TO_FOREGROUND,
+    GRADCAM_VOLUME,
+    PREPROCESS_CV2_THREADS,
+    PREPROCESS_TORCH_THREADS,
+    TORCH_THREADS,
+    MODEL_SERVER_ADDRESSES,
+    MODEL_SERVER_AUTHKEY,
+    MODEL_READY_TIMEOUT_S,
+    MESH_CACHE_DIR,
+    MESH_CACHE_MAX_MB,
+    MESH_DOWNSAMPLE,
+    MESH_LOD_CELLS,
+    STARTUP_MODE,
+    MODEL_WARM_UP,
+)
+
+# === Heavy dependencies: imported on first use (see STARTUP_MODE) ===
+# torch, OpenCV, nibabel, reportlab and the model modules built on them take
+# seconds to import; the background warm-up (or the first request) loads them.
+torch = LazyModule("torch")
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+pipeline = LazyModule("modules.pipeline")
+report_module = LazyModule("modules.report")
+preprocessing = LazyModule("modules.preprocessing")
+backends = LazyModule("modules.backends")
+visualization = LazyModule("modules.visualization")
+scheduler = LazyModule("modules.scheduler")
+model_server = LazyModule("modules.model_server")
+adaptive = LazyModule("modules.adaptive")
+mesh = LazyModule("modules.mesh")
+uploads = LazyModule("modules.uploads")
+
+# Structured trace lines (one JSON object per analysis) go through logging
+logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+
+
+# === App lifecycle: start/stop the shared inference scheduler and worker pools ===
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global WARM_UP_TASK
+    if BACKEND_ERROR:
+        raise RuntimeError(BACKEND_ERROR)
+    if SCHEDULER is not None:
+        SCHEDULER.start()
+    if MODEL_WARM_UP:
+        start_warm_up()
+    JOB_RUNNER.start()
+    yield
+    if WARM_UP_TASK is not None:
+        WARM_UP_TASK.cancel()
+        WARM_UP_TASK = None
+    await JOB_RUNNER.stop()
+    if SCHEDULER is not None:
+        await SCHEDULER.stop()
+    await PUBLISHER.drain()
+    STORAGE.close()
+    DATABASE.close()
+    JOB_STORE.close()
+    PIPELINE.shutdown(wait=False)
+
 
 # === FastAPI setup ===
-app = FastAPI(title="Brain Tumor Classification API")
+app = FastAPI(title="Brain Tumor Classification API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,116 +138,478 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Upload-Offset"],  # read by resumable upload clients on 409
 )
 
-# === Device and model ===
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-MODEL = load_model(device=DEVICE)
+# Identifies what produced a result (weights + backend + slice selection), for the result cache
+def result_version(model_version):
+    if ADAPTIVE_INFERENCE:
+        return f"{model_version}:adaptive-{ADAPTIVE_STRIDE}-{ADAPTIVE_MIN_CONFIDENCE}-{ADAPTIVE_MIN_SLICES}"
+    return model_version
 
-# === Upload directory ===
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Set once the model has answered a warm-up batch (see /ready)
+MODEL_READY = asyncio.Event()
+STARTED_AT = time.time()
 
-# === Supabase configuration ===
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# === Device, model and scheduler: built by load_runtime() ===
+DEVICE = None
+MODEL = INFERENCE_MODEL = None
+MODEL_VERSION = None
+# Batches slices from concurrent /analyze requests into shared forward passes
+# (in this process, or in the model server that all workers share)
+SCHEDULER = None
+RUNTIME_LOCK = threading.Lock()
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise RuntimeError("❌ Missing SUPABASE_URL or SUPABASE_KEY in environment variables.")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+def load_runtime():
+    """
+    Import torch & co. and build the model and scheduler (blocking, runs
+    once). Called while importing with STARTUP_MODE=eager, otherwise from
+    the background warm-up or the first request that needs the model.
+    """
+    global DEVICE, MODEL, INFERENCE_MODEL, MODEL_VERSION, SCHEDULER
+    with RUNTIME_LOCK:
+        if SCHEDULER is not None:
+            return
+        started = time.perf_counter()
+        DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+        if TORCH_THREADS:
+            torch.set_num_threads(TORCH_THREADS)
+        if PIPELINE_POOL == "thread":
+            # Threads share this process (and torch's pool) with the model: only OpenCV is limited
+            preprocessing.configure_preprocessing(cv2_threads=PREPROCESS_CV2_THREADS)
+        # Import what the request path uses now rather than in the first request
+        for module in (pipeline, report_module, visualization):
+            module.load()
 
-# === Helper: Generate text summary ===
-def generate_text_report(prediction: str, confidence: float) -> str:
-    return (
-        f"<b>Prediction:</b> {prediction}<br/>"
-        f"<b>AI Confidence:</b> {confidence:.2f}%<br/><br/>"
-        "🧠 This report was generated using an AI-powered model trained to analyze MRI brain scans. "
-        "It detects abnormal tissue regions and predicts tumor categories using deep learning. "
-        "Please consult a medical professional for confirmation."
-    )
+        if MODEL_SERVER_ADDRESSES:
+            # Shared model server(s): this worker holds no weights; the model
+            # version is learned from the server during warm-up
+            print(f"🛰️ Using model server(s): {', '.join(MODEL_SERVER_ADDRESSES)}")
+            SCHEDULER = model_server.ModelClient(MODEL_SERVER_ADDRESSES, authkey=MODEL_SERVER_AUTHKEY)
+        else:
+            # Model used for the batched forward passes: optional TorchScript copy or a
+            # channels_last / INT8 backend. Grad-CAM always keeps the fp32 eager MODEL.
+            MODEL, INFERENCE_MODEL, model_info, model_version = backends.load_serving_models(
+                DEVICE, INFERENCE_BACKEND, MODEL_FORMAT, QUANT_CALIBRATION_DIR)
+            MODEL_VERSION = result_version(model_version)
+            print(f"🧠 Model loaded: {model_info.as_dict()}")
+            print(f"⚙️ Inference backend: {INFERENCE_BACKEND} ({MODEL_FORMAT})")
+            SCHEDULER = scheduler.InferenceScheduler(
+                INFERENCE_MODEL,
+                device=DEVICE,
+                max_batch_size=SCHEDULER_MAX_BATCH_SIZE,
+                max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+            )
+        print(f"🚀 Runtime loaded in {time.perf_counter() - started:.1f}s")
 
-# === Helper: Create PDF report ===
-def create_pdf_report(text, filename="report.pdf"):
-    report_path = os.path.join(UPLOAD_DIR, filename)
-    doc = SimpleDocTemplate(report_path, pagesize=A4)
-    styles = getSampleStyleSheet()
-    content = [
-        Paragraph("Brain MRI AI Diagnostic Report", styles["Title"]),
-        Spacer(1, 0.2 * inch),
-        Paragraph(text, styles["BodyText"]),
-    ]
-    doc.build(content)
-    return report_path
+
+if STARTUP_MODE == "eager":
+    load_runtime()
+
+# Results of earlier analyses, keyed by upload hash + model version + preprocessing
+RESULT_CACHE = ResultCache(
+    max_entries=RESULT_CACHE_ENTRIES,
+    disk_dir=RESULT_CACHE_DIR,
+    max_disk_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024,
+) if RESULT_CACHE_ENABLED else None
+
+# Preprocessed uint8 slices per scan, so re-analyzing a scan skips decoding and CLAHE
+SLICE_STORE = SliceStore(
+    SLICE_STORE_DIR, max_bytes=SLICE_STORE_MAX_MB * 1024 * 1024,
+) if SLICE_STORE_ENABLED else None
+
+# Worker pools that keep blocking pipeline stages off the event loop.
+# Preprocessing workers get small OpenCV/torch thread pools so they don't
+# compete with the model's threads for the same cores.
+# (Thread workers are limited in load_runtime.)
+if PIPELINE_POOL == "process":
+    preprocess_init = dict(initializer=LazyFunction("modules.preprocessing", "configure_preprocessing"),
+                           initargs=(PREPROCESS_CV2_THREADS, PREPROCESS_TORCH_THREADS))
+else:
+    preprocess_init = {}
+
+PIPELINE = StagedExecutor(
+    cpu_workers=PIPELINE_CPU_WORKERS,
+    io_workers=PIPELINE_IO_WORKERS,
+    max_pending=PIPELINE_MAX_PENDING,
+    pool_kind=PIPELINE_POOL,
+    **preprocess_init,
+)
+
+# Per-stage latency/CPU/memory aggregates served at /metrics
+METRICS = StageMetrics()
+
+# Packed 3D tumor meshes, keyed by segmentation hash + extraction settings
+@functools.lru_cache(maxsize=None)
+def mesh_cache():
+    return mesh.MeshCache(MESH_CACHE_DIR, max_bytes=MESH_CACHE_MAX_MB * 1024 * 1024)
+
+# === Storage and database backends ===
+# Report/Grad-CAM files: Supabase Storage over a pooled HTTP client, or a local
+# folder. Rows: Supabase tables, or a local SQLite file. Missing Supabase
+# credentials only stop the app when Supabase was explicitly chosen, and then
+# at startup rather than on import.
+HAS_SUPABASE = bool(SUPABASE_URL and SUPABASE_KEY)
+STORAGE_KIND = STORAGE_BACKEND if STORAGE_BACKEND != "auto" else ("supabase" if HAS_SUPABASE else "local")
+DB_KIND = DB_BACKEND if DB_BACKEND != "auto" else ("supabase" if STORAGE_KIND == "supabase" else "sqlite")
+BACKEND_ERROR = None
+if "supabase" in (STORAGE_KIND, DB_KIND) and not HAS_SUPABASE:
+    BACKEND_ERROR = "❌ Missing SUPABASE_URL or SUPABASE_KEY in environment variables."
+elif not HAS_SUPABASE:
+    print(f"⚠️ No Supabase credentials: using local storage ({LOCAL_STORAGE_DIR}) and SQLite ({LOCAL_DB_PATH})")
+# Workers unpickle model server replies: no default secret (see model_server.check_authkey)
+if MODEL_SERVER_ADDRESSES and len(MODEL_SERVER_AUTHKEY) < 16:
+    BACKEND_ERROR = "❌ MODEL_SERVER_AUTHKEY must be set to the model server's secret (16+ bytes)."
+
+if STORAGE_KIND == "supabase" and HAS_SUPABASE:
+    STORAGE = SupabaseStorage(SUPABASE_URL, SUPABASE_KEY, max_connections=STORAGE_MAX_CONNECTIONS)
+else:
+    STORAGE = LocalStorage(LOCAL_STORAGE_DIR, base_url=LOCAL_STORAGE_URL or None)
+
+if DB_KIND == "supabase":
+    DATABASE = SupabaseDatabase(SUPABASE_URL, SUPABASE_KEY)
+else:
+    DATABASE = SQLiteDatabase(LOCAL_DB_PATH)
+
+# === Helper: Load and warm the model up in the background; /ready reports when done ===
+WARM_UP_TASK = None
+
+
+async def warm_up_model(retry_s=2.0):
+    global MODEL_VERSION
+    while True:
+        try:
+            await PIPELINE.run_thread(load_runtime)
+            SCHEDULER.start()
+            if MODEL_SERVER_ADDRESSES:
+                MODEL_VERSION = result_version(await SCHEDULER.wait_ready())
+            else:
+                await model_server.warm_up(SCHEDULER, MODEL, DEVICE)
+            MODEL_READY.set()
+            print(f"✅ Model ready ({MODEL_VERSION})")
+            return
+        except Exception as e:
+            print(f"⚠️ Model warm-up failed, retrying: {e}")
+            await asyncio.sleep(retry_s)
+
+
+def start_warm_up():
+    """Start warm_up_model once (at startup, or on the first request with MODEL_WARM_UP=0)."""
+    global WARM_UP_TASK
+    if WARM_UP_TASK is None and not MODEL_READY.is_set():
+        WARM_UP_TASK = asyncio.get_running_loop().create_task(warm_up_model())
+    return WARM_UP_TASK
+
+# === Helper: Grad-CAM overlay for the explained slice, encoded as PNG ===
+def render_gradcam(scan, activations=None, cam=None):
+    if cam is None:
+        # Activations captured during the batched pass → backward through the head only;
+        # without them (TorchScript/INT8, adaptive) reuse the preprocessed tensor
+        position = scan.explain_position
+        cam = visualization.explain_slice(MODEL, scan.slices[position:position + 1], activations, DEVICE)
+    overlay = visualization.overlay_heatmap_on_slice(scan.explain_slice, cam, bbox=scan.bbox)
+
+    ok, png = cv2.imencode(".png", overlay)
+    if not ok:
+        raise RuntimeError("❌ Could not encode Grad-CAM overlay as PNG.")
+    return png.tobytes()
+
+# === Helper: Grad-CAM of every analyzed slice → (H, W, D) NIfTI + PNG of the most salient slice ===
+def render_gradcam_volume(scan, explanation):
+    """
+    explanation: captured activations of every slice (local model, None if
+    not hookable) or the server's finished (cams, saliency).
+    """
+    if MODEL_SERVER_ADDRESSES:
+        if explanation is None:
+            raise RuntimeError("❌ The model server returned no Grad-CAM.")
+        cams, saliency = explanation
+    else:
+        cams, saliency = visualization.explain_volume(MODEL, scan.slices, explanation, DEVICE)
+
+    # The report shows the slice the model attends to most, not just the middle one
+    position = int(np.argmax(saliency))
+    scan.explain_at(position)
+    cam = cams[position] / (cams[position].max() + 1e-8)
+    volume = visualization.heatmap_volume(cams, scan.indices, scan.shape, bbox=scan.bbox)
+    return render_gradcam(scan, cam=cam), visualization.heatmap_to_nifti(volume, scan.affine)
+
+# === Helper: Adaptive (coarse-to-fine, early exit) prediction through the scheduler ===
+async def predict_adaptive(slices, stats):
+    selector = adaptive.AdaptiveSelector(len(slices), stride=ADAPTIVE_STRIDE, min_confidence=ADAPTIVE_MIN_CONFIDENCE,
+                                min_slices=ADAPTIVE_MIN_SLICES, batch_size=SCHEDULER_MAX_BATCH_SIZE)
+    cpu_s = 0.0
+    while (positions := selector.next_batch()) is not None:
+        batch_stats = {}
+        probs = await SCHEDULER.predict_slices(slices[positions], stats=batch_stats)
+        cpu_s += batch_stats.get("cpu_s", 0.0)
+        selector.update(positions, probs)
+    stats["cpu_s"] = cpu_s
+    return selector.result()
+
+# Uploads artifacts and writes DB rows in the background after /analyze responds
+PUBLISHER = ArtifactPublisher(
+    STORAGE,
+    DATABASE.insert,
+    run_io=PIPELINE.run_io,
+    retries=PUBLISH_RETRIES,
+    backoff_s=PUBLISH_RETRY_BACKOFF_MS / 1000,
+)
+
+
+# === Liveness check: the process is up (answers before the model is loaded and while analyses run) ===
+@app.get("/health")
+async def health():
+    return {"status": "ok", "pipeline_pending": PIPELINE.pending, "uptime_s": round(time.time() - STARTED_AT, 1),
+            "runtime_loaded": SCHEDULER is not None}
+
+
+# === Readiness check: 200 once the model (local or shared server) is warm ===
+@app.get("/ready")
+async def ready():
+    body = {"status": "ready" if MODEL_READY.is_set() else "warming_up", "model_version": MODEL_VERSION,
+            "storage": STORAGE_KIND, "database": DB_KIND}
+    if not MODEL_WARM_UP and WARM_UP_TASK is None and not MODEL_READY.is_set():
+        # Nothing is loading yet: take traffic, the first request loads the model
+        body["status"] = "ready"
+        body["model"] = "loads_on_first_request"
+    if MODEL_SERVER_ADDRESSES and SCHEDULER is not None:
+        body["model_servers"] = await SCHEDULER.ping()
+        if not SCHEDULER.ready:
+            body["status"] = "unavailable" if MODEL_READY.is_set() else "warming_up"
+    return JSONResponse(body, status_code=200 if body["status"] == "ready" else 503)
+
+
+async def wait_until_ready(timeout_s=MODEL_READY_TIMEOUT_S):
+    """Hold a request while the model loads and warms up; 503 if it takes too long."""
+    if MODEL_READY.is_set():
+        return
+    start_warm_up()
+    try:
+        await asyncio.wait_for(MODEL_READY.wait(), timeout_s)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Model is still warming up.", headers={"Retry-After": "5"})
+
+
+# === Prometheus metrics (per-stage timings plus pipeline gauges) ===
+@app.get("/metrics")
+async def metrics():
+    scheduler = SCHEDULER.metrics() if SCHEDULER is not None else {"queue_depth": 0, "avg_batch_fill": 0.0}
+    gauges = {
+        "pipeline_pending_requests": ("Requests currently in the /analyze pipeline.", PIPELINE.pending),
+        "scheduler_queue_depth": ("Scans waiting for or in inference batches.", scheduler["queue_depth"]),
+        "scheduler_avg_batch_fill": ("Average fraction of each inference batch used.", scheduler["avg_batch_fill"]),
+        "publish_in_flight": ("Background publishes still running.", PUBLISHER.in_flight),
+        "process_rss_bytes": ("Resident memory of the API process.", current_rss_bytes()),
+    }
+    return PlainTextResponse(METRICS.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+# === Scheduler metrics (queue depth, batch fill) ===
+@app.get("/scheduler/metrics")
+async def scheduler_metrics():
+    return JSONResponse(SCHEDULER.metrics() if SCHEDULER is not None else {"loaded": False})
+
+
+# === Status of a background publish (uploads + DB rows) ===
+@app.get("/publish/{job_id}")
+async def publish_status(job_id: str):
+    job = PUBLISHER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown publish job '{job_id}'.")
+    return JSONResponse(job.as_dict())
+
+
+# === Result cache statistics ===
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = RESULT_CACHE.stats() if RESULT_CACHE else {"enabled": False}
+    stats["slice_store"] = SLICE_STORE.stats() if SLICE_STORE else {"enabled": False}
+    return JSONResponse(stats)
+
+
+# === Helper: Response body for a finished (or cached) analysis ===
+def analysis_result(label, confidence, job, cached=False):
+    return {
+        "tumorDetected": label.lower() != "no tumor",
+        "confidence": round(confidence, 2),
+        "tumorType": label,
+        "report_pdf_url": job.urls.get("report_pdf_url"),
+        "gradcam_url": job.urls.get("gradcam_url"),
+        "heatmap_url": job.urls.get("heatmap_url"),
+        "cached": cached,
+        "job_id": job.job_id,
+        "publish_status": job.status,
+        "message": "✅ Analysis complete; report is being published."
+    }
 
 
 # === 🔥 Unified Analyze Endpoint ===
 @app.post("/analyze")
 async def analyze(file: UploadFile = File(...), patient_id: str = Form(...)):
     print(f"🧾 Received patient_id: {patient_id}")
+    await wait_until_ready()
 
     try:
-        # Step 1: Save uploaded file locally
-        filename = f"{uuid.uuid4()}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-
-        # Step 2: Load and preprocess MRI
-        volume = load_mri(file_path)
-        processed_slices = preprocess_volume(volume)
-
-        # Step 3: Predict tumor type
-        label, confidence = predict_scan(MODEL, processed_slices, device=DEVICE)
-
-        # Step 4: Generate Grad-CAM visualization
-        mid_index = volume.shape[-1] // 2
-        slice_2d = volume[:, :, mid_index]
-        input_tensor = preprocess_slice(slice_2d).unsqueeze(0).to(DEVICE)
-        cam = generate_gradcam(MODEL, input_tensor)
-        overlay = overlay_heatmap_on_slice(slice_2d, cam)
-
-        gradcam_filename = f"gradcam_{uuid.uuid4()}.png"
-        gradcam_path = os.path.join(UPLOAD_DIR, gradcam_filename)
-        cv2.imwrite(gradcam_path, overlay)
-
-        # Step 5: Create PDF report
-        report_text = generate_text_report(label, confidence)
-        report_filename = f"report_{uuid.uuid4()}.pdf"
-        report_path = create_pdf_report(report_text, report_filename)
-
-       # Step 6: Upload to Supabase Storage
-        try:
-            # Upload Report PDF
-            with open(report_path, "rb") as f:
-                supabase.storage.from_("reports").upload(
-                    path=report_filename,
-                    file=f,
-                    file_options={"cache-control": "3600", "upsert": "true"}
-                )
-            report_url = supabase.storage.from_("reports").get_public_url(report_filename)
-            os.remove(report_path)
-
-            # Upload Grad-CAM image
-            with open(gradcam_path, "rb") as f:
-                supabase.storage.from_("gradcam").upload(
-                    path=gradcam_filename,
-                    file=f,
-                    file_options={"cache-control": "3600", "upsert": "true"}
-                )
-            gradcam_url = supabase.storage.from_("gradcam").get_public_url(gradcam_filename)
-            os.remove(gradcam_path)
-
-            print(f"✅ Uploaded report: {report_url}")
-            print(f"✅ Uploaded gradcam: {gradcam_url}")
-
-        except Exception as upload_error:
-            print("⚠️ Upload to Supabase failed:", upload_error)
-            report_url = None
-            gradcam_url = None
-
-        # Step 7: Insert into analysis_results
-        analysis_result = supabase.table("analysis_results").insert({
+        async with PIPELINE.admit():
+            # Threads read the spooled upload stream directly, worker
+            # processes need the bytes pickled over (large studies are
+            # better sent through /uploads or /jobs, which pass a path)
+            if PIPELINE.pool_kind == "process":
+                source = await file.read()
+            else:
+                await file.seek(0)
+                source = file.file
+            result, _ = await run_analysis(source, file.filename, patient_id)
+            return JSONResponse(result)
+
+    except PipelineBusyError as e:
+        print("⚠️ /analyze rejected:", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        print("❌ Error in /analyze:", e)
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def run_analysis(source, filename: str, patient_id: str, progress=None, content_sha256: str = None):
+    """
+    The analysis pipeline as async stages: every blocking step runs on the
+    StagedExecutor pools so the event loop keeps serving other requests.
+
+    Shared by /analyze and the job queue. progress(stage), if given, is
+    called on the event loop as each stage starts (see modules/jobs.py).
+    Every stage is recorded in a Trace (logged as JSON, aggregated at
+    /metrics); the total becomes processing_time. content_sha256, when the
+    caller already hashed the upload (chunked uploads), skips the hash
+    stage. Returns (response body, PublishJob).
+    """
+    trace = Trace(filename=filename)
+    # Volumetric Grad-CAM needs every slice's activations, which adaptive scans don't compute
+    volumetric = GRADCAM_VOLUME and not ADAPTIVE_INFERENCE
+
+    def report(stage):
+        if progress is not None:
+            progress(stage)
+
+    def finish_trace(**context):
+        trace.context.update(context)
+        trace.log()
+        METRICS.observe_trace(trace)
+
+    # Step 1: Same scan already analyzed with this model and preprocessing?
+    cache_key = None
+    if content_sha256 is None and (RESULT_CACHE is not None or SLICE_STORE is not None):
+        content_sha256, span = await PIPELINE.run_io(run_traced, "hash", hash_source, source)
+        trace.add(span)
+    if RESULT_CACHE is not None:
+        cache_key = make_cache_key(content_sha256, MODEL_VERSION,
+                                   dict(preprocessing.preprocessing_params(crop=CROP_TO_FOREGROUND), gradcam_volume=volumetric))
+        cached = await PIPELINE.run_io(RESULT_CACHE.get, cache_key)
+        if cached is not None:
+            print(f"♻️ Cache hit for upload {content_sha256[:12]}")
+            # Link this patient to the stored analysis; no model work needed
+            report("publish")
+            job = PUBLISHER.submit(
+                report_row={"analysis_id": cached["analysis_id"], "patient_id": patient_id},
+                urls={"report_pdf_url": cached["report_pdf_url"], "gradcam_url": cached["gradcam_url"]},
+                extra_urls={"heatmap_url": cached.get("heatmap_url")},
+            )
+            finish_trace(cached=True, label=cached["label"])
+            return analysis_result(cached["label"], cached["confidence"], job, cached=True), job
+
+    # Step 2: Load (lazily) and preprocess MRI (CPU pool)
+    report("load")
+    on_loaded = None
+    if progress is not None and PIPELINE.pool_kind == "thread":
+        loop = asyncio.get_running_loop()
+        on_loaded = lambda: loop.call_soon_threadsafe(progress, "preprocess")
+    # Model servers take the compact uint8 slices; worker processes send
+    # them back too (a twelfth of the float batch to pickle) and the float
+    # batch is expanded here
+    uint8 = bool(MODEL_SERVER_ADDRESSES) or PIPELINE.pool_kind == "process"
+    scan = await PIPELINE.run_cpu(pipeline.prepare_scan, source, filename=filename, on_loaded=on_loaded,
+                                 crop=CROP_TO_FOREGROUND, keep_overlay_slices=volumetric,
+                                 slice_store=SLICE_STORE, content_sha256=content_sha256, uint8=uint8)
+    if on_loaded is None:
+        # Worker processes cannot call back; report the stage once they return
+        report("preprocess")
+    if uint8 and not MODEL_SERVER_ADDRESSES:
+        scan.slices = await PIPELINE.run_thread(preprocessing.uint8_input_to_tensor, scan.slices)
+    trace.add(*scan.spans)
+
+    # Step 3: Predict tumor type (batched with concurrent requests), capturing
+    # activations of the slice to explain (or of every slice) in the same pass
+    report("inference")
+    inference_stats = {}
+    with trace.stage("inference", cpu=False,
+                     tensor_bytes=scan.nbytes) as span:
+        if ADAPTIVE_INFERENCE:
+            # Only a subset of slices runs; Grad-CAM recomputes its slice instead
+            adaptive = await predict_adaptive(scan.slices, inference_stats)
+            label, confidence, explanation = adaptive.label, adaptive.confidence, None
+            slices_scored = adaptive.forward_passes
+        elif volumetric:
+            label, confidence, explanation = await SCHEDULER.predict_volume(scan.slices, stats=inference_stats)
+            slices_scored = len(scan)
+        else:
+            label, confidence, explanation = await SCHEDULER.predict(
+                scan.slices, explain_index=scan.explain_position, stats=inference_stats)
+            slices_scored = len(scan)
+    span.cpu_s = inference_stats.get("cpu_s")
+    span.slices = slices_scored
+
+    # Step 4: Grad-CAM PNG (plus the heatmap volume) and PDF report in memory (model thread pool)
+    report("explain")
+    report_text = report_module.generate_text_report(label, confidence)
+    if volumetric:
+        explain_job = PIPELINE.run_thread(run_traced, "explain", render_gradcam_volume, scan, explanation)
+    else:
+        # Local model: explanation holds captured activations. Model server: it
+        # is the finished heatmap (or missing, for adaptive scans)
+        activations, cam = explanation, None
+        if MODEL_SERVER_ADDRESSES:
+            position = scan.explain_position
+            activations = None
+            cam = explanation if explanation is not None else await SCHEDULER.explain(
+                scan.slices[position:position + 1])
+        explain_job = PIPELINE.run_thread(run_traced, "explain", render_gradcam, scan, activations, cam)
+    (explain_result, explain_span), (report_pdf, report_span) = await asyncio.gather(
+        explain_job,
+        PIPELINE.run_thread(run_traced, "report", report_module.create_pdf_report, report_text),
+    )
+    gradcam_png, heatmap_nii = explain_result if volumetric else (explain_result, None)
+    explain_span.slices = len(scan) if volumetric else 1
+    trace.add(explain_span, report_span)
+
+    # Step 5: Hand uploads and DB writes to the background publisher
+    report("publish")
+
+    processing_time = round(trace.elapsed_s, 3)
+
+    async def on_published(job):
+        publish_span = Span("publish")
+        publish_span.wall_s = time.time() - job.created_at
+        METRICS.observe(publish_span)
+
+        # Only fully published results are reused for repeated uploads
+        # (the cache writes to disk and evicts, so off the event loop)
+        if cache_key is not None and all(job.urls.values()):
+            await PIPELINE.run_io(RESULT_CACHE.put, cache_key, {
+                "label": label,
+                "confidence": confidence,
+                "analysis_id": job.analysis_id,
+                **job.urls,
+            })
+
+    job = PUBLISHER.submit(
+        artifacts=[
+            Artifact("reports", f"report_{uuid.uuid4()}.pdf", report_pdf, "application/pdf", "report_pdf_url"),
+            Artifact("gradcam", f"gradcam_{uuid.uuid4()}.png", gradcam_png, "image/png", "gradcam_url"),
+        ] + ([Artifact("gradcam", f"heatmap_{uuid.uuid4()}.nii.gz", heatmap_nii, "application/gzip",
+                       "heatmap_url", in_report=False)] if heatmap_nii is not None else []),
+        analysis_row={
             "scan_id": None,
             "tumor_detected": label.lower() != "no tumor",
             "confidence": confidence,
@@ -158,35 +622,249 @@ async def analyze(file: UploadFile = File(...), patient_id: str = Form(...)):
                 "Maintain a record of this report for clinical use."
             ],
             "ai_model": "DenseNet-121",
-            "processing_time": 0.0,
-            "slices_analyzed": len(processed_slices),
-        }).execute()
-
-        analysis_id = analysis_result.data[0]["id"]
-
-        # Step 8: Insert into reports table
-        report_insert = supabase.table("reports").insert({
-        "analysis_id": analysis_id,
-        "patient_id": patient_id,
-        "report_pdf_url": report_url,
-        "gradcam_url": gradcam_url  # ✅ new column
-    }).execute()
-
-        # Step 9: Clean up uploaded MRI file
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        # ✅ Step 10: Return to frontend
-        return JSONResponse({
-            "tumorDetected": label.lower() != "no tumor",
-            "confidence": round(confidence, 2),
-            "tumorType": label,
-            "report_pdf_url": report_url,
-            "gradcam_url": gradcam_url,
-            "message": "✅ Analysis complete and report generated successfully."
-        })
+            "processing_time": processing_time,
+            "slices_analyzed": slices_scored,
+        },
+        report_row={"patient_id": patient_id},
+        on_published=on_published,
+    )
+    finish_trace(cached=False, label=label, slices=len(scan), slices_scored=slices_scored,
+                 processing_time_s=processing_time)
+
+    # ✅ Step 6: Return to frontend — URLs are final, publishing finishes in the background
+    return analysis_result(label, confidence, job), job
+
+
+# === Job queue: large or batched studies processed in the background ===
+async def process_job_item(item, progress):
+    """Run one queued scan through run_analysis and wait until it is published."""
+    await wait_until_ready(timeout_s=None)
+    # The queued file keeps its extension: workers (threads or processes) open it by path
+    result, job = await run_analysis(item["path"], item["filename"], item["patient_id"], progress)
+
+    await job.finished.wait()
+    if job.status == "failed":
+        raise RuntimeError(f"Publishing failed: {job.error}")
+    if job.status == "partial":
+        return dict(result, publish_status=job.status, message=f"⚠️ Analysis complete; {job.error}.")
+    return dict(result, publish_status=job.status, message="✅ Analysis complete and report published.")
+
+
+JOB_STORE = JobStore(JOBS_DB, JOBS_DIR)
+JOB_RUNNER = JobRunner(JOB_STORE, process_job_item, run_io=PIPELINE.run_io,
+                       workers=JOB_WORKERS, poll_interval_s=JOB_POLL_MS / 1000)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(files: List[UploadFile] = File(...), patient_id: str = Form(None)):
+    uploads = []
+    for upload in files:
+        await upload.seek(0)
+        uploads.append((upload.filename, upload.file))
+    job_id = await PIPELINE.run_io(JOB_STORE.create_job, uploads, patient_id)
+    JOB_RUNNER.notify()
+    print(f"📥 Queued job {job_id} with {len(uploads)} scan(s)")
+    return {
+        "job_id": job_id,
+        "items": len(uploads),
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await PIPELINE.run_io(JOB_STORE.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'.")
+    return JSONResponse(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: a snapshot, then per-stage progress until the job finishes."""
+    queue = JOB_RUNNER.subscribe(job_id)
+    snapshot = await PIPELINE.run_io(JOB_STORE.get_job, job_id)
+    if snapshot is None:
+        JOB_RUNNER.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'.")
+
+    async def stream(snapshot):
+        try:
+            yield sse_event("snapshot", snapshot)
+            while snapshot["status"] not in ("done", "failed"):
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_event("progress", event)
+                if event["status"] in ("done", "failed"):
+                    snapshot = await PIPELINE.run_io(JOB_STORE.get_job, job_id)
+            yield sse_event("complete", snapshot)
+        finally:
+            JOB_RUNNER.unsubscribe(job_id, queue)
+
+    return StreamingResponse(stream(snapshot), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# === Resumable chunked uploads: POST /uploads, PUT chunks, POST .../analyze ===
+@functools.lru_cache(maxsize=None)
+def upload_store():
+    return uploads.UploadStore(UPLOADS_DIR, max_bytes=UPLOAD_MAX_MB * 1024 * 1024, ttl_s=UPLOAD_TTL_H * 3600)
+
 
+def upload_status(session):
+    return dict(session.as_dict(), chunk_size=UPLOAD_CHUNK_MAX_MB * 1024 * 1024,
+                upload_url=f"/uploads/{session.upload_id}")
+
+
+def finish_upload(session):
+    """Flush and close a completed upload (blocking: run it in the I/O pool)."""
+    with session.lock:
+        return session.finish()
+
+
+@app.post("/uploads", status_code=201)
+async def create_upload(filename: str = Form(...), size: int = Form(None)):
+    """
+    Start a resumable upload. Send the file as consecutive chunks with
+    PUT /uploads/{id}?offset=<bytes received so far>; after a dropped
+    connection GET /uploads/{id} tells where to resume.
+    """
+    await PIPELINE.run_io(upload_store().purge)
+    try:
+        session = await PIPELINE.run_io(upload_store().create, filename, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return upload_status(session)
+
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    session = await PIPELINE.run_io(upload_store().get, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upload '{upload_id}'.")
+    return upload_status(session)
+
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, offset: int, request: Request):
+    """
+    Append one chunk. The header is checked as soon as enough bytes are in
+    (bad files are rejected with 415 on the first chunk), the SHA-256 is
+    updated and .nii.gz data is decompressed as it arrives.
+    """
+    limit = UPLOAD_CHUNK_MAX_MB * 1024 * 1024
+    body = bytearray()
+    async for piece in request.stream():
+        body += piece
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {UPLOAD_CHUNK_MAX_MB} MB.")
+    try:
+        session = await PIPELINE.run_io(upload_store().append, upload_id, offset, bytes(body))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown upload '{upload_id}'.")
+    except uploads.UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except ValueError as e:
+        print(f"⚠️ Upload {upload_id} rejected: {e}")
+        raise HTTPException(status_code=415, detail=str(e))
+    return upload_status(session)
+
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str):
+    await PIPELINE.run_io(upload_store().discard, upload_id)
+
+
+@app.post("/uploads/{upload_id}/analyze")
+async def analyze_upload(upload_id: str, patient_id: str = Form(...)):
+    """Run /analyze on a completed upload; the stored file is removed afterwards."""
+    print(f"🧾 Received patient_id: {patient_id} (upload {upload_id})")
+    session = await PIPELINE.run_io(upload_store().get, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upload '{upload_id}'.")
+    try:
+        path = await PIPELINE.run_io(finish_upload, session)
+    except uploads.UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete: {e}",
+                            headers={"Upload-Offset": str(e.offset)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await wait_until_ready()
+
+    try:
+        async with PIPELINE.admit():
+            # Already on disk (and decompressed): workers open it by path, no bytes are copied
+            result, _ = await run_analysis(path, session.filename, patient_id,
+                                           content_sha256=session.sha256.hexdigest())
+    except PipelineBusyError as e:
+        print("⚠️ /uploads analyze rejected:", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
-        print("❌ Error in /analyze:", e)
+        print("❌ Error in /uploads analyze:", e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    await PIPELINE.run_io(upload_store().discard, upload_id)
+    return JSONResponse(result)
+
+
+# === 3D tumor meshes: isosurfaces per label, several levels of detail ===
+def mesh_response(manifest):
+    """Manifest with a download URL per label and level (coarse levels first)."""
+    body = dict(manifest)
+    body["labels"] = [
+        dict(label, levels=[dict(level, url=f"/meshes/{manifest['mesh_id']}/{label['label']}/{level['level']}")
+                            for level in label["levels"]])
+        for label in manifest["labels"]
+    ]
+    return JSONResponse(body)
+
+
+@app.post("/meshes")
+async def create_meshes(file: UploadFile = File(...)):
+    """
+    Upload a segmentation (.nii/.nii.gz or zipped DICOM) and get the mesh
+    manifest. Meshes are built once per segmentation and served from cache.
+    """
+    try:
+        async with PIPELINE.admit():
+            if PIPELINE.pool_kind == "process":
+                source = await file.read()
+            else:
+                await file.seek(0)
+                source = file.file
+            content_sha256 = await PIPELINE.run_io(hash_source, source)
+            key = mesh.mesh_key(content_sha256, {"downsample": MESH_DOWNSAMPLE, "lod_cells": MESH_LOD_CELLS})
+
+            manifest = await PIPELINE.run_io(mesh_cache().manifest, key)
+            if manifest is None:
+                manifest = await PIPELINE.run_cpu(mesh.build_and_cache_meshes, source, file.filename, key, MESH_CACHE_DIR,
+                                                  MESH_DOWNSAMPLE, MESH_LOD_CELLS, mesh_cache().max_bytes)
+                print(f"🧊 Built meshes {key[:12]} for {len(manifest['labels'])} label(s)")
+            return mesh_response(manifest)
+
+    except PipelineBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/meshes/{mesh_id}")
+async def get_meshes(mesh_id: str):
+    manifest = await PIPELINE.run_io(mesh_cache().manifest, mesh_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Unknown mesh '{mesh_id}'.")
+    return mesh_response(manifest)
+
+
+@app.get("/meshes/{mesh_id}/{label}/{level}")
+async def get_mesh(mesh_id: str, label: int, level: int):
+    """One packed mesh (see modules/mesh.py pack_mesh); content never changes for a given id."""
+    data = await PIPELINE.run_io(mesh_cache().read, mesh_id, label, level)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"No mesh for label {label}, level {level}.")
+    return Response(data, media_type="application/octet-stream",
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
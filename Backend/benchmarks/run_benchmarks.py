@@ -0,0 +1,268 @@
+# benchmarks/run_benchmarks.py
+"""
+Per-stage benchmark of the analysis pipeline on synthetic scans.
+
+Every stage is timed separately (latency percentiles, throughput, peak RSS
+while it runs); results are written as JSON and compared with a stored
+baseline so capacity regressions show up before deployment.
+
+Usage (from Backend/):
+    python -m benchmarks.run_benchmarks --shape 240 240 155 --repeats 10
+    python -m benchmarks.run_benchmarks --save-baseline          # record benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --fail-on-regression     # exit 1 if slower than the baseline
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+
+from benchmarks.synthetic import write_inputs
+from modules.inference import load_model, predict_scan
+from modules.input_loader import load_mri
+from modules.preprocessing import extract_slices, preprocess_volume, preprocess_volume_batch
+from modules.report import create_pdf_report, generate_text_report
+from modules.tracing import current_rss_bytes
+from modules.visualization import generate_gradcam, overlay_heatmap_on_slice
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+FORMATS = ("nifti", "nifti_gz", "dicom")
+STAGES = ("load_mri", "extract_slices", "preprocess_volume", "preprocess_volume_batch", "preprocess_volume_crop",
+          "predict_scan", "generate_gradcam", "overlay_heatmap_on_slice", "create_pdf_report")
+
+
+# === Memory ===
+class RssSampler:
+    """Samples RSS in a background thread and keeps the peak seen while active."""
+
+    def __init__(self, interval_s=0.002):
+        self.interval_s = interval_s
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+# === Timing ===
+def summarize(times_s, units, unit):
+    """Latency percentiles (ms) and throughput (units per second) for one stage."""
+    times_ms = np.asarray(times_s) * 1000.0
+    mean_s = float(np.mean(times_s))
+    return {
+        "repeats": len(times_s),
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        "mean_ms": mean_s * 1000.0,
+        "min_ms": float(np.min(times_ms)),
+        "units": units,
+        "unit": unit,
+        "throughput_per_s": units / mean_s if mean_s > 0 else 0.0,
+    }
+
+
+def time_stage(fn, repeats=5, warmup=1):
+    """Run fn warmup + repeats times; returns (last result, per-call seconds, RssSampler)."""
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    times = []
+    with RssSampler() as rss:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - start)
+    return result, times, rss
+
+
+# === Suite ===
+def run_suite(shape=(240, 240, 155), formats=FORMATS, stages=STAGES, repeats=5, warmup=1, batch_size=None,
+              device="cpu", workdir=None):
+    """Generate synthetic inputs, time each stage and return the results dict."""
+    results = {}
+
+    def record(name, fn, units, unit):
+        output, times, rss = time_stage(fn, repeats, warmup)
+        results[name] = dict(summarize(times, units, unit), peak_rss_mb=rss.peak / 2 ** 20,
+                             rss_growth_mb=(rss.peak - rss.start) / 2 ** 20)
+        stats = results[name]
+        print(f"⏱️ {name:<34} p50 {stats['p50_ms']:9.2f} ms   p95 {stats['p95_ms']:9.2f} ms   "
+              f"{stats['throughput_per_s']:9.1f} {unit}/s   peak RSS {stats['peak_rss_mb']:8.1f} MB")
+        return output
+
+    with tempfile.TemporaryDirectory(dir=workdir) as folder:
+        print(f"🧪 Writing synthetic {shape} scans ({', '.join(formats)})")
+        paths = write_inputs(folder, shape, formats)
+        depth = shape[-1]
+
+        volume = None
+        if "load_mri" in stages:
+            for fmt, path in paths.items():
+                volume = record(f"load_mri[{fmt}]", lambda path=path: load_mri(path), depth, "slices")
+        if volume is None:
+            volume = load_mri(next(iter(paths.values())))
+
+        if "extract_slices" in stages:
+            record("extract_slices", lambda: extract_slices(volume), depth, "slices")
+
+        slices = preprocess_volume_batch(volume)
+        num = len(slices)
+        if "preprocess_volume" in stages:
+            record("preprocess_volume", lambda: preprocess_volume(volume), num, "slices")
+        if "preprocess_volume_batch" in stages:
+            record("preprocess_volume_batch", lambda: preprocess_volume_batch(volume), num, "slices")
+        if "preprocess_volume_crop" in stages:
+            record("preprocess_volume_crop", lambda: preprocess_volume_batch(volume, crop=True), num, "slices")
+
+        needs_model = {"predict_scan", "generate_gradcam", "overlay_heatmap_on_slice", "create_pdf_report"}
+        if needs_model & set(stages):
+            model = load_model(device=device)
+            label, confidence = predict_scan(model, slices, device=device, batch_size=batch_size)
+            mid = num // 2
+            if "predict_scan" in stages:
+                record("predict_scan", lambda: predict_scan(model, slices, device=device, batch_size=batch_size),
+                       num, "slices")
+
+            cam = generate_gradcam(model, slices[mid:mid + 1].to(device))
+            if "generate_gradcam" in stages:
+                record("generate_gradcam", lambda: generate_gradcam(model, slices[mid:mid + 1].to(device)), 1, "slices")
+
+            raw_slice = np.asarray(volume[:, :, depth // 2], dtype=np.float32)
+            if "overlay_heatmap_on_slice" in stages:
+                record("overlay_heatmap_on_slice", lambda: overlay_heatmap_on_slice(raw_slice, cam), 1, "images")
+            if "create_pdf_report" in stages:
+                text = generate_text_report(label, confidence)
+                record("create_pdf_report", lambda: create_pdf_report(text), 1, "reports")
+
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+# === Baseline comparison ===
+# Smallest absolute change that can count as a regression (sub-ms stages are noisy)
+MIN_DELTA = {"p50_ms": 1.0, "peak_rss_mb": 16.0}
+
+
+def compare(current, baseline, tolerance=0.15):
+    """
+    Compare stage results with a baseline run. A stage regresses when its p50
+    latency or peak RSS exceeds the baseline by more than tolerance (and by
+    more than MIN_DELTA). Returns rows of
+    (stage, metric, baseline, current, ratio, regressed).
+    """
+    rows = []
+    for stage, stats in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None:
+            continue
+        for metric, min_delta in MIN_DELTA.items():
+            if not base.get(metric):
+                continue
+            ratio = stats[metric] / base[metric]
+            regressed = ratio > 1 + tolerance and stats[metric] - base[metric] > min_delta
+            rows.append((stage, metric, base[metric], stats[metric], ratio, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on synthetic scans.")
+    parser.add_argument("--shape", type=int, nargs=3, default=(240, 240, 155), metavar=("H", "W", "D"))
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, help="predict_scan micro-batch size")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--output", help="Results JSON (default: benchmarks/results/bench-<time>.json)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown before flagging (0.15 = 15%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    stages = run_suite(tuple(args.shape), args.formats, args.stages, args.repeats, args.warmup,
+                       args.batch_size, device=device)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": dict(environment(), device=device),
+        "config": {"shape": list(args.shape), "repeats": args.repeats, "warmup": args.warmup,
+                   "batch_size": args.batch_size},
+        "stages": stages,
+        "max_rss_mb": current_rss_bytes() / 2 ** 20,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ No baseline at {args.baseline}; run with --save-baseline to record one.")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config", {}).get("shape") != report["config"]["shape"]:
+        print(f"⚠️ Baseline used shape {baseline.get('config', {}).get('shape')}; comparison is not like for like.")
+
+    rows = compare(report, baseline, args.tolerance)
+    print(f"\n{'stage':<34}{'metric':<13}{'baseline':>11}{'current':>11}{'ratio':>8}")
+    for stage, metric, base, current, ratio, regressed in rows:
+        flag = "  ❌ regression" if regressed else ""
+        print(f"{stage:<34}{metric:<13}{base:>11.2f}{current:>11.2f}{ratio:>8.2f}{flag}")
+
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f"\n❌ {len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        if args.fail_on_regression:
+            raise SystemExit(1)
+    else:
+        print("\n✅ No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/synthetic.py
+import os
+
+import nibabel as nib
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+
+def synthetic_volume(shape=(240, 240, 155), seed=0, lesion=True):
+    """
+    MRI-like (H, W, D) volume: a bright ellipsoidal "brain" with noise on a
+    dark background, optionally with a brighter spherical lesion.
+    """
+    rng = np.random.default_rng(seed)
+    h, w, d = shape
+    yy, xx, zz = np.meshgrid(np.linspace(-1, 1, h, dtype=np.float32), np.linspace(-1, 1, w, dtype=np.float32),
+                             np.linspace(-1, 1, d, dtype=np.float32), indexing="ij")
+    volume = ((yy ** 2 / 0.7 + xx ** 2 / 0.6 + zz ** 2 / 0.9) < 1) * np.float32(400.0)
+    if lesion:
+        volume += (((yy - 0.2) ** 2 + (xx + 0.15) ** 2 + zz ** 2) < 0.04) * np.float32(300.0)
+    volume += rng.normal(0, 20, shape).astype(np.float32)
+    return np.clip(volume, 0, None).astype(np.float32)
+
+
+def write_nifti(path: str, volume: np.ndarray):
+    """Save as .nii or .nii.gz (by extension) with an identity affine."""
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), path)
+    return path
+
+
+def write_dicom_series(folder: str, volume: np.ndarray):
+    """
+    Save an (H, W, D) volume as one single-frame MR DICOM file per slice
+    (uint16 with rescale slope/intercept, positions along z).
+    """
+    os.makedirs(folder, exist_ok=True)
+    slope = max(float(volume.max()) / 65535.0, 1e-3)
+    pixels = np.clip(np.round(volume / slope), 0, 65535).astype(np.uint16)
+    series_uid = generate_uid()
+
+    for k in range(volume.shape[-1]):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = "MR"
+        ds.InstanceNumber = k + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(k)]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.RescaleSlope = slope
+        ds.RescaleIntercept = 0.0
+        ds.Rows, ds.Columns = pixels.shape[:2]
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.PixelData = np.ascontiguousarray(pixels[:, :, k]).tobytes()
+        ds.save_as(os.path.join(folder, f"slice_{k:04d}.dcm"), enforce_file_format=True)
+    return folder
+
+
+def write_inputs(folder: str, shape, formats=("nifti", "nifti_gz", "dicom"), seed=0):
+    """Write one synthetic scan per format into folder; returns {format: path}."""
+    os.makedirs(folder, exist_ok=True)
+    volume = synthetic_volume(shape, seed=seed)
+    writers = {
+        "nifti": lambda: write_nifti(os.path.join(folder, "scan.nii"), volume),
+        "nifti_gz": lambda: write_nifti(os.path.join(folder, "scan.nii.gz"), volume),
+        "dicom": lambda: write_dicom_series(os.path.join(folder, "dicom"), volume),
+    }
+    return {fmt: writers[fmt]() for fmt in formats}
@@ -0,0 +1,154 @@
+# modules/adaptive.py
+import torch
+import torch.nn.functional as F
+
+from modules.inference import ScanAccumulator
+
+TUMOR_CLASS = 1
+
+
+class AdaptiveResult:
+    """Outcome of an adaptive scan: the prediction plus how much work it took."""
+
+    def __init__(self, label, confidence, scored, num_slices, batches, exited_early):
+        self.label = label
+        self.confidence = confidence
+        self.scored = scored
+        self.num_slices = num_slices
+        self.batches = batches
+        self.exited_early = exited_early
+
+    @property
+    def forward_passes(self):
+        """Slices that went through the model."""
+        return len(self.scored)
+
+    @property
+    def savings(self):
+        """Fraction of slice forward passes skipped compared with scoring every slice."""
+        return 1.0 - self.forward_passes / self.num_slices if self.num_slices else 0.0
+
+    def as_dict(self):
+        return {"label": self.label, "confidence": self.confidence, "forward_passes": self.forward_passes,
+                "num_slices": self.num_slices, "batches": self.batches, "exited_early": self.exited_early,
+                "savings": self.savings}
+
+
+class AdaptiveSelector:
+    """
+    Coarse-to-fine choice of which preprocessed slices to run.
+
+    1. Coarse: every `stride`-th slice (centred in each block of `stride`).
+    2. Fine: unscored neighbours (within stride - 1) of slices whose tumor
+       probability is at least tumor_threshold, most suspicious first.
+    3. Fallback: if the scan is still not confident, the remaining slices,
+       so an unclear scan ends with exactly the predict_scan result.
+
+    After every batch the confidence-weighted result (same weighting as
+    predict_scan) is checked; once at least min_slices are scored and the
+    confidence reaches min_confidence (%), scanning stops.
+
+    Drive it with next_batch() → model → update() until next_batch() returns
+    None; it never touches the model itself, so the same logic runs behind
+    the shared inference scheduler and in offline tools.
+    """
+
+    def __init__(self, num_slices, stride=4, min_confidence=90.0, min_slices=6, tumor_threshold=0.5,
+                 batch_size=16, exhaustive_fallback=True):
+        if num_slices <= 0:
+            raise ValueError("❌ No preprocessed slices found for prediction.")
+        self.num_slices = num_slices
+        self.stride = max(1, stride)
+        self.min_confidence = min_confidence
+        self.min_slices = min(min_slices, num_slices)
+        self.tumor_threshold = tumor_threshold
+        self.batch_size = max(1, batch_size)
+        self.exhaustive_fallback = exhaustive_fallback
+
+        self.accumulator = ScanAccumulator()
+        self.tumor_prob = {}  # position → tumor probability
+        self.batches = 0
+        self.exited_early = False
+        self._done = False
+
+        offset = min(self.stride // 2, num_slices - 1)
+        coarse = list(range(offset, num_slices, self.stride))
+        # Short scans: make sure the coarse pass alone can satisfy min_slices
+        if len(coarse) < self.min_slices:
+            extra = [p for p in range(num_slices) if p not in set(coarse)]
+            coarse = sorted(coarse + extra[:self.min_slices - len(coarse)])
+        self._coarse = coarse
+
+    # === Driving ===
+    def next_batch(self):
+        """Positions to score next, or None when the scan is finished."""
+        if self._done:
+            return None
+
+        coarse = [p for p in self._coarse if p not in self.tumor_prob]
+        if coarse:
+            return coarse[:self.batch_size]
+
+        refine = self._suspicious_neighbours()
+        if refine:
+            return refine[:self.batch_size]
+
+        remaining = [p for p in range(self.num_slices) if p not in self.tumor_prob]
+        if remaining and self.exhaustive_fallback:
+            return remaining[:self.batch_size]
+
+        self._done = True
+        return None
+
+    def update(self, positions, probs: torch.Tensor):
+        """Record the (B, C) softmax probabilities of the slices at positions."""
+        probs = probs.detach().cpu()
+        self.accumulator.update(probs)
+        for position, row in zip(positions, probs):
+            self.tumor_prob[int(position)] = float(row[TUMOR_CLASS])
+        self.batches += 1
+
+        if len(self.tumor_prob) == self.num_slices:
+            self._done = True
+        elif len(self.tumor_prob) >= self.min_slices and self.accumulator.result()[1] >= self.min_confidence:
+            self._done = True
+            self.exited_early = True
+
+    def result(self):
+        label, confidence = self.accumulator.result()
+        return AdaptiveResult(label, confidence, sorted(self.tumor_prob), self.num_slices, self.batches,
+                              self.exited_early)
+
+    # === Refinement ===
+    def _suspicious_neighbours(self):
+        seeds = sorted((p for p, prob in self.tumor_prob.items() if prob >= self.tumor_threshold),
+                       key=lambda p: -self.tumor_prob[p])
+        picked = []
+        for seed in seeds:
+            for delta in range(1, self.stride):
+                for position in (seed - delta, seed + delta):
+                    if 0 <= position < self.num_slices and position not in self.tumor_prob and position not in picked:
+                        picked.append(position)
+        return picked
+
+
+def adaptive_predict(model, processed_slices, device="cpu", stride=4, min_confidence=90.0, min_slices=6,
+                     tumor_threshold=0.5, batch_size=16, exhaustive_fallback=True):
+    """
+    predict_scan with coarse-to-fine slice selection and early exit (see
+    AdaptiveSelector). processed_slices is an (N, 3, 224, 224) tensor or a
+    list of (3, 224, 224) tensors. Returns an AdaptiveResult.
+    """
+    model.eval()
+    selector = AdaptiveSelector(len(processed_slices), stride, min_confidence, min_slices, tumor_threshold,
+                                batch_size, exhaustive_fallback)
+
+    with torch.no_grad():
+        while (positions := selector.next_batch()) is not None:
+            if isinstance(processed_slices, torch.Tensor):
+                batch = processed_slices[positions].to(device)
+            else:
+                batch = torch.stack([processed_slices[p] for p in positions]).to(device)
+            selector.update(positions, F.softmax(model(batch), dim=1))
+
+    return selector.result()
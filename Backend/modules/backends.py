@@ -0,0 +1,140 @@
+# modules/backends.py
+import copy
+import os
+
+import torch
+
+from modules.inference import load_model
+from modules.pipeline import prepare_scan
+from utils.config import CROP_TO_FOREGROUND
+
+BACKENDS = ("fp32", "channels_last", "int8_dynamic", "int8_static")
+
+# Inputs load_mri understands, for calibration folders
+SCAN_EXTENSIONS = (".nii", ".nii.gz", ".zip")
+
+
+class ChannelsLastModel(torch.nn.Module):
+    """Runs a channels_last copy of a model and converts inputs on the way in."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def _select_quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized CPU engine available in this torch build.")
+
+
+def find_scans(folder: str):
+    """NIfTI files, zipped series and DICOM folders directly inside folder."""
+    scans = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.endswith(SCAN_EXTENSIONS):
+            scans.append(path)
+        elif os.path.isdir(path) and any(f.endswith(".dcm") for f in os.listdir(path)):
+            scans.append(path)
+    return scans
+
+
+def calibration_batches(folder: str, max_scans: int = 8, batch_size: int = 16):
+    """Yield preprocessed (B, 3, 224, 224) batches from sample volumes in folder."""
+    scans = find_scans(folder)[:max_scans]
+    if not scans:
+        raise ValueError(f"No calibration scans found in {folder}.")
+    for path in scans:
+        slices = prepare_scan(path, crop=CROP_TO_FOREGROUND).slices
+        for start in range(0, len(slices), batch_size):
+            yield slices[start:start + batch_size]
+
+
+def quantize_dynamic_int8(model):
+    """
+    Post-training dynamic INT8 quantization.
+    For DenseNet-121 only the classifier Linear layer is quantized (dynamic
+    quantization does not cover convolutions), so the speed-up is small.
+    """
+    _select_quantized_engine()
+    from torch.ao.quantization import quantize_dynamic
+    return quantize_dynamic(copy.deepcopy(model).cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static_int8(model, batches):
+    """
+    Post-training static INT8 quantization (FX graph mode), calibrated on
+    the given preprocessed batches. Quantizes convolutions as well, which
+    is where DenseNet-121 spends its time. CPU only.
+    """
+    engine = _select_quantized_engine()
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    float_model = copy.deepcopy(model).cpu().eval()
+    example = (torch.zeros(1, 3, 224, 224),)
+    prepared = prepare_fx(float_model, get_default_qconfig_mapping(engine), example)
+
+    seen = 0
+    with torch.no_grad():
+        for batch in batches:
+            prepared(batch)
+            seen += len(batch)
+    if seen == 0:
+        raise ValueError("Static quantization needs at least one calibration batch.")
+
+    return convert_fx(prepared).eval()
+
+
+def prepare_backend(model, backend: str = "fp32", calibration_dir: str = None, device="cpu"):
+    """
+    Return a model for the selected inference backend. The input model is
+    left untouched (fp32 eager stays available for Grad-CAM).
+
+    Args:
+        backend: "fp32" (eager, unchanged), "channels_last",
+            "int8_dynamic" or "int8_static" (CPU only)
+        calibration_dir: folder of sample scans for "int8_static"
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'. Choose from {BACKENDS}.")
+
+    if backend == "fp32":
+        return model
+    if backend == "channels_last":
+        return ChannelsLastModel(copy.deepcopy(model)).to(device).eval()
+
+    if device != "cpu":
+        raise ValueError(f"Backend '{backend}' runs on CPU only.")
+    if backend == "int8_dynamic":
+        return quantize_dynamic_int8(model)
+    if not calibration_dir:
+        raise ValueError("Backend 'int8_static' needs a calibration folder (QUANT_CALIBRATION_DIR).")
+    return quantize_static_int8(model, calibration_batches(calibration_dir))
+
+
+def load_serving_models(device="cpu", backend: str = "fp32", model_format: str = "eager", calibration_dir: str = None):
+    """
+    Everything a serving process needs: the fp32 eager model (Grad-CAM), the
+    model for batched forward passes (optional TorchScript copy or a
+    channels_last / INT8 backend), its ModelInfo and the version string
+    that identifies results in the result cache.
+
+    Returns:
+        tuple: (model, inference_model, info, model_version)
+    """
+    model, info = load_model(device=device, with_info=True)
+    if model_format == "torchscript":
+        if backend != "fp32":
+            raise RuntimeError("❌ MODEL_FORMAT=torchscript only supports INFERENCE_BACKEND=fp32.")
+        inference_model = load_model(device=device, scripted=True)
+    else:
+        inference_model = prepare_backend(model, backend, calibration_dir, device=device)
+    return model, inference_model, info, f"{info.version}:{backend}:{model_format}"
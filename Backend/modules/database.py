@@ -0,0 +1,95 @@
+# modules/database.py
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+_TABLE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class SupabaseDatabase:
+    """
+    Rows in Supabase tables. The supabase client (and its dependencies) is
+    imported and created on the first insert, not when the app starts.
+    """
+
+    def __init__(self, url: str, key: str):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _table(self, table: str):
+        with self._lock:
+            if self._client is None:
+                from supabase import create_client
+                self._client = create_client(self.url, self.key)
+        return self._client.table(table)
+
+    def insert(self, table: str, row: dict):
+        """
+        Insert one row and return its id. A row with an id that already
+        exists is ignored, so retrying an insert never duplicates it.
+        """
+        if "id" not in row:
+            result = self._table(table).insert(row).execute()
+            return result.data[0]["id"] if result.data else None
+        self._table(table).upsert(row, on_conflict="id", ignore_duplicates=True).execute()
+        return row["id"]
+
+    def close(self):
+        pass
+
+
+class SQLiteDatabase:
+    """
+    Stand-in for the Supabase tables in one SQLite file, for development
+    and tests. Each table is created on first use; rows are stored as JSON
+    next to their id (the row's own "id", or a new uuid4), so any row shape
+    the app writes fits.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._tables = set()
+
+    def _ensure_table(self, table: str):
+        if not _TABLE.fullmatch(table):
+            raise ValueError(f"Invalid table name '{table}'.")
+        if table not in self._tables:
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ('
+                             "id TEXT PRIMARY KEY, created_at REAL NOT NULL, data TEXT NOT NULL)")
+            self._tables.add(table)
+
+    def insert(self, table: str, row: dict):
+        """Insert one row and return its id; a row whose id already exists is ignored."""
+        row = dict(row)
+        row_id = str(row.pop("id", None) or uuid.uuid4())
+        with self._lock:
+            self._ensure_table(table)
+            self._db.execute(f'INSERT OR IGNORE INTO "{table}" (id, created_at, data) VALUES (?, ?, ?)',
+                             (row_id, time.time(), json.dumps(row, default=str)))
+        return row_id
+
+    def get(self, table: str, row_id: int):
+        with self._lock:
+            self._ensure_table(table)
+            found = self._db.execute(f'SELECT id, data FROM "{table}" WHERE id = ?', (str(row_id),)).fetchone()
+        return dict(json.loads(found[1]), id=found[0]) if found else None
+
+    def rows(self, table: str):
+        """Every row of table, oldest first."""
+        with self._lock:
+            self._ensure_table(table)
+            found = self._db.execute(f'SELECT id, data FROM "{table}" ORDER BY rowid').fetchall()
+        return [dict(json.loads(data), id=row_id) for row_id, data in found]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
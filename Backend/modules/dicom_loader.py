@@ -0,0 +1,139 @@
+# modules/dicom_loader.py
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pydicom
+
+from utils.config import DICOM_DECODE_WORKERS
+
+# DICOM Part 10 files carry "DICM" after a 128-byte preamble
+DICOM_MAGIC_OFFSET = 128
+DICOM_MAGIC = b"DICM"
+
+# Values larger than this (in practice PixelData) are skipped by the header
+# pass and read from the source only when the slice is decoded
+DEFER_SIZE_BYTES = 1024
+
+
+def is_dicom_bytes(head: bytes) -> bool:
+    return head[DICOM_MAGIC_OFFSET:DICOM_MAGIC_OFFSET + 4] == DICOM_MAGIC
+
+
+def _open(source):
+    """pydicom accepts paths directly; in-memory members get a fresh stream per read."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+
+def read_header(source):
+    """Parse one slice with its pixel data deferred (not read until decoded)."""
+    return pydicom.dcmread(_open(source), defer_size=DEFER_SIZE_BYTES)
+
+
+def slice_position(header, fallback: int) -> float:
+    """
+    Position of a slice along the series normal.
+
+    Uses ImagePositionPatient projected on the normal of ImageOrientationPatient
+    when both are present, then InstanceNumber, then the file order.
+    """
+    position = getattr(header, "ImagePositionPatient", None)
+    orientation = getattr(header, "ImageOrientationPatient", None)
+    if position is not None and orientation is not None and len(orientation) == 6:
+        row = np.asarray(orientation[:3], dtype=np.float64)
+        col = np.asarray(orientation[3:], dtype=np.float64)
+        return float(np.dot(np.cross(row, col), np.asarray(position, dtype=np.float64)))
+
+    instance = getattr(header, "InstanceNumber", None)
+    if instance is not None:
+        return float(instance)
+    return float(fallback)
+
+
+def order_series(headers):
+    """Return the indices of headers sorted by slice position."""
+    positions = [slice_position(h, i) for i, h in enumerate(headers)]
+    return sorted(range(len(headers)), key=lambda i: (positions[i], i))
+
+
+def _decode_into(volume: np.ndarray, depth_index: int, dataset, slope: float, intercept: float):
+    """
+    Decode one slice's pixel data straight into volume[:, :, depth_index].
+    Only the deferred PixelData element is read; the rest of the dataset was
+    parsed by read_header. The raw and decoded pixels are dropped afterwards.
+    """
+    pixels = dataset.pixel_array
+    if pixels.shape != volume.shape[:2]:
+        raise ValueError(f"Slice shape {pixels.shape} does not match series shape {volume.shape[:2]}.")
+    target = volume[:, :, depth_index]
+    np.multiply(pixels, slope, out=target, casting="unsafe")
+    target += intercept
+    del dataset.PixelData
+
+
+def load_dicom_sources(sources, max_workers: int = None) -> np.ndarray:
+    """
+    Load one DICOM series from a list of sources (paths or in-memory bytes)
+    into a float32 (H, W, D) array.
+
+    Pass 1 parses every slice once with PixelData deferred and orders slices
+    by position; pass 2 reads and decodes only the pixel data on a thread
+    pool, applying each slice's RescaleSlope / RescaleIntercept, directly
+    into a preallocated array.
+    """
+    if not sources:
+        raise ValueError("No DICOM slices found.")
+    max_workers = max_workers or DICOM_DECODE_WORKERS
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dicom") as pool:
+        # Pass 1: headers, pixel data deferred
+        headers = list(pool.map(read_header, sources))
+        order = order_series(headers)
+
+        first = headers[order[0]]
+        volume = np.empty((int(first.Rows), int(first.Columns), len(order)), dtype=np.float32)
+
+        # Pass 2: pixel data of the parsed datasets, each slice written into its depth position
+        futures = []
+        for depth_index, i in enumerate(order):
+            slope = float(getattr(headers[i], "RescaleSlope", 1) or 1)
+            intercept = float(getattr(headers[i], "RescaleIntercept", 0) or 0)
+            futures.append(pool.submit(_decode_into, volume, depth_index, headers[i], slope, intercept))
+        for future in futures:
+            future.result()
+
+    return volume
+
+
+def load_dicom_folder(folder_path: str, max_workers: int = None) -> np.ndarray:
+    """Load every .dcm file in a folder as one series."""
+    paths = [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path)) if f.endswith(".dcm")]
+    return load_dicom_sources(paths, max_workers=max_workers)
+
+
+def load_dicom_zip(zip_source, max_workers: int = None) -> np.ndarray:
+    """
+    Load a zipped DICOM series (path, bytes or file-like object).
+    Members are accepted if they end in .dcm or carry the DICM preamble.
+    """
+    if isinstance(zip_source, (bytes, bytearray, memoryview)):
+        zip_source = io.BytesIO(zip_source)
+    max_workers = max_workers or DICOM_DECODE_WORKERS
+
+    with zipfile.ZipFile(zip_source) as archive:
+        # Skip directories and macOS resource-fork entries
+        names = sorted(info.filename for info in archive.infolist()
+                       if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+                       and not os.path.basename(info.filename).startswith("._"))
+        # ZipFile reads are serialised on the shared handle, but decompression
+        # runs in parallel and each member is read exactly once
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dicom-zip") as pool:
+            members = list(pool.map(archive.read, names))
+
+    sources = [data for name, data in zip(names, members)
+               if name.lower().endswith(".dcm") or is_dicom_bytes(data[:DICOM_MAGIC_OFFSET + 4])]
+    return load_dicom_sources(sources, max_workers=max_workers)
@@ -1,52 +1,157 @@
 # modules/inference.py
 import torch
 import torch.nn.functional as F
-from torchvision import models
+
+from modules.model_registry import load_densenet, load_scripted_densenet
+from modules.preprocessing import as_model_input
+from modules.visualization import capture_activations, find_cam_layer, gradcam_from_activations
+from utils.config import INFERENCE_BATCH_SIZE, INFERENCE_MAX_MEMORY_MB
 
 LABELS = ["No Tumor", "Tumor"]
 
-def load_model(device="cpu"):
+# Approximate peak activation memory of one 224×224 slice in a DenseNet-121
+# eval forward pass (measured ~13–20 MB on CPU), used to size micro-batches.
+DENSENET_BYTES_PER_SLICE = 24 * 1024 * 1024
+
+def load_model(device="cpu", scripted=False, with_info=False):
     """
     Load a pretrained DenseNet-121 model fine-tuned for brain tumor classification.
+    Weights come from the checksum-verified checkpoint via modules/model_registry.py;
+    scripted=True returns the cached TorchScript artifact (inference only).
+    With with_info=True returns (model, ModelInfo).
     """
-    model = models.densenet121(weights=None)  # use pretrained=True if available
-    num_features = model.classifier.in_features
-    model.classifier = torch.nn.Linear(num_features, len(LABELS))
-    model.to(device)
-    model.eval()
-    return model
+    loader = load_scripted_densenet if scripted else load_densenet
+    model, info = loader(len(LABELS), device=device)
+    return (model, info) if with_info else model
+
+
+class ScanAccumulator:
+    """
+    Incremental confidence-weighted average of per-slice softmax outputs.
+    Feeding slices in any number of chunks gives the same result as
+    weighting the whole scan at once.
+    """
+
+    def __init__(self):
+        self.weighted_sum = None
+        self.weight_total = 0.0
+        self.count = 0
+
+    def update(self, probs: torch.Tensor):
+        """Add a (B, C) block of softmax probabilities."""
+        probs = probs.detach().to("cpu", torch.float64)
 
+        # Per-slice confidence (max probability) is the slice weight
+        slice_confidences, _ = torch.max(probs, dim=1)
+        block_sum = (probs * slice_confidences.unsqueeze(1)).sum(dim=0)
+
+        self.weighted_sum = block_sum if self.weighted_sum is None else self.weighted_sum + block_sum
+        self.weight_total += slice_confidences.sum().item()
+        self.count += probs.shape[0]
+
+    def result(self):
+        """Return (label, confidence %) for everything seen so far."""
+        if self.count == 0:
+            raise ValueError("❌ No slice predictions accumulated.")
+
+        weighted_probs = self.weighted_sum / self.weight_total
+        conf, pred_idx = torch.max(weighted_probs, dim=0)
+        return LABELS[pred_idx.item()], conf.item() * 100  # convert to percentage
 
-def predict_scan(model, processed_slices, device="cpu"):
+
+def resolve_batch_size(num_slices: int, batch_size=None, max_memory_mb=None):
+    """
+    Pick the micro-batch size for a forward pass.
+    An explicit batch_size wins over the configured default; a memory budget
+    then caps it using DENSENET_BYTES_PER_SLICE. 0 means "no limit".
     """
-    Predict tumor class from a list of preprocessed MRI slices.
+    if batch_size is None:
+        batch_size = INFERENCE_BATCH_SIZE
+    if max_memory_mb is None:
+        max_memory_mb = INFERENCE_MAX_MEMORY_MB
+
+    size = batch_size if batch_size and batch_size > 0 else num_slices
+    if max_memory_mb and max_memory_mb > 0:
+        budget_slices = (max_memory_mb * 1024 * 1024) // DENSENET_BYTES_PER_SLICE
+        size = min(size, budget_slices)
+
+    return max(1, min(size, num_slices))
+
+
+def predict_scan(model, processed_slices, device="cpu", batch_size=None, max_memory_mb=None):
+    """
+    Predict tumor class from preprocessed MRI slices, given as a list of
+    (3, 224, 224) tensors, one (N, 3, 224, 224) batch tensor or (N, 224, 224)
+    uint8 slices (e.g. memory-mapped from a SliceStore, normalized per
+    micro-batch).
     Uses weighted averaging for more stable and confident predictions.
+
+    Slices go through the model in micro-batches (see resolve_batch_size) so
+    peak memory stays bounded; the result matches a single full-batch pass.
     """
     model.eval()
 
-    if not processed_slices:
+    if len(processed_slices) == 0:
         raise ValueError("❌ No preprocessed slices found for prediction.")
 
+    num_slices = len(processed_slices)
+    step = resolve_batch_size(num_slices, batch_size, max_memory_mb)
+    accumulator = ScanAccumulator()
+
     with torch.no_grad():
-        # Stack and send to device
-        batch = torch.stack(processed_slices).to(device)
+        for start in range(0, num_slices, step):
+            # Slice (and stack or normalize) only this micro-batch and send to device
+            batch = as_model_input(processed_slices[start:start + step]).to(device)
 
-        # Forward pass through model
-        outputs = model(batch)
-        probs = F.softmax(outputs, dim=1)
+            # Forward pass through model
+            outputs = model(batch)
+            accumulator.update(F.softmax(outputs, dim=1))
 
-        # Compute per-slice confidence (max probability)
-        slice_confidences, _ = torch.max(probs, dim=1)
+    return accumulator.result()
 
-        # Normalize weights (stronger slices get higher weight)
-        weights = slice_confidences / slice_confidences.sum()
 
-        # Weighted average of probabilities
-        weighted_probs = (probs * weights.unsqueeze(1)).sum(dim=0)
+def predict_and_explain(model, processed_slices, explain_index: int, device="cpu", batch_size=None,
+                        max_memory_mb=None, target_class=1):
+    """
+    predict_scan plus Grad-CAM for one of the slices, without a second
+    full forward pass: the last DenseBlock's activations for
+    processed_slices[explain_index] are captured (scoped hook) during the
+    batched inference pass, and the CAM comes from one backward pass through
+    the classifier head only. processed_slices takes the same forms as in
+    predict_scan (tensor, list or uint8 slices).
 
-        # Final prediction
-        conf, pred_idx = torch.max(weighted_probs, dim=0)
-        label = LABELS[pred_idx.item()]
-        confidence = conf.item() * 100  # convert to percentage
+    Returns:
+        (label, confidence, cam) where cam is a (224, 224) heatmap in [0, 1]
+    """
+    model.eval()
+
+    if len(processed_slices) == 0:
+        raise ValueError("❌ No preprocessed slices found for prediction.")
+
+    layer = find_cam_layer(model)
+    if layer is None:
+        raise ValueError("predict_and_explain needs an eager DenseNet model (model.features[-2]).")
+
+    num_slices = len(processed_slices)
+    explain_index = explain_index % num_slices
+    step = resolve_batch_size(num_slices, batch_size, max_memory_mb)
+    accumulator = ScanAccumulator()
+    activations = None
+
+    with torch.no_grad():
+        for start in range(0, num_slices, step):
+            batch = as_model_input(processed_slices[start:start + step]).to(device)
+
+            if start <= explain_index < start + step:
+                # Only this micro-batch needs the hook
+                with capture_activations(layer) as store:
+                    outputs = model(batch)
+                row = explain_index - start
+                activations = store["output"][row:row + 1].clone()
+            else:
+                outputs = model(batch)
+            accumulator.update(F.softmax(outputs, dim=1))
 
-    return label, confidence
+    label, confidence = accumulator.result()
+    cam = gradcam_from_activations(model, activations, target_class=target_class)
+    return label, confidence, cam
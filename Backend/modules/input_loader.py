@@ -1,39 +1,197 @@
 # modules/input_loader.py
+import gzip
+import io
 import os
+import struct
 import numpy as np
 import nibabel as nib
-import pydicom
+from modules.dicom_loader import load_dicom_folder, load_dicom_zip
+
+ZIP_MAGIC = b"PK\x03\x04"
+
 # load medical images (NIfTI and DICOM) into NumPy arrays
 def load_nifti(file_path: str) -> np.ndarray:
     """Load a NIfTI (.nii or .nii.gz) file into a NumPy array (H, W, D)."""
     nii_img = nib.load(file_path)
     volume = nii_img.get_fdata()
     return volume.astype(np.float32)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _as_stream(source):
+    """Wrap bytes-like input in a BytesIO (shares the buffer); pass streams through."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def _peek(stream, size: int) -> bytes:
+    """Read the first bytes of a seekable stream without moving its position."""
+    pos = stream.tell()
+    head = stream.read(size)
+    stream.seek(pos)
+    return head
+
+
+def is_gzip(stream) -> bool:
+    return _peek(stream, 2) == GZIP_MAGIC
+
+
+def is_nifti_header(head: bytes) -> bool:
+    """True if the bytes start with a NIfTI-1 (348) or NIfTI-2 (540) header size field."""
+    if len(head) < 4:
+        return False
+    return any(struct.unpack(order + "i", head[:4])[0] in (348, 540) for order in ("<", ">"))
+
+
+def open_nifti_stream(source):
+    """
+    Open a NIfTI image (header + lazy data proxy) from memory.
+
+    Args:
+        source: bytes-like object or seekable binary file-like object holding
+            a .nii or .nii.gz file. Gzip is decompressed as a stream; nothing
+            is written to disk.
+    """
+    stream = _as_stream(source)
+    if is_gzip(stream):
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+
+    # sizeof_hdr tells NIfTI-1 (348) from NIfTI-2 (540)
+    head = _peek(stream, 4)
+    if not is_nifti_header(head):
+        raise ValueError("Not a NIfTI file: unexpected header size field.")
+    is_nifti2 = 540 in (struct.unpack("<i", head)[0], struct.unpack(">i", head)[0])
+    image_class = nib.Nifti2Image if is_nifti2 else nib.Nifti1Image
+
+    # Header and voxel data share the same in-memory file holder
+    holder = nib.FileHolder(fileobj=stream)
+    return image_class.from_file_map({"header": holder, "image": holder})
+
+
+def load_nifti_stream(source) -> np.ndarray:
+    """Load a NIfTI volume (H, W, D) straight from memory (see open_nifti_stream)."""
+    return open_nifti_stream(source).get_fdata(dtype=np.float32)
+
+
+class LazyVolume:
+    """
+    Read-on-demand (H, W, D) view of a NIfTI image.
+
+    Indexing goes through nibabel's dataobj proxy (memory-mapped for
+    uncompressed files), so only the requested voxels are read and only they
+    are cast to float32. The last depth range read is kept, so repeated
+    access to the same slice window (selection, then preprocessing) does not
+    decode it twice. For 4D files (e.g. multi-modal BraTS) volume_index picks
+    the volume along the fourth axis.
+    """
+
+    def __init__(self, nii_img, volume_index: int = 0):
+        if len(nii_img.shape) < 3:
+            raise ValueError(f"Expected a 3D or 4D image, got shape {nii_img.shape}.")
+        self.dataobj = nii_img.dataobj
+        self.affine = nii_img.affine
+        self.zooms = tuple(float(z) for z in nii_img.header.get_zooms()[:3])  # voxel size (mm)
+        self.shape = tuple(nii_img.shape[:3])
+        self.ndim = 3
+        self.dtype = np.dtype(np.float32)
+        self._extra = (volume_index,) + (0,) * (len(nii_img.shape) - 4) if len(nii_img.shape) > 3 else ()
+        self._cached = None  # (depth_start, depth_stop, float32 slab)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _depth_range(self, key):
+        """Depth interval [start, stop) a depth index needs, plus the index relative to it."""
+        depth = self.shape[2]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(depth)
+            if step != 1:
+                return 0, depth, key
+            stop = max(stop, start)
+            return start, stop, slice(0, stop - start)
+        if isinstance(key, (int, np.integer)):
+            index = int(key) % depth
+            return index, index + 1, 0
+        indices = np.asarray(key, dtype=np.intp) % depth
+        if len(indices) == 0:
+            return 0, 0, indices
+        start = int(indices.min())
+        return start, int(indices.max()) + 1, indices - start
+
+    def _read_depth(self, start: int, stop: int) -> np.ndarray:
+        cached = self._cached
+        if cached is not None and cached[0] <= start and stop <= cached[1]:
+            return cached[2][:, :, start - cached[0]:stop - cached[0]]
+        slab = np.asarray(self.dataobj[(slice(None), slice(None), slice(start, stop)) + self._extra],
+                          dtype=np.float32)
+        self._cached = (start, stop, slab)
+        return slab
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            raise IndexError("LazyVolume does not support Ellipsis indexing.")
+        key = key + (slice(None),) * (3 - len(key))
+        start, stop, depth_key = self._depth_range(key[2])
+        slab = self._read_depth(start, stop)
+        return slab[key[0], key[1], depth_key]
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self[:, :, :]
+        return volume if dtype is None else volume.astype(dtype, copy=False)
+
+
+def load_nifti_lazy(file_path, volume_index: int = 0) -> LazyVolume:
+    """
+    Open a NIfTI volume without decoding it. file_path may be a path
+    (memory-mapped when uncompressed) or bytes / a file-like object.
+    """
+    if isinstance(file_path, (str, os.PathLike)):
+        nii_img = nib.load(os.fspath(file_path), mmap=True)
+    else:
+        nii_img = open_nifti_stream(file_path)
+    return LazyVolume(nii_img, volume_index=volume_index)
+
 # function to load a series of DICOM files from a directory
 def load_dicom_series(folder_path: str) -> np.ndarray:
     """
     Load a series of DICOM (.dcm) slices from a folder into a 3D NumPy array.
-    Assumes all slices belong to the same study/series.
-    """
-    slices = []
-    # sort files to maintain slice order
-    for fname in sorted(os.listdir(folder_path)):
-        # only process .dcm files
-        if fname.endswith(".dcm"):
-            dcm = pydicom.dcmread(os.path.join(folder_path, fname))
-            slices.append(dcm.pixel_array)
-    
-    volume = np.stack(slices, axis=-1)  # shape: (H, W, D)
-    return volume.astype(np.float32)
+    Assumes all slices belong to the same study/series; slices are ordered by
+    header position and decoded in parallel (see modules/dicom_loader.py).
+    """
+    return load_dicom_folder(folder_path)
 # main function to load either NIfTI or DICOM based on file extension
-def load_mri(file_path: str) -> np.ndarray:
-    """Wrapper to handle both NIfTI and DICOM inputs."""
+def load_mri(file_path, filename: str = None, lazy: bool = False):
+    """
+    Wrapper to handle both NIfTI and DICOM inputs.
+
+    file_path is normally a path; it may also be bytes or a binary file-like
+    object (e.g. an upload stream), in which case the volume is decoded in
+    memory and filename (if given) is only used to check the extension.
+    With lazy=True NIfTI inputs come back as a LazyVolume instead of a
+    fully decoded array.
+    """
+    if not isinstance(file_path, (str, os.PathLike)):
+        stream = _as_stream(file_path)
+        # zipped DICOM series
+        if (filename or "").lower().endswith(".zip") or _peek(stream, 4) == ZIP_MAGIC:
+            return load_dicom_zip(stream)
+        if filename and not filename.endswith((".nii", ".nii.gz")):
+            raise ValueError("Unsupported in-memory format. Use .nii, .nii.gz or a .zip of .dcm files.")
+        return load_nifti_lazy(stream) if lazy else load_nifti_stream(stream)
+
+    file_path = os.fspath(file_path)
     # determine file type by extension
     if file_path.endswith((".nii", ".nii.gz")):
-        return load_nifti(file_path)
+        return load_nifti_lazy(file_path) if lazy else load_nifti(file_path)
     elif file_path.endswith(".dcm"):
         raise ValueError("For DICOM, please provide folder path containing .dcm files.")
+    elif file_path.lower().endswith(".zip"):
+        return load_dicom_zip(file_path)
     elif os.path.isdir(file_path):
         return load_dicom_series(file_path)
     else:
-        raise ValueError("Unsupported file format. Use .nii, .nii.gz, or .dcm folder.")
+        raise ValueError("Unsupported file format. Use .nii, .nii.gz, .dcm folder or .zip of .dcm files.")
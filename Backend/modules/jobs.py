@@ -0,0 +1,295 @@
+# modules/jobs.py
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+# Progress reported for every scan of a job, in order
+JOB_STAGES = ("load", "preprocess", "inference", "explain", "publish")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items(status, updated_at);
+"""
+
+
+def sse_event(event: str, data) -> str:
+    """One Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _safe_name(filename: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(filename or "scan")) or "scan"
+
+
+class JobStore:
+    """
+    Persistent job queue in SQLite.
+
+    A job is one or more scans (items). Each item moves queued → running →
+    done | failed and records its current stage and result. Uploaded scans
+    are kept under files_dir until their item finishes (done or failed),
+    so queued work survives a restart; the job's folder goes with its last
+    item.
+    """
+
+    def __init__(self, db_path: str, files_dir: str):
+        self.files_dir = files_dir
+        os.makedirs(files_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    # === Submission ===
+    def create_job(self, uploads, patient_id: str = None) -> str:
+        """
+        Store a new job. uploads is a list of (filename, fileobj); each file is
+        copied to disk in chunks. Returns the job id.
+        """
+        job_id = uuid.uuid4().hex
+        folder = os.path.join(self.files_dir, job_id)
+        os.makedirs(folder, exist_ok=True)
+
+        items = []
+        for idx, (filename, fileobj) in enumerate(uploads):
+            path = os.path.join(folder, f"{idx}_{_safe_name(filename)}")
+            with open(path, "wb") as out:
+                for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+                    out.write(chunk)
+            items.append((job_id, idx, filename or os.path.basename(path), path, time.time()))
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT INTO jobs (id, patient_id, created_at) VALUES (?, ?, ?)",
+                             (job_id, patient_id, time.time()))
+            self._db.executemany(
+                "INSERT INTO job_items (job_id, idx, filename, path, updated_at) VALUES (?, ?, ?, ?, ?)", items)
+            self._db.execute("COMMIT")
+        return job_id
+
+    # === Worker side ===
+    def claim_next(self):
+        """Atomically move the oldest queued item to running and return it (or None)."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "SELECT i.job_id, i.idx, i.filename, i.path, j.patient_id FROM job_items i "
+                "JOIN jobs j ON j.id = i.job_id WHERE i.status = 'queued' "
+                "ORDER BY j.created_at, i.idx LIMIT 1").fetchone()
+            if row is not None:
+                self._db.execute("UPDATE job_items SET status = 'running', updated_at = ? WHERE job_id = ? AND idx = ?",
+                                 (time.time(), row["job_id"], row["idx"]))
+            self._db.execute("COMMIT")
+        return dict(row) if row is not None else None
+
+    def set_stage(self, job_id: str, idx: int, stage: str):
+        with self._lock:
+            self._db.execute("UPDATE job_items SET stage = ?, updated_at = ? WHERE job_id = ? AND idx = ?",
+                             (stage, time.time(), job_id, idx))
+
+    def finish_item(self, job_id: str, idx: int, result: dict = None, error: str = None):
+        """Record the outcome and remove the item's scan (and the job folder after its last item)."""
+        status = "failed" if error else "done"
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_items SET status = ?, result = ?, error = ?, updated_at = ? WHERE job_id = ? AND idx = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, idx))
+            row = self._db.execute("SELECT path FROM job_items WHERE job_id = ? AND idx = ?", (job_id, idx)).fetchone()
+            unfinished = self._db.execute("SELECT COUNT(*) FROM job_items WHERE job_id = ? "
+                                          "AND status IN ('queued', 'running')", (job_id,)).fetchone()[0]
+
+        # The stored scan is no longer needed once its item finished, whatever the outcome
+        if row is not None:
+            try:
+                os.remove(row["path"])
+            except OSError:
+                pass
+        if not unfinished:
+            try:
+                os.rmdir(os.path.join(self.files_dir, job_id))
+            except OSError:
+                pass
+
+    def requeue_running(self) -> int:
+        """Put items left running by a previous process back in the queue."""
+        with self._lock:
+            cursor = self._db.execute("UPDATE job_items SET status = 'queued', stage = NULL, updated_at = ? "
+                                      "WHERE status = 'running'", (time.time(),))
+            return cursor.rowcount
+
+    # === Status ===
+    def get_job(self, job_id: str):
+        with self._lock:
+            job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            items = self._db.execute("SELECT idx, filename, status, stage, result, error, updated_at "
+                                     "FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+
+        items = [dict(item, result=json.loads(item["result"]) if item["result"] else None) for item in items]
+        counts = {status: sum(item["status"] == status for item in items)
+                  for status in ("queued", "running", "done", "failed")}
+        return {
+            "job_id": job["id"],
+            "patient_id": job["patient_id"],
+            "created_at": job["created_at"],
+            "status": job_status(counts),
+            "counts": counts,
+            "items": items,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def job_status(counts: dict) -> str:
+    """queued | running | done | failed (failed once finished with any failed item)."""
+    if counts["queued"] + counts["running"] == 0:
+        return "failed" if counts["failed"] else "done"
+    if counts["running"] or counts["done"] or counts["failed"]:
+        return "running"
+    return "queued"
+
+
+class JobRunner:
+    """
+    Processes queued job items with a fixed number of async workers.
+
+    process(item, progress) is a coroutine that runs one scan through the
+    pipeline, calls progress(stage) as it goes and returns a JSON-able
+    result. Stage changes are written to the store and pushed to anyone
+    following the job through subscribe().
+
+    Args:
+        store: JobStore
+        run_io: coroutine function running blocking calls off the loop
+            (StagedExecutor.run_io)
+        workers: scans processed at once
+        poll_interval_s: how often idle workers re-check the queue
+    """
+
+    def __init__(self, store, process, run_io, workers=2, poll_interval_s=1.0):
+        self.store = store
+        self.process = process
+        self.run_io = run_io
+        self.workers = workers
+        self.poll_interval_s = poll_interval_s
+        self._tasks = []
+        self._wakeup = None
+        self._subscribers = {}
+
+    # === Lifecycle ===
+    def start(self):
+        if self._tasks:
+            return
+        requeued = self.store.requeue_running()
+        if requeued:
+            print(f"🔁 Requeued {requeued} interrupted job item(s)")
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after new items were queued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # === Progress events ===
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[job_id]
+
+    def _emit(self, event: dict):
+        for queue in self._subscribers.get(event["job_id"], ()):
+            queue.put_nowait(event)
+
+    # === Workers ===
+    async def _worker(self):
+        while True:
+            item = await self.run_io(self.store.claim_next)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_item(item)
+
+    async def _run_item(self, item):
+        job_id, idx = item["job_id"], item["idx"]
+        # Stage writes go through run_io, one at a time so they land in
+        # order; stages reported while a write is running are coalesced
+        stages = {"current": None, "written": None, "writer": None}
+
+        async def write_stages():
+            while stages["written"] != stages["current"]:
+                stage = stages["current"]
+                await self.run_io(self.store.set_stage, job_id, idx, stage)
+                stages["written"] = stage
+
+        def progress(stage):
+            stages["current"] = stage
+            if stages["writer"] is None or stages["writer"].done():
+                stages["writer"] = asyncio.get_running_loop().create_task(write_stages())
+            self._emit({"job_id": job_id, "item": idx, "status": "running", "stage": stage})
+
+        async def stages_written():
+            if stages["writer"] is not None:
+                try:
+                    await stages["writer"]
+                except Exception as e:
+                    print(f"⚠️ Job {job_id} item {idx}: stage not recorded:", e)
+
+        try:
+            result = await self.process(item, progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Job {job_id} item {idx} failed:", e)
+            await stages_written()
+            await self.run_io(self.store.finish_item, job_id, idx, error=str(e))
+            self._emit({"job_id": job_id, "item": idx, "status": "failed", "error": str(e)})
+            return
+
+        await stages_written()
+        await self.run_io(self.store.finish_item, job_id, idx, result=result)
+        self._emit({"job_id": job_id, "item": idx, "status": "done", "result": result})
@@ -0,0 +1,279 @@
+# modules/mesh.py
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+import threading
+import uuid
+
+import numpy as np
+from skimage.measure import marching_cubes
+
+from modules.input_loader import load_mri
+
+# Bump whenever mesh extraction or the binary layout changes, so cached meshes are rebuilt
+MESH_VERSION = 2
+
+MESH_MAGIC = b"BMSH"
+_KEY = re.compile(r"[0-9a-f]{64}")
+
+# magic, format version, index bytes (2|4), vertex count, face count, origin xyz, scale xyz
+_HEADER = struct.Struct("<4sHHII3f3f")
+
+
+def mesh_key(content_sha256: str, params: dict) -> str:
+    """Cache key = segmentation content + mesh version + extraction parameters."""
+    material = json.dumps({"content": content_sha256, "version": MESH_VERSION, "params": params}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+# === Extraction ===
+def block_fraction(mask: np.ndarray, factor: int):
+    """
+    Downsample a boolean (H, W, D) mask by averaging factor³ blocks, giving
+    the fraction of each block inside the mask (float32). Edges are zero-padded.
+    """
+    if factor <= 1:
+        return mask.astype(np.float32)
+    pad = [(0, -n % factor) for n in mask.shape]
+    padded = np.pad(mask, pad).astype(np.float32)
+    h, w, d = (n // factor for n in padded.shape)
+    return padded.reshape(h, factor, w, factor, d, factor).mean(axis=(1, 3, 5))
+
+
+def extract_label_meshes(labels: np.ndarray, downsample: int = 2, spacing=(1.0, 1.0, 1.0)):
+    """
+    One isosurface per non-zero label of an integer (H, W, D) segmentation.
+
+    Each label's mask is reduced to block fractions on a grid downsample×
+    coarser and meshed with marching cubes at 0.5 (the block is half inside),
+    which keeps smooth boundaries at a fraction of the full-grid cost.
+    Vertices are returned in voxel coordinates of the input (× spacing).
+
+    Returns:
+        dict: {label: (vertices (V, 3) float32, faces (F, 3) uint32)}
+    """
+    meshes = {}
+    for label in np.unique(labels):
+        if label == 0:
+            continue
+        grid = block_fraction(labels == label, downsample)
+        if grid.max() < 0.5:
+            continue  # smaller than one block at this resolution
+        # One empty cell on every side closes surfaces that touch the volume edge
+        grid = np.pad(grid, 1)
+        verts, faces, _, _ = marching_cubes(grid, level=0.5)
+
+        # Grid index → centre of the corresponding voxel block
+        verts = (verts - 1) * downsample + (downsample - 1) / 2.0
+        verts *= np.asarray(spacing, dtype=np.float32)
+        meshes[int(label)] = (verts.astype(np.float32), faces.astype(np.uint32))
+    return meshes
+
+
+# === Level of detail ===
+def decimate(verts: np.ndarray, faces: np.ndarray, cell_size: float):
+    """
+    Vertex-clustering decimation: vertices falling in the same cubic cell of
+    cell_size are merged into their mean, collapsed and duplicate faces are
+    dropped. cell_size <= 0 returns the mesh unchanged.
+    """
+    if cell_size <= 0 or len(verts) == 0:
+        return verts, faces
+
+    # Step 1: One integer key per occupied cell
+    cells = np.floor(verts / cell_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    extent = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * extent[1] + cells[:, 1]) * extent[2] + cells[:, 2]
+    _, cluster, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+
+    # Step 2: Cluster centroids
+    merged = np.stack([np.bincount(cluster, weights=verts[:, axis], minlength=len(counts))
+                       for axis in range(3)], axis=1) / counts[:, None]
+
+    # Step 3: Remap faces, drop collapsed and duplicate triangles
+    faces = cluster[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+    if len(faces):
+        _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+        faces = faces[np.sort(first)]
+
+    # Step 4: Drop vertices no face uses any more
+    used = np.unique(faces)
+    remap = np.full(len(merged), -1, dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    return merged[used].astype(np.float32), remap[faces].astype(np.uint32)
+
+
+# === Binary format ===
+def pack_mesh(verts: np.ndarray, faces: np.ndarray) -> bytes:
+    """
+    Compact little-endian mesh:
+      40-byte header (see _HEADER), vertices as uint16 xyz quantized to the
+      mesh bounds (position = origin + q × scale), padded to 4 bytes, then
+      faces as uint16 (≤ 65536 vertices) or uint32 index triples.
+    """
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    faces = np.asarray(faces).reshape(-1, 3)
+    origin = verts.min(axis=0) if len(verts) else np.zeros(3, dtype=np.float32)
+    extent = verts.max(axis=0) - origin if len(verts) else np.zeros(3, dtype=np.float32)
+    scale = np.where(extent > 0, extent / 65535.0, 1.0).astype(np.float32)
+
+    quantized = np.rint((verts - origin) / scale).astype("<u2")
+    index_bytes = 2 if len(verts) <= 65536 else 4
+    indices = faces.astype("<u2" if index_bytes == 2 else "<u4")
+
+    body = quantized.tobytes()
+    body += b"\0" * (-len(body) % 4)
+    header = _HEADER.pack(MESH_MAGIC, MESH_VERSION, index_bytes, len(verts), len(faces), *origin, *scale)
+    return header + body + indices.tobytes()
+
+
+def unpack_mesh(data: bytes):
+    """Inverse of pack_mesh → (vertices float32 (V, 3), faces uint32 (F, 3))."""
+    magic, version, index_bytes, num_verts, num_faces, *rest = _HEADER.unpack_from(data)
+    if magic != MESH_MAGIC:
+        raise ValueError("Not a packed mesh.")
+    origin, scale = np.array(rest[:3], dtype=np.float32), np.array(rest[3:], dtype=np.float32)
+
+    offset = _HEADER.size
+    quantized = np.frombuffer(data, dtype="<u2", count=num_verts * 3, offset=offset).reshape(-1, 3)
+    offset += num_verts * 6 + (-(num_verts * 6) % 4)
+    faces = np.frombuffer(data, dtype="<u2" if index_bytes == 2 else "<u4", count=num_faces * 3, offset=offset)
+    verts = origin + quantized.astype(np.float32) * scale
+    return verts.astype(np.float32), faces.reshape(-1, 3).astype(np.uint32)
+
+
+# === Cache ===
+class MeshCache:
+    """
+    Packed meshes on disk, one folder per mesh key:
+    manifest.json plus label_<label>_lod_<level>.bin files. Folders appear
+    atomically (written aside, then renamed) and the least recently used
+    ones are removed once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _folder(self, key):
+        return os.path.join(self.root, key)
+
+    def manifest(self, key: str):
+        if not _KEY.fullmatch(key):
+            return None  # keys come from URLs; never touch paths outside root
+        path = os.path.join(self._folder(key), "manifest.json")
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            os.utime(self._folder(key))  # mark as recently used for eviction
+            return manifest
+        except (OSError, ValueError):
+            return None
+
+    def read(self, key: str, label: int, level: int):
+        if not _KEY.fullmatch(key):
+            return None
+        try:
+            with open(os.path.join(self._folder(key), f"label_{int(label)}_lod_{int(level)}.bin"), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store(self, key: str, manifest: dict, blobs: dict):
+        """blobs: {(label, level): packed bytes}. Returns the manifest."""
+        staging = os.path.join(self.root, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(staging)
+        for (label, level), data in blobs.items():
+            with open(os.path.join(staging, f"label_{label}_lod_{level}.bin"), "wb") as f:
+                f.write(data)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(staging, self._folder(key))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # built concurrently by another worker
+        self._evict()
+        return manifest
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                folder = os.path.join(self.root, name)
+                if name.startswith(".") or not os.path.isdir(folder):
+                    continue
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(folder))
+                    entries.append((os.stat(folder).st_mtime, size, folder))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, folder in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(folder, ignore_errors=True)
+                total -= size
+
+
+# === Pipeline ===
+def build_meshes(labels: np.ndarray, downsample: int = 2, lod_cells=(8.0, 4.0, 0.0), spacing=(1.0, 1.0, 1.0)):
+    """
+    Meshes for every label at every level of detail, coarse first.
+
+    Decimation cells are measured in voxels; vertices are then scaled by
+    spacing (voxel size, e.g. mm from the NIfTI header), so anisotropic
+    scans keep their real proportions.
+
+    Returns:
+        tuple: (manifest dict, {(label, level): packed bytes})
+    """
+    labels_info, blobs = [], {}
+    scale = np.asarray(spacing, dtype=np.float32)
+    for label, (verts, faces) in extract_label_meshes(labels, downsample).items():
+        levels = []
+        for level, cell_size in enumerate(lod_cells):
+            lod_verts, lod_faces = decimate(verts, faces, cell_size)
+            data = pack_mesh(lod_verts * scale, lod_faces)
+            blobs[(label, level)] = data
+            levels.append({"level": level, "cell_size": cell_size, "vertices": len(lod_verts),
+                           "faces": len(lod_faces), "bytes": len(data)})
+        labels_info.append({"label": label, "voxels": int(np.count_nonzero(labels == label)), "levels": levels})
+
+    manifest = {
+        "version": MESH_VERSION,
+        "shape": list(labels.shape),
+        "spacing": [float(v) for v in spacing],
+        "downsample": downsample,
+        "lod_cells": list(lod_cells),
+        "labels": labels_info,
+    }
+    return manifest, blobs
+
+
+def load_segmentation(source, filename: str = None):
+    """
+    Integer label volume and voxel size from a NIfTI/DICOM segmentation
+    (path, bytes or stream). The spacing comes from the NIfTI header;
+    DICOM series fall back to (1, 1, 1).
+    """
+    volume = load_mri(source, filename=filename, lazy=True)
+    spacing = getattr(volume, "zooms", (1.0, 1.0, 1.0))
+    return np.rint(np.asarray(volume, dtype=np.float32)).astype(np.int16), spacing
+
+
+def build_and_cache_meshes(source, filename: str, key: str, cache_dir: str, downsample: int = 2,
+                           lod_cells=(8.0, 4.0, 0.0), max_bytes: int = 512 * 1024 * 1024):
+    """Load → mesh → store, in one worker-friendly call. Returns the manifest."""
+    labels, spacing = load_segmentation(source, filename)
+    manifest, blobs = build_meshes(labels, downsample, lod_cells, spacing)
+    manifest["mesh_id"] = key
+    return MeshCache(cache_dir, max_bytes).store(key, manifest, blobs)
@@ -0,0 +1,263 @@
+# modules/model_registry.py
+import hashlib
+import os
+import re
+import warnings
+
+import torch
+from torchvision import models
+
+from utils.config import MODEL_CHECKPOINT, MODEL_SHA256, MODEL_CACHE_DIR
+
+UNTRAINED_VERSION = "untrained"
+
+# Bump whenever remap_monai_state_dict changes, so cached state dicts are rebuilt
+REMAP_VERSION = 1
+
+
+class ModelInfo:
+    """Where the loaded weights came from; version feeds result-cache keys."""
+
+    def __init__(self, version, checkpoint=None, sha256=None, source="checkpoint"):
+        self.version = version
+        self.checkpoint = checkpoint
+        self.sha256 = sha256
+        self.source = source
+
+    def as_dict(self):
+        return {"version": self.version, "checkpoint": self.checkpoint, "sha256": self.sha256, "source": self.source}
+
+
+# === Checksums ===
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def expected_sha256(checkpoint: str):
+    """Expected checksum from MODEL_SHA256 or a '<checkpoint>.sha256' sidecar file."""
+    if MODEL_SHA256:
+        return MODEL_SHA256.lower()
+    sidecar = checkpoint + ".sha256"
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return f.read().split()[0].lower()
+    return None
+
+
+# === MONAI → torchvision key mapping ===
+_MONAI_DENSE_LAYER = re.compile(r"(features\.denseblock\d+\.denselayer\d+)\.layers\.")
+
+
+def unwrap_checkpoint(checkpoint):
+    """Accept a bare state dict or the usual {'state_dict'|'model': ...} wrappers."""
+    for key in ("state_dict", "model_state_dict", "model"):
+        if isinstance(checkpoint, dict) and isinstance(checkpoint.get(key), dict):
+            checkpoint = checkpoint[key]
+    if not isinstance(checkpoint, dict):
+        raise ValueError("Checkpoint does not contain a state dict.")
+    return checkpoint
+
+
+def remap_monai_state_dict(state_dict):
+    """
+    Rename MONAI DenseNet121 keys to torchvision densenet121 keys.
+
+    MONAI nests each dense layer's modules under '.layers.' and names the
+    classifier 'class_layers.out'; transitions and norm5 already match.
+    A single-channel MONAI stem is spread over torchvision's 3 input
+    channels by averaging. This is an approximation: our input replicates
+    grayscale to 3 channels, but the per-channel ImageNet Normalize makes
+    the channels differ, so the stem sees a per-channel affine transform of
+    the single-channel input rather than the same values.
+    """
+    remapped = {}
+    for key, value in state_dict.items():
+        key = key[len("module."):] if key.startswith("module.") else key
+        key = _MONAI_DENSE_LAYER.sub(r"\1.", key)
+        key = key.replace("class_layers.out.", "classifier.")
+        remapped[key] = value
+
+    conv0 = remapped.get("features.conv0.weight")
+    if conv0 is not None and conv0.shape[1] == 1:
+        remapped["features.conv0.weight"] = conv0.repeat(1, 3, 1, 1) / 3.0
+    return remapped
+
+
+# === Model construction ===
+def build_densenet(num_classes: int, state_dict=None):
+    """
+    DenseNet-121 with a num_classes classifier. With a state dict the module
+    is created on the meta device and the weights are assigned directly,
+    skipping random initialisation.
+    """
+    if state_dict is None:
+        model = models.densenet121(weights=None)
+        model.classifier = torch.nn.Linear(model.classifier.in_features, num_classes)
+        return model
+
+    with torch.device("meta"):
+        model = models.densenet121(weights=None)
+        model.classifier = torch.nn.Linear(model.classifier.in_features, num_classes)
+    model.load_state_dict(state_dict, strict=True, assign=True)
+    return model
+
+
+# === Artifact cache ===
+def _cache_paths(sha256: str):
+    """Cached state dict and TorchScript paths: checkpoint + remap version (+ torch version for .ts)."""
+    stem = os.path.join(MODEL_CACHE_DIR, f"densenet121-{sha256[:16]}-remap{REMAP_VERSION}")
+    torch_version = re.sub(r"[^A-Za-z0-9.]", "_", torch.__version__)
+    return stem + ".pt", f"{stem}-torch{torch_version}.ts"
+
+
+# Checksums verified by this process, keyed by path, size and mtime. Nothing
+# is trusted across processes: the first load in each one rehashes the file.
+_VERIFIED = {}
+
+
+def _verified_sha256(checkpoint: str):
+    stat = os.stat(checkpoint)
+    return _VERIFIED.get((os.path.abspath(checkpoint), stat.st_size, stat.st_mtime_ns))
+
+
+def _record_sha256(checkpoint: str, sha256: str):
+    stat = os.stat(checkpoint)
+    _VERIFIED[(os.path.abspath(checkpoint), stat.st_size, stat.st_mtime_ns)] = sha256
+
+
+def _atomic_save(obj, path, save_fn=torch.save):
+    tmp = path + ".tmp"
+    save_fn(obj, tmp)
+    os.replace(tmp, path)
+
+
+def _save_artifact(obj, path, save_fn=torch.save):
+    """Save a cached artifact with a '<path>.sha256' digest next to it."""
+    _atomic_save(obj, path, save_fn)
+    sha256 = file_sha256(path)
+    _record_sha256(path, sha256)
+    with open(path + ".sha256.tmp", "w") as f:
+        f.write(sha256 + "\n")
+    os.replace(path + ".sha256.tmp", path + ".sha256")
+
+
+def _artifact_is_intact(path: str) -> bool:
+    """
+    True when a cached artifact exists and matches its recorded digest.
+    Anything else (missing digest, changed bytes) is removed so the
+    artifact is rebuilt from the verified checkpoint.
+    """
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path + ".sha256") as f:
+            expected = f.read().split()[0].lower()
+    except (OSError, IndexError):
+        expected = None
+
+    sha256 = _verified_sha256(path)
+    if sha256 is None and expected:
+        sha256 = file_sha256(path)
+        _record_sha256(path, sha256)
+    if expected and sha256 == expected:
+        return True
+
+    warnings.warn(f"⚠️ Cached model artifact {path} failed its integrity check; rebuilding it.")
+    for stale in (path, path + ".sha256"):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+    return False
+
+
+def resolve_checkpoint(checkpoint: str = None):
+    """
+    Return (checkpoint_path, sha256) for a usable checkpoint, or (None, None)
+    when it is missing or empty. Raises when no checksum is configured or it
+    does not match.
+    """
+    checkpoint = checkpoint or MODEL_CHECKPOINT
+    if not os.path.exists(checkpoint) or os.path.getsize(checkpoint) == 0:
+        return None, None
+
+    expected = expected_sha256(checkpoint)
+    if not expected:
+        raise RuntimeError(f"❌ No checksum configured for {checkpoint}: set MODEL_SHA256 or add "
+                           f"'{os.path.basename(checkpoint)}.sha256' next to it (sha256sum output).")
+
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    sha256 = _verified_sha256(checkpoint)
+    if sha256 is None:
+        sha256 = file_sha256(checkpoint)
+        _record_sha256(checkpoint, sha256)
+    if expected != sha256:
+        raise RuntimeError(f"❌ Checksum mismatch for {checkpoint}: expected {expected}, got {sha256}.")
+    return checkpoint, sha256
+
+
+def load_state_dict(checkpoint: str, sha256: str):
+    """
+    Remapped torchvision state dict for a checkpoint. The first load remaps and
+    caches it; later loads memory-map the cached copy once its digest checks out.
+    """
+    state_path, _ = _cache_paths(sha256)
+    if _artifact_is_intact(state_path):
+        return torch.load(state_path, map_location="cpu", mmap=True, weights_only=True)
+
+    raw = torch.load(checkpoint, map_location="cpu", weights_only=True)
+    state_dict = remap_monai_state_dict(unwrap_checkpoint(raw))
+    _save_artifact(state_dict, state_path)
+    return state_dict
+
+
+def load_densenet(num_classes: int, device="cpu", checkpoint: str = None):
+    """
+    Eager DenseNet-121 with the repository checkpoint loaded.
+
+    Falls back to untrained weights (with a warning) when no checkpoint is
+    available, matching the behaviour before checkpoints were loaded.
+    Returns (model, ModelInfo).
+    """
+    path, sha256 = resolve_checkpoint(checkpoint)
+    if path is None:
+        warnings.warn(f"⚠️ No model checkpoint at {checkpoint or MODEL_CHECKPOINT}; using untrained weights.")
+        model = build_densenet(num_classes)
+        info = ModelInfo(UNTRAINED_VERSION, source="untrained")
+    else:
+        model = build_densenet(num_classes, load_state_dict(path, sha256))
+        info = ModelInfo(sha256[:16], checkpoint=path, sha256=sha256)
+
+    model.to(device)
+    model.eval()
+    return model, info
+
+
+def load_scripted_densenet(num_classes: int, device="cpu", checkpoint: str = None):
+    """
+    TorchScript DenseNet-121 for inference-only workers.
+
+    The traced module is cached next to the state dict (per torch version,
+    with a digest checked before torch.jit.load runs it), so later start-ups
+    load it directly without building the eager graph. Scripted modules do
+    not run Python hooks, so Grad-CAM needs the eager model.
+    Returns (module, ModelInfo).
+    """
+    path, sha256 = resolve_checkpoint(checkpoint)
+    if path is not None:
+        _, script_path = _cache_paths(sha256)
+        if _artifact_is_intact(script_path):
+            scripted = torch.jit.load(script_path, map_location=device)
+            return scripted.eval(), ModelInfo(sha256[:16], checkpoint=path, sha256=sha256, source="torchscript")
+
+    model, info = load_densenet(num_classes, device="cpu", checkpoint=checkpoint)
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, torch.zeros(1, 3, 224, 224))
+    if path is not None:
+        _save_artifact(scripted, _cache_paths(sha256)[1], save_fn=torch.jit.save)
+        info.source = "torchscript"
+    return scripted.to(device).eval(), info
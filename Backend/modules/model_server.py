@@ -0,0 +1,497 @@
+# modules/model_server.py
+import asyncio
+import itertools
+import os
+import re
+import stat
+import threading
+import time
+import uuid
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import torch
+
+from modules.preprocessing import MODEL_INPUT_SIZE, uint8_input_to_tensor
+from modules.scheduler import InferenceScheduler
+from modules.visualization import explain_slice, explain_volume
+
+
+class ModelServerError(RuntimeError):
+    """Raised when the model server rejects a request or the connection drops."""
+
+
+# multiprocessing.connection unpickles what it receives: only peers that know
+# the secret may connect, so there is no default and short keys are refused
+MIN_AUTHKEY_BYTES = 16
+
+
+def check_authkey(authkey: bytes):
+    if not authkey or len(authkey) < MIN_AUTHKEY_BYTES:
+        raise ValueError(f"❌ MODEL_SERVER_AUTHKEY must be set to a secret of at least {MIN_AUTHKEY_BYTES} bytes "
+                         "(e.g. python -c 'import secrets; print(secrets.token_hex(32))').")
+    return authkey
+
+
+# === Shared-memory slices ===
+# Blocks created by this process (their owner unlinks them)
+_created_blocks = set()
+# Only blocks named like this are opened on request of a peer
+SHM_PREFIX = "brainalyze_"
+_SHM_NAME = re.compile(SHM_PREFIX + r"[0-9a-f]{32}")
+_SHM_DTYPES = {"uint8": np.uint8, "float32": np.float32}
+
+
+def slices_to_shm(slices):
+    """
+    Copy slices into a new shared-memory block; returns (block, header).
+    (N, 224, 224) uint8 slices (see preprocessing.uint8_input_to_tensor) are
+    sent as they are — 12x fewer bytes than the float batch — and expanded
+    by the receiver; anything else is sent as float32.
+    """
+    if isinstance(slices, np.ndarray) and slices.dtype == np.uint8:
+        array = np.ascontiguousarray(slices)
+    else:
+        array = slices.detach().to("cpu", torch.float32).contiguous().numpy()
+    block = SharedMemory(name=SHM_PREFIX + uuid.uuid4().hex, create=True, size=max(array.nbytes, 1))
+    _created_blocks.add(block._name)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, {"shm": block.name, "shape": array.shape, "dtype": array.dtype.name}
+
+
+def slices_from_shm(header):
+    """
+    Read slices written by slices_to_shm in another process as a float32
+    model-input tensor. The block is copied once into process memory and
+    detached right away, so the sender can unlink it as soon as the reply
+    arrives. Blocks not named by slices_to_shm, unknown dtypes and shapes
+    larger than the block are refused.
+    """
+    name, dtype = header.get("shm"), _SHM_DTYPES.get(header.get("dtype", "float32"))
+    shape = tuple(header.get("shape", ()))
+    if not isinstance(name, str) or not _SHM_NAME.fullmatch(name):
+        raise ValueError(f"Refusing shared-memory block '{name}'.")
+    if dtype is None or len(shape) not in (3, 4) or not all(isinstance(n, int) and n >= 0 for n in shape):
+        raise ValueError("Malformed slice header.")
+
+    block = SharedMemory(name=name)
+    if block._name not in _created_blocks:
+        # The sender owns the block; don't let this process's tracker unlink it on exit
+        resource_tracker.unregister(block._name, "shared_memory")
+    try:
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if dtype is np.uint8:
+            tensor = uint8_input_to_tensor(view)
+        else:
+            tensor = torch.from_numpy(view.copy())
+        del view
+    finally:
+        block.close()
+    return tensor
+
+
+# === Warm-up ===
+async def warm_up(scheduler, explain_model=None, device="cpu", batch_size=2):
+    """
+    Push one dummy batch (and one Grad-CAM) through the model so lazy
+    initialization — allocator growth, oneDNN kernel selection, thread pool
+    start-up — happens before the first real request.
+    """
+    dummy = torch.zeros(batch_size, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+    _, _, activations = await scheduler.predict(dummy, explain_index=0)
+    if explain_model is not None:
+        await asyncio.get_running_loop().run_in_executor(
+            None, explain_slice, explain_model, dummy[:1], activations, device)
+
+
+# === Server ===
+class ModelServer:
+    """
+    One process that holds the model for many HTTP workers.
+
+    Workers connect over a unix socket (multiprocessing.connection with an
+    authkey) and send small request headers; slice tensors travel in shared
+    memory, not through the socket. Requests from all connections feed one
+    InferenceScheduler, so slices from different workers share batches.
+    Grad-CAM is computed here too, next to the eager model.
+
+    Ops: "ping" (status, answered while warming up), "predict" (label,
+    confidence and optionally the heatmap of one slice), "volume" (label,
+    confidence and the heatmaps of every slice), "probs" (per-slice
+    probabilities) and "explain" (heatmap of one slice).
+    """
+
+    def __init__(self, model, explain_model=None, model_version=None, info=None, device="cpu",
+                 max_batch_size=32, max_wait_ms=10.0):
+        self.scheduler = InferenceScheduler(model, device=device, max_batch_size=max_batch_size,
+                                            max_wait_ms=max_wait_ms)
+        self.explain_model = explain_model
+        self.model_version = model_version
+        self.info = info or {}
+        self.device = device
+        self.started_at = time.time()
+        self.ready = None
+        self._loop = None
+        self._stopping = None
+        self._connections = set()
+
+    def status(self):
+        return {
+            "status": "ready" if self.ready is not None and self.ready.is_set() else "warming_up",
+            "pid": os.getpid(),
+            "model_version": self.model_version,
+            "info": self.info,
+            "uptime_s": time.time() - self.started_at,
+            "connections": len(self._connections),
+            "metrics": self.scheduler.metrics(),
+        }
+
+    # === Lifecycle ===
+    def serve(self, address, authkey: bytes):
+        """Run until stop() (blocking)."""
+        asyncio.run(self.serve_async(address, authkey))
+
+    def stop(self):
+        """Ask a running server to shut down (thread-safe)."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve_async(self, address, authkey: bytes):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self.ready = asyncio.Event()
+        check_authkey(authkey)
+        self.scheduler.start()
+
+        if os.path.lexists(address):
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                raise FileExistsError(f"❌ {address} exists and is not a socket.")
+            os.unlink(address)  # stale socket from an earlier run
+        # Owner-only socket (0600): other local users can't even attempt the handshake
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(umask)
+        os.chmod(address, 0o600)
+        threading.Thread(target=self._accept, args=(listener,), name="model-server-accept", daemon=True).start()
+        print(f"🛰️ Model server listening on {address} (pid {os.getpid()})")
+
+        try:
+            await warm_up(self.scheduler, self.explain_model, self.device)
+            self.ready.set()
+            print(f"✅ Model server ready ({self.model_version})")
+            await self._stopping.wait()
+        finally:
+            listener.close()
+            for conn in list(self._connections):
+                conn.close()
+            await self.scheduler.stop()
+            if os.path.exists(address):
+                os.unlink(address)
+            print("👋 Model server stopped")
+
+    # === Connections (one reader thread each) ===
+    def _accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                return  # listener closed
+            except Exception as e:  # failed authentication etc.
+                print(f"⚠️ Rejected model server connection: {e}")
+                continue
+            self._connections.add(conn)
+            threading.Thread(target=self._serve_connection, args=(conn,), name="model-server-conn",
+                             daemon=True).start()
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                future = asyncio.run_coroutine_threadsafe(self._dispatch(request), self._loop)
+                future.add_done_callback(
+                    lambda done, request_id=request.get("id"): self._reply(conn, send_lock, request_id, done))
+        finally:
+            self._connections.discard(conn)
+            conn.close()
+
+    @staticmethod
+    def _reply(conn, send_lock, request_id, done):
+        try:
+            message = {"id": request_id, "ok": True, "result": done.result()}
+        except Exception as e:
+            message = {"id": request_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+        try:
+            with send_lock:
+                conn.send(message)
+        except (OSError, ValueError):
+            pass  # worker went away
+
+    # === Requests ===
+    async def _dispatch(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return self.status()
+
+        await self.ready.wait()
+        slices = slices_from_shm(request)
+        stats = {}
+        if op == "predict":
+            explain_index = request.get("explain_index")
+            result = await self.scheduler.predict(slices, explain_index=explain_index, stats=stats)
+            cam = None
+            if explain_index is not None:
+                label, confidence, activations = result
+                cam = await self._explain(slices[explain_index:explain_index + 1], activations)
+            else:
+                label, confidence = result
+            return {"label": label, "confidence": confidence, "cam": cam, "metrics": self.scheduler.metrics(), **stats}
+        if op == "volume":
+            label, confidence, activations = await self.scheduler.predict_volume(slices, stats=stats)
+            cams, saliency = None, None
+            if self.explain_model is not None:
+                cams, saliency = await self._loop.run_in_executor(
+                    None, explain_volume, self.explain_model, slices, activations, self.device)
+                cams = cams.astype(np.float16)  # half the bytes on the wire; heatmaps need no more
+            return {"label": label, "confidence": confidence, "cams": cams, "saliency": saliency,
+                    "metrics": self.scheduler.metrics(), **stats}
+        if op == "probs":
+            probs = await self.scheduler.predict_slices(slices, stats=stats)
+            return {"probs": probs.numpy(), "metrics": self.scheduler.metrics(), **stats}
+        if op == "explain":
+            return {"cam": await self._explain(slices[:1], None)}
+        raise ValueError(f"Unknown op '{op}'")
+
+    async def _explain(self, slice_tensor, activations):
+        if self.explain_model is None:
+            return None
+        return await self._loop.run_in_executor(None, explain_slice, self.explain_model, slice_tensor,
+                                                activations, self.device)
+
+
+# === Client (HTTP workers) ===
+class _ServerConnection:
+    """One multiplexed connection to a model server; replies are matched by request id."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.conn = None
+        self.pending = {}
+        self.status = None
+        self._send_lock = threading.Lock()
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        return self.conn is not None
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.conn is not None:
+                return
+            loop = asyncio.get_running_loop()
+            self.conn = await loop.run_in_executor(None, Client, self.address, "AF_UNIX", self.authkey)
+            threading.Thread(target=self._read, args=(self.conn, loop), name="model-client-read",
+                             daemon=True).start()
+
+    def send(self, message):
+        conn = self.conn
+        if conn is None:
+            raise ModelServerError(f"Not connected to model server at {self.address}")
+        try:
+            with self._send_lock:
+                conn.send(message)
+        except (OSError, ValueError) as e:
+            raise ModelServerError(f"Lost connection to model server at {self.address}: {e}")
+
+    def _read(self, conn, loop):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            loop.call_soon_threadsafe(self._resolve, message)
+        loop.call_soon_threadsafe(self._disconnected, conn)
+
+    def _resolve(self, message):
+        future = self.pending.pop(message["id"], None)
+        if future is None or future.done():
+            return
+        if message["ok"]:
+            future.set_result(message["result"])
+        else:
+            future.set_exception(ModelServerError(message["error"]))
+
+    def _disconnected(self, conn):
+        if self.conn is conn:
+            self.conn = None
+            self.status = None
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ModelServerError(f"Lost connection to model server at {self.address}"))
+        self.pending.clear()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class ModelClient:
+    """
+    Drop-in for InferenceScheduler in HTTP workers that don't load the model.
+
+    Slices are written to shared memory and scored by a ModelServer; with
+    several servers each request goes to the connected one with the fewest
+    requests in flight. predict(..., explain_index=i) returns the Grad-CAM
+    heatmap of slice i (computed by the server) where InferenceScheduler
+    returns activations; likewise predict_volume() returns the finished
+    heatmaps of every slice.
+    """
+
+    def __init__(self, addresses, authkey: bytes, request_timeout_s=300.0):
+        check_authkey(authkey)
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self._servers = [_ServerConnection(address, authkey) for address in addresses]
+        self.request_timeout_s = request_timeout_s
+        self.model_version = None
+        self._ids = itertools.count()
+
+    # === Lifecycle ===
+    def start(self):
+        """Connections are opened lazily (and re-opened after a server restart)."""
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+
+    async def ping(self):
+        """Status of every server ({address: status dict or error string})."""
+        statuses = {}
+        for server in self._servers:
+            try:
+                await server.connect()
+                server.status = await self._request(server, {"op": "ping"}, timeout=5.0)
+                statuses[server.address] = server.status
+            except Exception as e:
+                statuses[server.address] = f"{type(e).__name__}: {e}"
+        return statuses
+
+    @property
+    def ready(self):
+        return any(s.status is not None and s.status.get("status") == "ready" and s.connected for s in self._servers)
+
+    async def wait_ready(self, poll_s=0.5, timeout_s=None):
+        """Wait until at least one server has finished warming up; returns its model version."""
+        deadline = None if timeout_s is None else time.monotonic() + timeout_s
+        while True:
+            await self.ping()
+            if self.ready:
+                ready = [s.status for s in self._servers if s.status and s.status.get("status") == "ready"]
+                self.model_version = ready[0]["model_version"]
+                return self.model_version
+            if deadline is not None and time.monotonic() > deadline:
+                raise ModelServerError("No model server became ready in time.")
+            await asyncio.sleep(poll_s)
+
+    # === Public API (mirrors InferenceScheduler) ===
+    async def predict(self, processed_slices, explain_index=None, stats=None):
+        slices = _as_slices(processed_slices)
+        if explain_index is not None:
+            explain_index %= len(slices)
+        result = await self._call("predict", slices, explain_index=explain_index)
+        _update_stats(stats, result)
+        if explain_index is None:
+            return result["label"], result["confidence"]
+        return result["label"], result["confidence"], result["cam"]
+
+    async def predict_volume(self, processed_slices, stats=None):
+        """(label, confidence, (cams, saliency) or None), see visualization.explain_volume."""
+        result = await self._call("volume", _as_slices(processed_slices))
+        _update_stats(stats, result)
+        explanation = None
+        if result["cams"] is not None:
+            explanation = (result["cams"].astype(np.float32), result["saliency"])
+        return result["label"], result["confidence"], explanation
+
+    async def predict_slices(self, processed_slices, stats=None):
+        result = await self._call("probs", _as_slices(processed_slices))
+        _update_stats(stats, result)
+        return torch.from_numpy(result["probs"])
+
+    async def explain(self, slice_tensor):
+        """Grad-CAM heatmap of one (1, 3, 224, 224) slice (or (1, 224, 224) uint8)."""
+        return (await self._call("explain", _as_slices(slice_tensor)))["cam"]
+
+    def metrics(self):
+        """Scheduler metrics as last reported by the servers, plus this worker's requests in flight."""
+        reported = [s.status["metrics"] for s in self._servers if s.status and "metrics" in s.status]
+        merged = {"queue_depth": 0, "avg_batch_fill": 0.0, "batches_run": 0, "slices_run": 0, "scans_completed": 0}
+        for snapshot in reported:
+            for key in ("queue_depth", "batches_run", "slices_run", "scans_completed"):
+                merged[key] += snapshot.get(key, 0)
+        if reported:
+            merged["avg_batch_fill"] = sum(m.get("avg_batch_fill", 0.0) for m in reported) / len(reported)
+        merged["in_flight"] = sum(len(s.pending) for s in self._servers)
+        merged["servers"] = {s.address: s.connected for s in self._servers}
+        return merged
+
+    # === Transport ===
+    async def _pick_server(self):
+        connected = [s for s in self._servers if s.connected]
+        if not connected:
+            errors = []
+            for server in self._servers:
+                try:
+                    await server.connect()
+                    connected.append(server)
+                except OSError as e:
+                    errors.append(f"{server.address}: {e}")
+            if not connected:
+                raise ModelServerError(f"No model server reachable ({'; '.join(errors)})")
+        return min(connected, key=lambda s: len(s.pending))
+
+    async def _call(self, op, slices, **fields):
+        if len(slices) == 0:
+            raise ValueError("❌ No preprocessed slices found for prediction.")
+        server = await self._pick_server()
+        block, header = slices_to_shm(slices)
+        try:
+            result = await self._request(server, {"op": op, **header, **fields}, timeout=self.request_timeout_s)
+        finally:
+            block.close()
+            block.unlink()
+            _created_blocks.discard(block._name)
+        if "metrics" in result and server.status is not None:
+            server.status["metrics"] = result.pop("metrics")
+        return result
+
+    async def _request(self, server, message, timeout):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        server.pending[request_id] = future
+        try:
+            server.send(dict(message, id=request_id))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            server.pending.pop(request_id, None)
+
+
+def _as_slices(processed_slices):
+    """Tensors and uint8 slice stacks are sent as they are; lists of tensors are stacked."""
+    if isinstance(processed_slices, (torch.Tensor, np.ndarray)):
+        return processed_slices
+    return torch.stack(processed_slices)
+
+
+def _update_stats(stats, result):
+    if stats is not None:
+        stats.update(cpu_s=result.get("cpu_s", 0.0), batches=result.get("batches", 0))
@@ -0,0 +1,172 @@
+# modules/pipeline.py
+import numpy as np
+
+from modules.input_loader import load_mri
+from modules.preprocessing import (
+    preprocess_volume_batch,
+    preprocess_volume_uint8,
+    preprocessing_params,
+    select_slice_indices,
+    uint8_input_to_tensor,
+)
+from modules.result_cache import hash_source
+from modules.tracing import measure
+
+
+class PreparedScan:
+    """
+    Everything later stages need from one loaded + preprocessed scan.
+    Holds the model-ready batch, not the raw volume, so it is cheap to keep
+    around and to send back from a worker process.
+
+    Attributes:
+        slices (torch.Tensor): (N, 3, 224, 224) model input, or (N, 224, 224)
+            uint8 slices when prepared with uint8=True (see as_model_input)
+        indices (np.ndarray): depth index of each row in slices
+        shape (tuple): (H, W, D) of the source volume
+        explain_position (int): row in slices chosen for the Grad-CAM report
+            (the selected slice closest to depth D // 2)
+        explain_slice (np.ndarray): raw float32 slice for that row (for overlays)
+        spans (list): tracing spans of the load and preprocess stages (or
+            of the slice_store read that replaced them)
+        bbox (tuple): (y0, y1, x0, x1) foreground box every slice was cropped
+            to before resizing, or None when uncropped
+        affine (np.ndarray): NIfTI voxel-to-world affine, or None (DICOM)
+        overlay_slices (np.ndarray): (N, H, W) uint8 raw slices, each scaled
+            to 0-255, so any row can be explained later (see explain_at);
+            None unless requested
+    """
+
+    def __init__(self, slices, indices, shape, explain_position, explain_slice, spans=None, bbox=None,
+                 affine=None, overlay_slices=None):
+        self.slices = slices
+        self.indices = indices
+        self.shape = shape
+        self.explain_position = explain_position
+        self.explain_slice = explain_slice
+        self.spans = spans or []
+        self.bbox = bbox
+        self.affine = affine
+        self.overlay_slices = overlay_slices
+
+    def __len__(self):
+        return len(self.slices)
+
+    @property
+    def nbytes(self):
+        """Size of the model input as held (uint8 slices or the float tensor)."""
+        if isinstance(self.slices, np.ndarray):
+            return self.slices.nbytes
+        return self.slices.element_size() * self.slices.nelement()
+
+    def explain_at(self, position: int):
+        """Make row position the explained slice (needs overlay_slices)."""
+        if self.overlay_slices is None:
+            raise ValueError("explain_at needs a scan prepared with keep_overlay_slices=True.")
+        self.explain_position = int(position)
+        self.explain_slice = self.overlay_slices[self.explain_position].astype(np.float32)
+
+
+def prepare_scan(source, filename: str = None, slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0,
+                 on_loaded=None, crop: bool = False, keep_overlay_slices: bool = False, slice_store=None,
+                 content_sha256: str = None, uint8: bool = False):
+    """
+    Load → select slices → preprocess, in one worker-friendly call.
+
+    NIfTI inputs are opened lazily, so only the central slice window is ever
+    decoded to float32; DICOM series are loaded as before. on_loaded() is
+    called once the volume is open, for progress reporting (thread pools
+    only; callbacks cannot cross into worker processes). With crop=True the
+    slices are cropped to the brain's bounding box before resizing. With
+    keep_overlay_slices=True every selected raw slice is kept as uint8, so
+    the report can show whichever slice the volumetric Grad-CAM picks.
+
+    With a SliceStore (modules/slice_store.py) a scan preprocessed before
+    with the same parameters is read back instead (content_sha256 is
+    computed from source when not given); otherwise the result is stored
+    for next time. uint8=True returns the compact (N, 224, 224) uint8
+    slices instead of the float tensor.
+    """
+    # Step 0: Preprocessed before? Skip load and preprocessing altogether
+    params = preprocessing_params(slice_fraction, min_intensity_threshold, crop)
+    spans = []
+    if slice_store is not None:
+        with measure("slice_store") as store_span:
+            content_sha256 = content_sha256 or hash_source(source)
+            stored = slice_store.get(content_sha256, params, need_overlays=keep_overlay_slices)
+        if stored is not None:
+            if on_loaded is not None:
+                on_loaded()
+            store_span.slices = len(stored)
+            return scan_from_store(stored, uint8, spans=[store_span])
+        spans.append(store_span)
+
+    # Step 1: Open the volume (lazy for NIfTI)
+    with measure("load") as load_span:
+        volume = load_mri(source, filename=filename, lazy=True)
+    load_span.slices = int(volume.shape[-1])
+    if on_loaded is not None:
+        on_loaded()
+
+    # Step 2: Select and preprocess slices from the central window only
+    with measure("preprocess") as preprocess_span:
+        indices = select_slice_indices(volume, slice_fraction, min_intensity_threshold)
+        if slice_store is None and not uint8:
+            slices, bbox = preprocess_volume_batch(volume, indices=indices, crop=crop, return_bbox=True)
+        else:
+            # Stop at uint8 (the stored form); the tensor follows from it bit for bit
+            stack, bbox = preprocess_volume_uint8(volume, indices=indices, crop=crop)
+            slices = stack if uint8 else uint8_input_to_tensor(stack)
+    preprocess_span.slices = len(slices)
+    preprocess_span.tensor_bytes = slices.nbytes if uint8 else slices.element_size() * slices.nelement()
+
+    # Step 3: Keep the one raw slice the report overlay needs — the analyzed
+    # slice nearest the middle, so its preprocessed tensor can be reused
+    depth = volume.shape[-1]
+    explain_position = int(np.argmin(np.abs(np.asarray(indices) - depth // 2)))
+    explain_slice = np.asarray(volume[:, :, int(indices[explain_position])], dtype=np.float32)
+
+    overlay_slices = None
+    if keep_overlay_slices:
+        raw = np.asarray(volume[:, :, indices], dtype=np.float32)
+        overlay_slices = np.stack([to_uint8(raw[:, :, k]) for k in range(raw.shape[-1])])
+
+    affine = getattr(volume, "affine", None)
+    if slice_store is not None:
+        meta = {
+            "indices": [int(i) for i in indices],
+            "shape": [int(n) for n in volume.shape],
+            "bbox": [int(v) for v in bbox] if bbox is not None else None,
+            "explain_position": explain_position,
+            "affine": np.asarray(affine).tolist() if affine is not None else None,
+        }
+        slice_store.put(content_sha256, params, stack, meta, to_uint8(explain_slice), overlay_slices)
+
+    return PreparedScan(slices, indices, tuple(volume.shape), explain_position, explain_slice,
+                        spans=spans + [load_span, preprocess_span], bbox=bbox, affine=affine,
+                        overlay_slices=overlay_slices)
+
+
+def scan_from_store(stored, uint8: bool = False, spans=None):
+    """PreparedScan from a slice_store.StoredScan (uint8 slices stay memory-mapped)."""
+    meta = stored.meta
+    slices = stored.slices if uint8 else uint8_input_to_tensor(stored.slices)
+    return PreparedScan(
+        slices,
+        np.asarray(meta["indices"]),
+        tuple(meta["shape"]),
+        meta["explain_position"],
+        stored.explain_slice.astype(np.float32),
+        spans=spans,
+        bbox=tuple(meta["bbox"]) if meta["bbox"] is not None else None,
+        affine=np.asarray(meta["affine"]) if meta["affine"] is not None else None,
+        overlay_slices=stored.overlay_slices,
+    )
+
+
+def to_uint8(slice_2d):
+    """Min-max scale one slice to uint8 (the overlay normalizes the same way)."""
+    low, high = float(slice_2d.min()), float(slice_2d.max())
+    if high <= low:
+        return np.zeros(slice_2d.shape, dtype=np.uint8)
+    return np.rint((slice_2d - low) * (255.0 / (high - low))).astype(np.uint8)
@@ -1,9 +1,95 @@
 # modules/preprocessing.py
+import threading
+
 import numpy as np
+import torch
+import torch.nn.functional as F
 from PIL import Image
 from torchvision import transforms
 import cv2
 
+# DenseNet-121 input geometry and ImageNet statistics (shared by both paths)
+MODEL_INPUT_SIZE = 224
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Bump whenever preprocessing output changes, so cached results are not reused
+PREPROCESS_VERSION = 2
+
+
+class PreprocessingContext:
+    """
+    Reusable preprocessing state, built once per process instead of per slice.
+
+    - clahe(): one CLAHE object per thread (OpenCV's CLAHE keeps scratch
+      buffers, so instances are not shared between pool threads)
+    - scale / offset: ImageNet normalization folded into one multiply-add
+      on 0–255 values, as (1, 3, 1, 1) tensors
+    - cv2_threads / torch_threads: intra-op thread counts applied by
+      apply_threads(), so N preprocessing workers don't each spawn a full
+      OpenCV/torch pool next to the model's threads (None = library default)
+    """
+
+    def __init__(self, clip_limit: float = 2.0, tile_grid_size=(8, 8), cv2_threads: int = None,
+                 torch_threads: int = None, input_size: int = MODEL_INPUT_SIZE):
+        self.clip_limit = clip_limit
+        self.tile_grid_size = tuple(tile_grid_size)
+        self.cv2_threads = cv2_threads
+        self.torch_threads = torch_threads
+        self.size = (input_size, input_size)
+
+        mean = torch.tensor(IMAGENET_MEAN, dtype=torch.float32).view(1, 3, 1, 1)
+        std = torch.tensor(IMAGENET_STD, dtype=torch.float32).view(1, 3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.offset = -mean / std
+        self._local = threading.local()
+
+    def clahe(self):
+        clahe = getattr(self._local, "clahe", None)
+        if clahe is None:
+            clahe = self._local.clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=self.tile_grid_size)
+        return clahe
+
+    def apply_threads(self):
+        """
+        Apply the thread limits to this process. Both settings are process-wide:
+        in a thread pool that shares the process with the model, leave
+        torch_threads None so the model's own setting is kept.
+        """
+        if self.cv2_threads is not None:
+            cv2.setNumThreads(self.cv2_threads)
+        if self.torch_threads is not None:
+            torch.set_num_threads(self.torch_threads)
+
+
+_context = PreprocessingContext()
+
+
+def get_preprocessing_context():
+    return _context
+
+
+def configure_preprocessing(cv2_threads: int = None, torch_threads: int = None, **options):
+    """
+    Install a new default PreprocessingContext for this process and apply
+    its thread limits. Module-level so it can serve as a pool initializer.
+    """
+    global _context
+    _context = PreprocessingContext(cv2_threads=cv2_threads, torch_threads=torch_threads, **options)
+    _context.apply_threads()
+    return _context
+
+
+def preprocessing_params(slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0, crop: bool = False):
+    """Everything that determines preprocessing output, for cache keys."""
+    return {
+        "version": PREPROCESS_VERSION,
+        "slice_fraction": slice_fraction,
+        "min_intensity_threshold": min_intensity_threshold,
+        "input_size": MODEL_INPUT_SIZE,
+        "crop": crop,
+    }
+
 
 def normalize_intensity(slice_2d: np.ndarray):
     """
@@ -23,12 +109,12 @@ def normalize_intensity(slice_2d: np.ndarray):
     return slice_2d
 
 
-def enhance_contrast(slice_2d: np.ndarray):
+def enhance_contrast(slice_2d: np.ndarray, context: PreprocessingContext = None):
     """
     Apply CLAHE (adaptive histogram equalization) to improve local contrast.
     Enhances tumor boundaries for the model.
     """
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    clahe = (context or _context).clahe()
     enhanced = clahe.apply(slice_2d)
     return enhanced
 
@@ -60,26 +146,87 @@ def extract_slices(volume: np.ndarray, slice_fraction: float = 0.6, min_intensit
     return selected_slices
 
 
-# 🔧 Model input transform
+def _fit_span(start: int, stop: int, size: int, limit: int):
+    """Grow or shrink [start, stop) to `size` around its centre, kept inside [0, limit)."""
+    size = min(size, limit)
+    begin = int(round((start + stop - size) / 2))
+    begin = min(max(begin, 0), limit - size)
+    return begin, begin + size
+
+
+def foreground_bbox(stack: np.ndarray, threshold_fraction: float = 0.1, min_fraction: float = 0.005,
+                    margin: float = 0.05, square: bool = True):
+    """
+    3D bounding box of the brain in an (N, H, W) slice stack, shared by all
+    slices so they stay aligned.
+
+    Voxels above min + threshold_fraction × (max − min) count as foreground;
+    the mask is projected onto the row and column axes, and rows/columns
+    with fewer than min_fraction of their voxels set are ignored (isolated
+    noise). The box is padded by `margin` of its size and, with square=True,
+    widened to a square so the resize to 224×224 keeps the aspect ratio.
+
+    Returns:
+        tuple: (y0, y1, x0, x1) in slice coordinates (the full slice when no
+        foreground is found)
+    """
+    count, height, width = stack.shape
+    full = (0, height, 0, width)
+    lo, hi = float(stack.min()), float(stack.max())
+    if hi <= lo:
+        return full
+
+    # Step 1: Threshold once, then project onto each in-plane axis
+    mask = stack > lo + threshold_fraction * (hi - lo)
+    row_counts = mask.sum(axis=(0, 2))
+    col_counts = mask.sum(axis=(0, 1))
+    rows = np.flatnonzero(row_counts > min_fraction * count * width)
+    cols = np.flatnonzero(col_counts > min_fraction * count * height)
+    if len(rows) == 0 or len(cols) == 0:
+        return full
+
+    # Step 2: Pad, then square up around the centre
+    y0, y1, x0, x1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+    pad = int(round(margin * max(y1 - y0, x1 - x0)))
+    y0, y1 = max(y0 - pad, 0), min(y1 + pad, height)
+    x0, x1 = max(x0 - pad, 0), min(x1 + pad, width)
+    if square:
+        side = max(y1 - y0, x1 - x0)
+        y0, y1 = _fit_span(y0, y1, side, height)
+        x0, x1 = _fit_span(x0, x1, side, width)
+    return y0, y1, x0, x1
+
+
+def crop_to_bbox(slice_or_stack: np.ndarray, bbox):
+    """Crop the last two axes of a slice (H, W) or stack (N, H, W) to (y0, y1, x0, x1)."""
+    if bbox is None:
+        return slice_or_stack
+    y0, y1, x0, x1 = bbox
+    return slice_or_stack[..., y0:y1, x0:x1]
+
+
+# 🔧 Torchvision model input transform (PIL-based; the batched pipeline
+# uses the equivalent uint8_stack_to_tensor below)
 preprocess_transform = transforms.Compose([
-    transforms.Resize((224, 224)),                 # Resize to DenseNet expected input
+    transforms.Resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)),  # Resize to DenseNet expected input
     transforms.Grayscale(num_output_channels=3),   # Convert single channel → 3 channels
     transforms.ToTensor(),                         # Convert to torch tensor
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],  # ImageNet normalization
-                         std=[0.229, 0.224, 0.225])
+    transforms.Normalize(mean=IMAGENET_MEAN,       # ImageNet normalization
+                         std=IMAGENET_STD)
 ])
 
 
-def preprocess_slice(slice_2d: np.ndarray):
+def preprocess_slice(slice_2d: np.ndarray, context: PreprocessingContext = None):
     """
     Preprocess a single MRI slice for DenseNet-121 inference.
     Steps: normalize → enhance contrast → convert → tensorize.
+    This is the PIL/torchvision reference the faster paths are checked against.
     """
     # Step 1: Normalize
     slice_2d = normalize_intensity(slice_2d)
 
     # Step 2: Enhance local contrast
-    slice_2d = enhance_contrast(slice_2d)
+    slice_2d = enhance_contrast(slice_2d, context)
 
     # Step 3: Convert to PIL Image for torchvision
     img = Image.fromarray(slice_2d).convert("L")
@@ -89,21 +236,235 @@ def preprocess_slice(slice_2d: np.ndarray):
     return img_tensor
 
 
-def preprocess_volume(volume: np.ndarray, slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0):
+def preprocess_slice_torch(slice_2d: np.ndarray, context: PreprocessingContext = None):
+    """
+    preprocess_slice without the PIL round trip: resize and normalize in
+    torch like the batched path. Matches preprocess_slice up to resize
+    rounding (about one grey level, < 0.05 after normalization).
+    """
+    slice_2d = enhance_contrast(normalize_intensity(slice_2d), context)
+    return uint8_stack_to_tensor(slice_2d[np.newaxis], context=context)[0]
+
+
+def preprocess_volume(volume: np.ndarray, slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0,
+                      crop: bool = False, context: PreprocessingContext = None):
     """
     Extract and preprocess a set of slices from a 3D MRI volume.
     Returns a list of torch tensors ready for DenseNet inference.
+    With crop=True every slice is first cropped to the foreground_bbox of
+    the selection.
     """
     # Step 1: Extract clean central slices
     slices = extract_slices(volume, slice_fraction, min_intensity_threshold)
+    if crop:
+        bbox = foreground_bbox(np.stack(slices).astype(np.float32))
+        slices = [crop_to_bbox(s, bbox) for s in slices]
 
     # Step 2: Preprocess all slices
-    preprocessed_slices = [preprocess_slice(s) for s in slices if s is not None]
+    preprocessed_slices = [preprocess_slice(s, context) for s in slices if s is not None]
 
     # Step 3: Safety fallback (ensure non-empty tensor list)
     if len(preprocessed_slices) == 0:
         print("⚠️ preprocess_volume: No valid slices, adding fallback middle slice.")
         mid = volume.shape[-1] // 2
-        preprocessed_slices = [preprocess_slice(volume[:, :, mid])]
+        preprocessed_slices = [preprocess_slice(volume[:, :, mid], context)]
 
     return preprocessed_slices
+
+
+# === Batched path ===
+# The functions below process the whole slice selection at once and are
+# numerically equivalent (up to resize rounding) to preprocess_slice above,
+# which stays as the per-slice reference implementation.
+
+def select_slice_indices(volume: np.ndarray, slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0):
+    """
+    Vectorized counterpart of extract_slices that returns depth indices
+    instead of slice views.
+
+    Returns:
+        np.ndarray: sorted indices along the last axis of the volume
+    """
+    depth = volume.shape[-1]
+    start = int(depth * (1 - slice_fraction) / 2)
+    end = int(depth * (1 + slice_fraction) / 2)
+
+    # One reduction over the central window instead of a mean per slice
+    window = np.asarray(volume[:, :, start:end])
+    means = window.reshape(-1, window.shape[-1]).mean(axis=0)
+    indices = np.flatnonzero(means > min_intensity_threshold) + start
+
+    if len(indices) == 0:
+        print("⚠️ All slices below intensity threshold. Using middle slice fallback.")
+        indices = np.array([depth // 2])
+
+    return indices
+
+
+def normalize_intensity_batch(stack: np.ndarray):
+    """
+    Apply normalize_intensity to every slice of an (N, H, W) stack at once.
+    Percentiles, clipping and min/max scaling are computed per slice in a
+    single vectorized step. Returns a uint8 array of the same shape.
+    """
+    # float64 working copy keeps results bit-identical to normalize_intensity
+    rows = np.array(stack, dtype=np.float64).reshape(stack.shape[0], -1)
+
+    # Constant slices map to zeros, as in normalize_intensity
+    constant = rows.max(axis=1) == rows.min(axis=1)
+
+    # Per-slice 1st/99th percentiles, shape (N, 1) each
+    p1, p99 = np.percentile(rows, (1, 99), axis=1, keepdims=True)
+    np.clip(rows, p1, p99, out=rows)
+
+    # Normalize to 0–255 range (in place on the working copy)
+    lo = rows.min(axis=1, keepdims=True)
+    hi = rows.max(axis=1, keepdims=True)
+    rows -= lo
+    rows /= hi - lo + 1e-8
+    rows *= 255
+    normalized = rows.astype(np.uint8)
+    normalized[constant] = 0
+    return normalized.reshape(stack.shape)
+
+
+def enhance_contrast_batch(stack: np.ndarray, context: PreprocessingContext = None):
+    """
+    Apply CLAHE to every slice of an (N, H, W) uint8 stack.
+    Returns a new (N, H, W) uint8 array.
+    """
+    clahe = (context or _context).clahe()
+    enhanced = np.empty_like(stack)
+    for i in range(stack.shape[0]):
+        enhanced[i] = clahe.apply(np.ascontiguousarray(stack[i]))
+    return enhanced
+
+
+def uint8_stack_to_tensor(stack: np.ndarray, out: torch.Tensor = None, chunk_size: int = 32,
+                          context: PreprocessingContext = None):
+    """
+    Resize, replicate to 3 channels and ImageNet-normalize an (N, H, W)
+    uint8 stack, writing straight into one (N, 3, 224, 224) float tensor.
+
+    Args:
+        stack (np.ndarray): enhanced slices, (N, H, W) uint8
+        out (torch.Tensor): optional preallocated output tensor
+        chunk_size (int): slices resized together (bounds temporary memory)
+        context (PreprocessingContext): normalization constants (default: the process context)
+    """
+    context = context or _context
+    count = stack.shape[0]
+    size = context.size
+    if out is None:
+        out = torch.empty((count, 3) + size, dtype=torch.float32)
+
+    for begin in range(0, count, chunk_size):
+        end = min(begin + chunk_size, count)
+        chunk = torch.from_numpy(np.ascontiguousarray(stack[begin:end])).unsqueeze(1).float()
+
+        # Antialiased bilinear resize matches torchvision's PIL Resize;
+        # rounding mimics the uint8 image PIL hands to ToTensor.
+        resized = F.interpolate(chunk, size=size, mode="bilinear", align_corners=False, antialias=True)
+        resized = resized.round_().clamp_(0, 255)
+
+        # (x / 255 - mean) / std as one multiply-add per channel
+        target = out[begin:end]
+        target.copy_(resized.expand(-1, 3, -1, -1))
+        target.mul_(context.scale).add_(context.offset)
+
+    return out
+
+
+def resize_uint8_stack(stack: np.ndarray, chunk_size: int = 32, context: PreprocessingContext = None):
+    """
+    Resize an (N, H, W) uint8 stack to (N, 224, 224) uint8 exactly as
+    uint8_stack_to_tensor does before normalizing, so
+    uint8_input_to_tensor(resize_uint8_stack(s)) equals uint8_stack_to_tensor(s).
+    """
+    size = (context or _context).size
+    resized = np.empty((stack.shape[0],) + size, dtype=np.uint8)
+    for begin in range(0, stack.shape[0], chunk_size):
+        chunk = torch.from_numpy(np.ascontiguousarray(stack[begin:begin + chunk_size])).unsqueeze(1).float()
+        chunk = F.interpolate(chunk, size=size, mode="bilinear", align_corners=False, antialias=True)
+        resized[begin:begin + chunk_size] = chunk.round_().clamp_(0, 255)[:, 0].to(torch.uint8).numpy()
+    return resized
+
+
+def uint8_input_to_tensor(stack: np.ndarray, out: torch.Tensor = None, chunk_size: int = 32,
+                          context: PreprocessingContext = None):
+    """
+    Replicate to 3 channels and ImageNet-normalize (N, 224, 224) uint8
+    slices that are already model-sized (see resize_uint8_stack). Works on
+    read-only memory maps; only chunk_size slices are copied at a time.
+    """
+    context = context or _context
+    count = stack.shape[0]
+    if out is None:
+        out = torch.empty((count, 3) + tuple(stack.shape[1:]), dtype=torch.float32)
+    for begin in range(0, count, chunk_size):
+        end = min(begin + chunk_size, count)
+        chunk = torch.from_numpy(np.array(stack[begin:end])).unsqueeze(1).float()
+        target = out[begin:end]
+        target.copy_(chunk.expand(-1, 3, -1, -1))
+        target.mul_(context.scale).add_(context.offset)
+    return out
+
+
+def as_model_input(slices):
+    """Model input from a tensor, a list of (3, 224, 224) tensors or (N, 224, 224) uint8 slices."""
+    if isinstance(slices, torch.Tensor):
+        return slices
+    if isinstance(slices, np.ndarray):
+        return uint8_input_to_tensor(slices)
+    return torch.stack(list(slices))
+
+
+def preprocess_volume_uint8(volume: np.ndarray, slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0,
+                            indices=None, crop: bool = False, context: PreprocessingContext = None):
+    """
+    preprocess_volume_batch up to (and including) the resize, stopping at
+    uint8: returns ((N, 224, 224) uint8 slices, bbox). One twelfth the size
+    of the float tensor, so it is the form worth keeping (modules/slice_store.py).
+    """
+    if indices is None:
+        indices = select_slice_indices(volume, slice_fraction, min_intensity_threshold)
+    stack = np.moveaxis(np.asarray(volume[:, :, indices], dtype=np.float32), -1, 0)
+    bbox = foreground_bbox(stack) if crop else None
+    stack = np.ascontiguousarray(crop_to_bbox(stack, bbox))
+    stack = enhance_contrast_batch(normalize_intensity_batch(stack), context)
+    return resize_uint8_stack(stack, context=context), bbox
+
+
+def preprocess_volume_batch(volume: np.ndarray, slice_fraction: float = 0.6, min_intensity_threshold: float = 10.0,
+                            indices=None, crop: bool = False, return_bbox: bool = False,
+                            context: PreprocessingContext = None):
+    """
+    Batched equivalent of preprocess_volume.
+    Returns a single (N, 3, 224, 224) float tensor instead of a list of tensors.
+
+    Args:
+        volume (np.ndarray): 3D MRI volume (H, W, D)
+        indices: optional precomputed slice indices (see select_slice_indices)
+        crop (bool): crop the stack to its foreground_bbox before normalizing
+        return_bbox (bool): return (tensor, bbox) instead; bbox is None
+            without crop
+        context (PreprocessingContext): CLAHE and normalization state
+            (default: the process context)
+    """
+    # Step 1: Pick slices with one vectorized reduction
+    if indices is None:
+        indices = select_slice_indices(volume, slice_fraction, min_intensity_threshold)
+
+    # Step 2: Gather selection as one contiguous (N, H, W) float32 stack
+    stack = np.asarray(volume[:, :, indices], dtype=np.float32)
+    stack = np.moveaxis(stack, -1, 0)
+
+    # Step 3: Drop the empty background around the brain (one box for all slices)
+    bbox = foreground_bbox(stack) if crop else None
+    stack = np.ascontiguousarray(crop_to_bbox(stack, bbox))
+
+    # Step 4: Normalize → enhance contrast → tensorize
+    stack = normalize_intensity_batch(stack)
+    stack = enhance_contrast_batch(stack, context)
+    tensor = uint8_stack_to_tensor(stack, context=context)
+    return (tensor, bbox) if return_bbox else tensor
@@ -0,0 +1,194 @@
+# modules/publisher.py
+import asyncio
+import inspect
+import time
+import uuid
+from collections import OrderedDict
+
+
+class Artifact:
+    """
+    One in-memory file to upload; field is the report row column that gets
+    its URL. With in_report=False the URL is only exposed on the job (for
+    files the reports table has no column for).
+    """
+
+    def __init__(self, bucket, name, data, content_type, field, in_report=True):
+        self.bucket = bucket
+        self.name = name
+        self.data = data
+        self.content_type = content_type
+        self.field = field
+        self.in_report = in_report
+
+
+class PublishJob:
+    """
+    Status of one background publish: pending → uploading → writing →
+    published | partial | failed. partial: the rows were written but some
+    artifacts could not be uploaded (their URLs are None, error names them).
+    """
+
+    def __init__(self, job_id, urls):
+        self.job_id = job_id
+        self.status = "pending"
+        self.urls = urls
+        self.unlinked = set()  # url fields kept out of the report row
+        self.analysis_id = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.finished = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in ("published", "partial", "failed")
+
+    def as_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "urls": self.urls,
+            "analysis_id": self.analysis_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ArtifactPublisher:
+    """
+    Publishes analysis artifacts after the response has been sent.
+
+    submit() returns at once with a PublishJob whose URLs are already final
+    (storage URLs are deterministic). In the background the artifacts are
+    uploaded concurrently, then the analysis_results and reports rows are
+    written, each call retried with exponential backoff. Row ids are chosen
+    here (uuid4) before the first attempt, so a retry after an insert that
+    timed out but was committed does not add a second row.
+
+    Args:
+        storage: object with upload(bucket, name, data, content_type) and
+            public_url(bucket, name) (SupabaseStorage or LocalStorage)
+        insert_row: blocking insert_row(table, row) returning the row id;
+            must ignore a row whose id already exists (Database.insert)
+        run_io: coroutine function that runs a blocking call off the event
+            loop (StagedExecutor.run_io)
+    """
+
+    def __init__(self, storage, insert_row, run_io, retries=3, backoff_s=0.5, max_jobs=1024):
+        self.storage = storage
+        self.insert_row = insert_row
+        self.run_io = run_io
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._tasks = set()
+
+    # === Public API ===
+    def submit(self, artifacts=(), analysis_row=None, report_row=None, on_published=None, urls=None,
+               extra_urls=None):
+        """
+        Schedule a publish on the running event loop and return its PublishJob.
+
+        analysis_row is inserted into analysis_results first; its id becomes
+        report_row["analysis_id"]. Without analysis_row, report_row must carry
+        its own analysis_id (e.g. a cached result linked to a new patient).
+        urls adds already published URLs to the job and report row;
+        extra_urls adds them to the job only.
+        on_published(job) runs after everything was written; when it returns
+        an awaitable (e.g. a coroutine function), the publish awaits it.
+        """
+        job_urls = dict(urls or {})
+        job_urls.update({a.field: self.storage.public_url(a.bucket, a.name) for a in artifacts})
+        job_urls.update(extra_urls or {})
+        job = PublishJob(uuid.uuid4().hex, job_urls)
+        job.unlinked = {a.field for a in artifacts if not a.in_report} | set(extra_urls or {})
+        self._remember(job)
+
+        task = asyncio.get_running_loop().create_task(
+            self._publish(job, list(artifacts), analysis_row, report_row, on_published))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    async def drain(self):
+        """Wait for background publishes (called on shutdown)."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    # === Background stage ===
+    async def _publish(self, job, artifacts, analysis_row, report_row, on_published):
+        try:
+            # Step 1: Upload all artifacts at once; a failed upload leaves its URL empty
+            job.status = "uploading"
+            results = await asyncio.gather(
+                *(self._retry(self.storage.upload, a.bucket, a.name, a.data, a.content_type) for a in artifacts),
+                return_exceptions=True,
+            )
+            failed_uploads = []
+            for artifact, result in zip(artifacts, results):
+                if isinstance(result, Exception):
+                    print(f"⚠️ Upload of {artifact.bucket}/{artifact.name} failed:", result)
+                    job.urls[artifact.field] = None
+                    failed_uploads.append(f"{artifact.bucket}/{artifact.name}")
+                artifact.data = None  # release the buffer early
+
+            # Step 2: Write the analysis row, then the report row that points at it
+            job.status = "writing"
+            if analysis_row is not None:
+                analysis_row = dict(analysis_row, id=analysis_row.get("id") or str(uuid.uuid4()))
+                job.analysis_id = await self._retry(self.insert_row, "analysis_results", analysis_row)
+            if report_row is not None:
+                report_row = dict(report_row, **{k: v for k, v in job.urls.items() if k not in job.unlinked})
+                report_row.setdefault("id", str(uuid.uuid4()))
+                if job.analysis_id is not None:
+                    report_row["analysis_id"] = job.analysis_id
+                else:
+                    job.analysis_id = report_row.get("analysis_id")
+                await self._retry(self.insert_row, "reports", report_row)
+
+            if failed_uploads:
+                # The client already holds these URLs; say they are not there
+                job.status = "partial"
+                job.error = f"Upload failed: {', '.join(failed_uploads)}"
+            else:
+                job.status = "published"
+            if on_published is not None:
+                done = on_published(job)
+                if inspect.isawaitable(done):
+                    await done
+            print(f"✅ Published {job.job_id} ({job.status}): {job.urls}")
+
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"❌ Publishing {job.job_id} failed:", e)
+        finally:
+            job.finished_at = time.time()
+            job.finished.set()
+
+    async def _retry(self, fn, *args):
+        for attempt in range(self.retries):
+            try:
+                return await self.run_io(fn, *args)
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                await asyncio.sleep(self.backoff_s * 2 ** attempt)
+
+    def _remember(self, job):
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest.done:
+                break
+            del self._jobs[oldest_id]
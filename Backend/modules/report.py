@@ -0,0 +1,32 @@
+# modules/report.py
+import io
+
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+
+
+# === Text summary ===
+def generate_text_report(prediction: str, confidence: float) -> str:
+    return (
+        f"<b>Prediction:</b> {prediction}<br/>"
+        f"<b>AI Confidence:</b> {confidence:.2f}%<br/><br/>"
+        "🧠 This report was generated using an AI-powered model trained to analyze MRI brain scans. "
+        "It detects abnormal tissue regions and predicts tumor categories using deep learning. "
+        "Please consult a medical professional for confirmation."
+    )
+
+
+# === PDF report (in memory) ===
+def create_pdf_report(text) -> bytes:
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+    content = [
+        Paragraph("Brain MRI AI Diagnostic Report", styles["Title"]),
+        Spacer(1, 0.2 * inch),
+        Paragraph(text, styles["BodyText"]),
+    ]
+    doc.build(content)
+    return buffer.getvalue()
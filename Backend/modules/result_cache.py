@@ -0,0 +1,149 @@
+# modules/result_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_stream(fileobj, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """SHA-256 of a binary stream read in chunks; the stream is rewound afterwards."""
+    digest = hashlib.sha256()
+    start = fileobj.tell()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(start)
+    return digest.hexdigest()
+
+
+def hash_source(source) -> str:
+    """
+    SHA-256 of upload content given as bytes, a seekable stream or a path
+    (the file's bytes; for a DICOM folder, its sorted file names and bytes).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    if isinstance(source, (str, os.PathLike)):
+        if os.path.isdir(source):
+            digest = hashlib.sha256()
+            for name in sorted(os.listdir(source)):
+                if not os.path.isfile(os.path.join(source, name)):
+                    continue
+                with open(os.path.join(source, name), "rb") as f:
+                    digest.update(name.encode("utf-8") + b"\0" + bytes.fromhex(hash_stream(f)))
+            return digest.hexdigest()
+        with open(source, "rb") as f:
+            return hash_stream(f)
+    return hash_stream(source)
+
+
+def make_cache_key(content_sha256: str, model_version: str, params: dict) -> str:
+    """Key = scan content + model version + preprocessing parameters."""
+    material = json.dumps({"content": content_sha256, "model": model_version, "params": params}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of analysis results (small JSON-serialisable dicts).
+
+    - memory: LRU bounded by max_entries
+    - disk: one JSON file per key under disk_dir, evicted oldest-first
+      once the tier grows past max_disk_bytes (disk_dir=None disables it)
+
+    Safe to use from worker threads.
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: str = None, max_disk_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # === Public API ===
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    def stats(self):
+        with self._lock:
+            return {"memory_entries": len(self._memory), "hits": self.hits, "misses": self.misses,
+                    "disk_bytes": self._disk_usage()[0] if self.disk_dir else 0}
+
+    # === Memory tier ===
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # === Disk tier ===
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used for eviction
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        tmp = self._path(key) + f".{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, self._path(key))
+        self._evict_disk()
+
+    def _disk_usage(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.disk_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return sum(size for _, size, _ in entries), entries
+
+    def _evict_disk(self):
+        total, entries = self._disk_usage()
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+                total -= size
+            except OSError:
+                pass
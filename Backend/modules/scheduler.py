@@ -0,0 +1,283 @@
+# modules/scheduler.py
+import asyncio
+import time
+from collections import deque
+
+import torch
+import torch.nn.functional as F
+
+from modules.inference import ScanAccumulator, resolve_batch_size
+from modules.tracing import cpu_clock
+from modules.visualization import capture_activations, find_cam_layer
+
+
+class _PendingScan:
+    """One request's slices plus its progress through the shared batches."""
+
+    def __init__(self, slices: torch.Tensor, future: asyncio.Future, explain_index=None, keep_probs=False,
+                 capture_all=False):
+        self.slices = slices
+        self.future = future
+        self.offset = 0
+        self.accumulator = ScanAccumulator()
+        self.enqueued_at = time.monotonic()
+        self.explain_index = explain_index
+        self.activations = None
+        self.cpu_s = 0.0  # this scan's share of the forward passes' CPU time
+        self.batches = 0
+        self.probs = [] if keep_probs else None
+        self.captured = [] if capture_all else None
+
+    def result(self):
+        if self.probs is not None:
+            return torch.cat(self.probs)
+        label, confidence = self.accumulator.result()
+        if self.captured is not None:
+            complete = self.captured and sum(len(part) for part in self.captured) == len(self.slices)
+            return label, confidence, torch.cat(self.captured) if complete else None
+        if self.explain_index is None:
+            return label, confidence
+        return label, confidence, self.activations
+
+    @property
+    def remaining(self):
+        return len(self.slices) - self.offset
+
+
+class InferenceScheduler:
+    """
+    Dynamic batching in front of a shared model.
+
+    Concurrent requests submit their preprocessed slices with predict(); a
+    single background task packs slices from all waiting scans into batches
+    of up to max_batch_size, waiting at most max_wait_ms for a batch to fill.
+    Each scan keeps its own ScanAccumulator, so every caller gets exactly the
+    weighted result predict_scan would give, delivered through a future.
+
+    A scan may ask for one slice to be explained: the last DenseBlock's
+    activations for that slice are captured during the shared pass and
+    returned for visualization.gradcam_from_activations (None when the
+    model cannot be hooked, e.g. TorchScript or INT8), or, with
+    predict_volume(), the activations of every slice for a volumetric
+    explanation.
+    """
+
+    def __init__(self, model, device="cpu", max_batch_size=32, max_wait_ms=10.0, max_memory_mb=None,
+                 executor=None):
+        self.model = model
+        self.device = device
+        # The memory budget (if any) caps the batch size like in predict_scan
+        self.max_batch_size = resolve_batch_size(max_batch_size, max_batch_size, max_memory_mb)
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+
+        self._queue = None
+        self._active = deque()
+        self._task = None
+
+        # Metrics
+        self._batches = 0
+        self._slices = 0
+        self._scans_done = 0
+        self._last_fill = 0.0
+        self._total_latency = 0.0
+
+    # === Lifecycle ===
+    def start(self):
+        """Start the batching loop on the running event loop."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and fail any scans still waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        pending = list(self._active)
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for scan in pending:
+            if not scan.future.done():
+                scan.future.set_exception(RuntimeError("Inference scheduler stopped."))
+        self._active.clear()
+
+    # === Public API ===
+    async def predict(self, processed_slices, explain_index=None, stats=None):
+        """
+        Queue one scan's slices (list of tensors or an (N, 3, 224, 224) tensor)
+        and wait for its (label, confidence) result. With explain_index the
+        result is (label, confidence, activations) for that slice.
+
+        A stats dict, if given, receives the scan's share of forward-pass CPU
+        time ("cpu_s", split by slices per batch) and "batches".
+        """
+        return await self._submit(processed_slices, stats, explain_index=explain_index)
+
+    async def predict_slices(self, processed_slices, stats=None):
+        """
+        Like predict(), but return the (N, C) softmax probabilities of every
+        slice instead of the weighted scan result (for adaptive selection).
+        """
+        return await self._submit(processed_slices, stats, keep_probs=True)
+
+    async def predict_volume(self, processed_slices, stats=None):
+        """
+        Like predict(), but capture the activations of every slice: returns
+        (label, confidence, (N, C, h, w) activations or None) for
+        visualization.explain_volume, at no extra forward pass.
+        """
+        return await self._submit(processed_slices, stats, capture_all=True)
+
+    async def _submit(self, processed_slices, stats, explain_index=None, keep_probs=False, capture_all=False):
+        if len(processed_slices) == 0:
+            raise ValueError("❌ No preprocessed slices found for prediction.")
+
+        self.start()
+        slices = processed_slices if isinstance(processed_slices, torch.Tensor) else torch.stack(processed_slices)
+        if explain_index is not None:
+            explain_index %= len(slices)
+        future = asyncio.get_running_loop().create_future()
+        scan = _PendingScan(slices, future, explain_index, keep_probs, capture_all)
+        await self._queue.put(scan)
+        try:
+            return await future
+        finally:
+            if stats is not None:
+                stats.update(cpu_s=scan.cpu_s, batches=scan.batches)
+
+    def metrics(self):
+        """Snapshot of queue depth and batch fill statistics."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return {
+            "queue_depth": queued + len(self._active),
+            "pending_slices": sum(scan.remaining for scan in self._active),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_run": self._batches,
+            "slices_run": self._slices,
+            "scans_completed": self._scans_done,
+            "last_batch_fill": self._last_fill,
+            "avg_batch_fill": self._slices / (self._batches * self.max_batch_size) if self._batches else 0.0,
+            "avg_scan_latency_ms": 1000.0 * self._total_latency / self._scans_done if self._scans_done else 0.0,
+        }
+
+    # === Batching loop ===
+    def _pending_slices(self):
+        return sum(scan.remaining for scan in self._active)
+
+    async def _collect(self):
+        """Gather scans until a full batch is available or max_wait expires."""
+        loop = asyncio.get_running_loop()
+
+        # Block until there is any work at all
+        if not self._active:
+            self._active.append(await self._queue.get())
+
+        deadline = loop.time() + self.max_wait
+        while self._pending_slices() < self.max_batch_size:
+            try:
+                scan = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    scan = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            self._active.append(scan)
+
+    def _forward(self, batch: torch.Tensor, capture_rows):
+        """
+        Forward one batch; also return activations for capture_rows (if
+        hookable) and CPU seconds used, counted process-wide so torch's
+        intra-op threads are included.
+        """
+        clock = cpu_clock("inference")
+        cpu_start = clock()
+        layer = find_cam_layer(self.model) if capture_rows else None
+        with torch.no_grad():
+            if layer is None:
+                outputs = self.model(batch.to(self.device))
+                captured = None
+            else:
+                with capture_activations(layer) as store:
+                    outputs = self.model(batch.to(self.device))
+                captured = store["output"][capture_rows]
+            probs = F.softmax(outputs, dim=1).cpu()
+        return probs, captured, clock() - cpu_start
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._collect()
+
+            # Drop scans whose caller has gone away (e.g. cancelled request)
+            self._active = deque(scan for scan in self._active if not scan.future.done())
+            if not self._active:
+                continue
+
+            # Take slices from the oldest scans first
+            parts, owners, room = [], [], self.max_batch_size
+            capture_rows, capture_owners = [], []
+            for scan in self._active:
+                if room == 0:
+                    break
+                take = min(room, scan.remaining)
+                first_row = self.max_batch_size - room
+                if scan.captured is not None:
+                    capture_rows.extend(range(first_row, first_row + take))
+                    capture_owners.append((scan, take))
+                elif scan.explain_index is not None and scan.offset <= scan.explain_index < scan.offset + take:
+                    capture_rows.append(first_row + scan.explain_index - scan.offset)
+                    capture_owners.append((scan, 1))
+                parts.append(scan.slices[scan.offset:scan.offset + take])
+                owners.append((scan, take))
+                scan.offset += take
+                room -= take
+
+            batch = torch.cat(parts)
+            try:
+                probs, captured, cpu_s = await loop.run_in_executor(self.executor, self._forward, batch, capture_rows)
+            except Exception as e:
+                for scan, _ in owners:
+                    if not scan.future.done():
+                        scan.future.set_exception(e)
+                    if scan in self._active:
+                        self._active.remove(scan)
+                continue
+
+            self._batches += 1
+            self._slices += len(batch)
+            self._last_fill = len(batch) / self.max_batch_size
+
+            if captured is not None:
+                k = 0
+                for scan, count in capture_owners:
+                    if scan.captured is not None:
+                        scan.captured.append(captured[k:k + count])
+                    else:
+                        scan.activations = captured[k:k + count]
+                    k += count
+
+            # Hand each scan its own rows; finished scans resolve their future
+            row = 0
+            for scan, take in owners:
+                scan.accumulator.update(probs[row:row + take])
+                if scan.probs is not None:
+                    scan.probs.append(probs[row:row + take])
+                scan.cpu_s += cpu_s * take / len(batch)
+                scan.batches += 1
+                row += take
+                if scan.remaining == 0:
+                    self._active.remove(scan)
+                    self._scans_done += 1
+                    self._total_latency += time.monotonic() - scan.enqueued_at
+                    if not scan.future.done():
+                        scan.future.set_result(scan.result())
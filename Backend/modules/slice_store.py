@@ -0,0 +1,126 @@
+# modules/slice_store.py
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+_HASH = re.compile(r"[0-9a-f]{64}")
+
+
+class StoredScan:
+    """
+    One stored entry: model-ready uint8 slices (memory-mapped, read-only)
+    plus the slice-selection metadata written with them.
+
+    Attributes:
+        slices (np.ndarray): (N, 224, 224) uint8, see preprocessing.uint8_input_to_tensor
+        meta (dict): params, indices, shape, bbox, explain_position, affine
+        explain_slice (np.ndarray): (H, W) uint8 raw slice at explain_position
+        overlay_slices (np.ndarray): (N, H, W) uint8 raw slices, or None
+    """
+
+    def __init__(self, slices, meta, explain_slice, overlay_slices=None):
+        self.slices = slices
+        self.meta = meta
+        self.explain_slice = explain_slice
+        self.overlay_slices = overlay_slices
+
+    def __len__(self):
+        return len(self.slices)
+
+
+class SliceStore:
+    """
+    Preprocessed slice stacks on disk, one folder per scan content hash:
+    meta.json, slices.npy, explain.npy and optionally overlays.npy.
+
+    Arrays are plain .npy so they can be memory-mapped: predict_scan and
+    bulk scoring read the uint8 slices straight from the page cache, with
+    no NIfTI/DICOM decoding, CLAHE or resizing. An entry written with other
+    preprocessing parameters (PREPROCESS_VERSION, crop, ...) is stale: get()
+    misses and the next put() replaces it. Folders appear atomically; with
+    max_bytes the least recently used ones are removed once it is exceeded.
+    The object holds no locks or handles, so it can be sent to worker processes.
+    """
+
+    def __init__(self, root: str, max_bytes: int = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _folder(self, content_sha256):
+        return os.path.join(self.root, content_sha256)
+
+    def get(self, content_sha256: str, params: dict, need_overlays: bool = False):
+        """StoredScan for this content and parameters, or None (missing or stale)."""
+        if not content_sha256 or not _HASH.fullmatch(content_sha256):
+            return None
+        folder = self._folder(content_sha256)
+        try:
+            with open(os.path.join(folder, "meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("params") != params:
+                return None
+            overlay_path = os.path.join(folder, "overlays.npy")
+            if need_overlays and not os.path.exists(overlay_path):
+                return None
+            slices = np.load(os.path.join(folder, "slices.npy"), mmap_mode="r")
+            explain_slice = np.load(os.path.join(folder, "explain.npy"))
+            overlays = np.load(overlay_path, mmap_mode="r") if need_overlays else None
+            os.utime(folder)  # mark as recently used for eviction
+        except (OSError, ValueError, KeyError):
+            return None
+        return StoredScan(slices, meta, explain_slice, overlays)
+
+    def put(self, content_sha256: str, params: dict, slices, meta: dict, explain_slice, overlay_slices=None):
+        """Write (or replace) the entry for content_sha256; meta must be JSON-serialisable."""
+        if not _HASH.fullmatch(content_sha256):
+            raise ValueError("content_sha256 must be a SHA-256 hex digest.")
+        staging = os.path.join(self.root, f".{content_sha256}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(staging)
+        try:
+            np.save(os.path.join(staging, "slices.npy"), np.ascontiguousarray(slices, dtype=np.uint8))
+            np.save(os.path.join(staging, "explain.npy"), np.asarray(explain_slice, dtype=np.uint8))
+            if overlay_slices is not None:
+                np.save(os.path.join(staging, "overlays.npy"), np.asarray(overlay_slices, dtype=np.uint8))
+            with open(os.path.join(staging, "meta.json"), "w") as f:
+                json.dump(dict(meta, params=params, stored_at=time.time()), f)
+
+            folder = self._folder(content_sha256)
+            if os.path.isdir(folder):
+                # Stale (or narrower) entry: swap it out, readers keep their open maps
+                retired = os.path.join(self.root, f".{content_sha256}.{uuid.uuid4().hex}.old")
+                os.rename(folder, retired)
+                shutil.rmtree(retired, ignore_errors=True)
+            os.rename(staging, folder)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # written concurrently by another worker
+        if self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            folder = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(folder):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(folder))
+                entries.append((os.stat(folder).st_mtime, size, folder))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, folder in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        entries = [name for name in os.listdir(self.root) if _HASH.fullmatch(name)]
+        size = sum(entry.stat().st_size for name in entries for entry in os.scandir(self._folder(name)))
+        return {"entries": len(entries), "bytes": size}
@@ -0,0 +1,65 @@
+# modules/storage.py
+import os
+from urllib.parse import quote
+
+import httpx
+
+
+class SupabaseStorage:
+    """
+    Uploads to Supabase Storage over its REST API with one pooled HTTP client,
+    so concurrent uploads reuse keep-alive connections instead of opening a
+    new TLS session per file. Public URLs are derived from bucket + name, so
+    they are known before the upload finishes.
+    """
+
+    def __init__(self, url: str, key: str, max_connections: int = 16, timeout: float = 30.0):
+        self.url = url.rstrip("/")
+        self._client = httpx.Client(
+            headers={"Authorization": f"Bearer {key}", "apikey": key},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+
+    def public_url(self, bucket: str, name: str) -> str:
+        return f"{self.url}/storage/v1/object/public/{bucket}/{quote(name)}"
+
+    def upload(self, bucket: str, name: str, data: bytes, content_type: str) -> str:
+        response = self._client.post(
+            f"{self.url}/storage/v1/object/{bucket}/{quote(name)}",
+            content=data,
+            headers={"Content-Type": content_type, "cache-control": "max-age=3600", "x-upsert": "true"},
+        )
+        response.raise_for_status()
+        return self.public_url(bucket, name)
+
+    def close(self):
+        self._client.close()
+
+
+class LocalStorage:
+    """
+    Stand-in storage that writes objects under root/<bucket>/<name>.
+    Used by tests and local runs without Supabase.
+    """
+
+    def __init__(self, root: str, base_url: str = None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/") if base_url else None
+
+    def public_url(self, bucket: str, name: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{bucket}/{quote(name)}"
+        return "file://" + os.path.join(self.root, bucket, name)
+
+    def upload(self, bucket: str, name: str, data: bytes, content_type: str) -> str:
+        folder = os.path.join(self.root, bucket)
+        os.makedirs(folder, exist_ok=True)
+        tmp = os.path.join(folder, f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(folder, name))
+        return self.public_url(bucket, name)
+
+    def close(self):
+        pass
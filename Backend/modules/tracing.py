@@ -0,0 +1,274 @@
+# modules/tracing.py
+import json
+import logging
+import os
+import platform
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("brainalyze.trace")
+
+
+# === Memory ===
+def current_rss_bytes():
+    """Resident set size of this process (Linux /proc; falls back to the peak so far)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KB on Linux, bytes on macOS
+        scale = 1 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class MemoryMonitor:
+    """
+    One background thread per process that samples RSS and raises the peak
+    of every span currently open. RSS is process-wide, so concurrent stages
+    see each other's allocations.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+        self._pid = os.getpid()
+        self._spans = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="memory-monitor", daemon=True).start()
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            if cls._instance is None or cls._instance._pid != os.getpid():
+                cls._instance = cls()
+            return cls._instance
+
+    def watch(self, span):
+        span.peak_rss_bytes = current_rss_bytes()
+        with self._lock:
+            self._spans.add(span)
+
+    def unwatch(self, span):
+        with self._lock:
+            self._spans.discard(span)
+        span.peak_rss_bytes = max(span.peak_rss_bytes, current_rss_bytes())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_s)
+            with self._lock:
+                if not self._spans:
+                    continue
+                spans = list(self._spans)
+            rss = current_rss_bytes()
+            for span in spans:
+                if rss > span.peak_rss_bytes:
+                    span.peak_rss_bytes = rss
+
+
+# === Spans and traces ===
+# Stages that fan out to native threads (torch intra-op, OpenCV, DICOM decode
+# pool): their CPU time is whole-process CPU (time.process_time), which also
+# counts whatever else the process runs meanwhile. Other stages count the
+# calling thread only (time.thread_time).
+PROCESS_CPU_STAGES = frozenset({"load", "preprocess", "inference", "explain"})
+
+
+def cpu_clock(stage: str):
+    """CPU clock for a stage's cpu_s (see PROCESS_CPU_STAGES)."""
+    return time.process_time if stage in PROCESS_CPU_STAGES else time.thread_time
+
+
+class Span:
+    """
+    Measurements of one pipeline stage.
+
+    Attributes:
+        wall_s: elapsed wall-clock time
+        cpu_s: CPU time of the stage (None when the stage only awaited
+            other work, e.g. the shared inference scheduler reports its own
+            share); see cpu_scope
+        cpu_scope: "process" for stages in PROCESS_CPU_STAGES, else "thread"
+        slices: slices the stage handled
+        tensor_bytes: size of the tensor the stage produced
+        peak_rss_bytes: highest process RSS seen while the stage ran
+    """
+
+    def __init__(self, name, slices=None, tensor_bytes=None):
+        self.name = name
+        self.wall_s = 0.0
+        self.cpu_s = None
+        self.cpu_scope = "process" if name in PROCESS_CPU_STAGES else "thread"
+        self.slices = slices
+        self.tensor_bytes = tensor_bytes
+        self.peak_rss_bytes = 0
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "wall_ms": round(self.wall_s * 1000.0, 3),
+            "cpu_ms": round(self.cpu_s * 1000.0, 3) if self.cpu_s is not None else None,
+            "cpu_scope": self.cpu_scope,
+            "slices": self.slices,
+            "tensor_bytes": self.tensor_bytes,
+            "peak_rss_mb": round(self.peak_rss_bytes / 2 ** 20, 1),
+        }
+
+
+@contextmanager
+def measure(name, cpu=True, **fields):
+    """
+    Time the enclosed block as a Span. With cpu=True the block's CPU time is
+    taken from cpu_clock(name); for thread-scoped stages use it in the
+    thread doing the work (see run_traced for pool workers).
+    """
+    span = Span(name, **fields)
+    monitor = MemoryMonitor.get()
+    monitor.watch(span)
+    wall_start = time.perf_counter()
+    clock = cpu_clock(name)
+    cpu_start = clock() if cpu else None
+    try:
+        yield span
+    finally:
+        span.wall_s = time.perf_counter() - wall_start
+        if cpu:
+            span.cpu_s = clock() - cpu_start
+        monitor.unwatch(span)
+
+
+def run_traced(name, fn, *args, **kwargs):
+    """
+    Call fn inside a measured span and return (result, span). Module-level so
+    it can be submitted to thread and process pools alike.
+    """
+    with measure(name) as span:
+        result = fn(*args, **kwargs)
+    return result, span
+
+
+class Trace:
+    """All stage spans of one analysis, logged as one JSON line when finished."""
+
+    def __init__(self, trace_id=None, **context):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.context = context
+        self.spans = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, *spans):
+        with self._lock:
+            self.spans.extend(spans)
+
+    @contextmanager
+    def stage(self, name, cpu=True, **fields):
+        with measure(name, cpu=cpu, **fields) as span:
+            yield span
+        self.add(span)
+
+    @property
+    def elapsed_s(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            "event": "analysis_trace",
+            "trace_id": self.trace_id,
+            **self.context,
+            "total_ms": round(self.elapsed_s * 1000.0, 3),
+            "stages": [span.as_dict() for span in self.spans],
+        }
+
+    def log(self, level=logging.INFO):
+        logger.log(level, json.dumps(self.as_dict()))
+
+
+# === Prometheus exposition ===
+class StageMetrics:
+    """
+    Per-stage counters and latency histograms rendered in the Prometheus
+    text format (no client library needed).
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, prefix="brainalyze"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def _entry(self, stage):
+        entry = self._stages.get(stage)
+        if entry is None:
+            entry = self._stages[stage] = {"buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0,
+                                           "cpu": 0.0, "slices": 0, "tensor_bytes": 0, "peak_rss": 0}
+        return entry
+
+    def observe(self, span):
+        with self._lock:
+            self._record(span.name, span.wall_s, span.cpu_s, span.slices, span.tensor_bytes, span.peak_rss_bytes)
+
+    def observe_trace(self, trace):
+        """Record every span of a trace plus its end-to-end time as stage 'total'."""
+        with self._lock:
+            for span in trace.spans:
+                self._record(span.name, span.wall_s, span.cpu_s, span.slices, span.tensor_bytes, span.peak_rss_bytes)
+            self._record("total", trace.elapsed_s, None, None, None, 0)
+
+    def _record(self, stage, wall_s, cpu_s, slices, tensor_bytes, peak_rss):
+        entry = self._entry(stage)
+        for i, bound in enumerate(self.BUCKETS):
+            if wall_s <= bound:
+                entry["buckets"][i] += 1
+        entry["count"] += 1
+        entry["sum"] += wall_s
+        entry["cpu"] += cpu_s or 0.0
+        entry["slices"] += slices or 0
+        entry["tensor_bytes"] += tensor_bytes or 0
+        entry["peak_rss"] = max(entry["peak_rss"], peak_rss or 0)
+
+    def render(self, gauges=None):
+        """
+        Prometheus text exposition. gauges adds {name: (help, value)} for
+        point-in-time values such as queue depth.
+        """
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_stage_duration_seconds Wall time per pipeline stage.",
+            f"# TYPE {p}_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = {name: dict(entry, buckets=list(entry["buckets"])) for name, entry in self._stages.items()}
+
+        for stage, entry in sorted(stages.items()):
+            for bound, count in zip(self.BUCKETS, entry["buckets"]):
+                lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'{p}_stage_duration_seconds_sum{{stage="{stage}"}} {entry["sum"]}')
+            lines.append(f'{p}_stage_duration_seconds_count{{stage="{stage}"}} {entry["count"]}')
+
+        counters = (
+            ("stage_cpu_seconds_total", "counter",
+             "CPU time spent per stage: whole-process CPU for " + ", ".join(sorted(PROCESS_CPU_STAGES))
+             + " (they fan out to native threads), calling-thread CPU for the others.", "cpu"),
+            ("stage_slices_total", "counter", "Slices handled per stage.", "slices"),
+            ("stage_tensor_bytes_total", "counter", "Bytes of tensors produced per stage.", "tensor_bytes"),
+            ("stage_peak_rss_bytes", "gauge", "Highest process RSS seen during a stage.", "peak_rss"),
+        )
+        for name, kind, help_text, key in counters:
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            for stage, entry in sorted(stages.items()):
+                lines.append(f'{p}_{name}{{stage="{stage}"}} {entry[key]}')
+
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
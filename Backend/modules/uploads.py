@@ -0,0 +1,340 @@
+# modules/uploads.py
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+import nibabel as nib
+
+from modules.dicom_loader import DICOM_MAGIC_OFFSET, is_dicom_bytes
+from modules.input_loader import GZIP_MAGIC, ZIP_MAGIC, is_nifti_header
+
+_UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+# Bytes of (decompressed) data the header checks may look at before giving up
+HEADER_PROBE_BYTES = 4 * 1024 * 1024
+
+# Zip local file header: signature, version, flags, method, time, date, crc,
+# compressed size, size, name length, extra length
+_ZIP_LOCAL = struct.Struct("<4sHHHHHIIIHH")
+
+
+class UploadOffsetError(ValueError):
+    """A chunk did not start where the upload currently ends; offset is where it does."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at byte {offset}.")
+        self.offset = offset
+
+
+# === Header checks (run on the first bytes, before the rest arrives) ===
+def check_nifti_header(head: bytes):
+    """
+    True once head holds a valid NIfTI-1/2 header of a 3D or 4D image, None
+    while more bytes are needed; raises ValueError for anything else.
+    """
+    if len(head) < 4:
+        return None
+    if not is_nifti_header(head):
+        raise ValueError("Not a NIfTI file: unexpected header size field.")
+    is_nifti2 = 540 in (struct.unpack("<i", head[:4])[0], struct.unpack(">i", head[:4])[0])
+    header_class = nib.Nifti2Header if is_nifti2 else nib.Nifti1Header
+    if len(head) < header_class.template_dtype.itemsize:
+        return None
+    try:
+        header = header_class.from_fileobj(io.BytesIO(head), check=True)
+    except Exception as e:
+        raise ValueError(f"Invalid NIfTI header: {e}")
+    if len(header.get_data_shape()) not in (3, 4):
+        raise ValueError(f"Expected a 3D or 4D image, got shape {header.get_data_shape()}.")
+    return True
+
+
+def check_dicom_zip(head: bytes):
+    """
+    True once a member of the zip carries a DICOM header (or a .dcm name),
+    None while more bytes are needed; raises ValueError if the archive is
+    malformed or its directory is reached without any DICOM member.
+    Folders, macOS entries and other files are skipped, as the loader does.
+    """
+    offset = 0
+    while True:
+        if len(head) < offset + 4:
+            return None
+        if head[offset:offset + 4] == b"PK\x01\x02":
+            raise ValueError("No DICOM files found in the zip archive.")  # central directory: no more members
+        if len(head) < offset + _ZIP_LOCAL.size:
+            return None
+        signature, _, flags, method, _, _, _, compressed, _, name_len, extra_len = \
+            _ZIP_LOCAL.unpack_from(head, offset)
+        if signature != ZIP_MAGIC:
+            raise ValueError("Corrupt zip archive.")
+        start = offset + _ZIP_LOCAL.size + name_len + extra_len
+        if len(head) < start:
+            return None
+        name = head[offset + _ZIP_LOCAL.size:offset + _ZIP_LOCAL.size + name_len].decode("utf-8", "replace")
+        base = os.path.basename(name)
+        streamed = bool(flags & 0x08)  # sizes follow the data, so the next member can't be located
+
+        if not (name.endswith("/") or name.startswith("__MACOSX/") or base.startswith("._")):
+            if base.lower().endswith(".dcm"):
+                return True
+            # Only the member's preamble is needed
+            data = head[start:len(head) if streamed else start + compressed]
+            if method == 8:
+                data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, DICOM_MAGIC_OFFSET + 4)
+            elif method != 0:
+                raise ValueError(f"Unsupported zip compression method {method}.")
+            if len(data) >= DICOM_MAGIC_OFFSET + 4 and is_dicom_bytes(data):
+                return True
+
+        if streamed:
+            return None
+        offset = start + compressed
+
+
+# === Sessions ===
+class UploadSession:
+    """
+    One resumable upload: the received bytes on disk, a running SHA-256 of
+    them and, for .nii.gz, the NIfTI decompressed so far.
+
+    Attributes:
+        upload_id (str): 32 hex chars
+        filename (str): client file name (.nii, .nii.gz or .zip)
+        size (int): declared total size in bytes, or None
+        received (int): bytes stored so far (the next chunk's offset)
+        kind (str): "nifti", "nifti_gz" or "dicom_zip" once sniffed
+        validated (bool): header check passed
+    """
+
+    def __init__(self, upload_id, folder, filename, size=None, created_at=None):
+        self.upload_id = upload_id
+        self.folder = folder
+        self.filename = filename
+        self.size = size
+        self.created_at = created_at or time.time()
+        self.updated_at = self.created_at
+        self.received = 0
+        self.kind = None
+        self.validated = False
+        self.sha256 = hashlib.sha256()
+        self.lock = threading.Lock()
+        self._head = b""  # first (decompressed) bytes, until validated
+        self._inflater = None
+        self._decoded = 0
+
+    @property
+    def raw_path(self):
+        return os.path.join(self.folder, "upload")
+
+    @property
+    def volume_path(self):
+        """What the pipeline opens (the loader goes by extension)."""
+        return os.path.join(self.folder, "volume.zip" if self.kind == "dicom_zip" else "volume.nii")
+
+    def as_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.received,
+            "kind": self.kind,
+            "validated": self.validated,
+            "decoded_bytes": self._decoded,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    # === Incremental processing ===
+    def consume(self, data: bytes):
+        """Hash, store and decode one chunk that starts at self.received."""
+        if self.received == 0:
+            self._sniff(data)
+        self.sha256.update(data)
+        with open(self.raw_path, "ab") as f:
+            f.write(data)
+        self.received += len(data)
+
+        if self.kind == "nifti_gz":
+            self._inflate(data)
+        elif not self.validated:
+            self._probe(data)
+        self.updated_at = time.time()
+
+    def _sniff(self, data):
+        if data[:2] == GZIP_MAGIC:
+            self.kind = "nifti_gz"
+        elif data[:4] == ZIP_MAGIC:
+            self.kind = "dicom_zip"
+        else:
+            self.kind = "nifti"
+        if self.kind == "dicom_zip" and not self.filename.lower().endswith(".zip"):
+            raise ValueError("Zip archives must be uploaded with a .zip name.")
+        if self.kind != "dicom_zip" and not self.filename.endswith((".nii", ".nii.gz")):
+            raise ValueError("Unsupported format. Use .nii, .nii.gz or a .zip of .dcm files.")
+
+    def _inflate(self, data):
+        """Decompress as the chunks arrive, so the NIfTI is ready when the last one lands."""
+        with open(self.volume_path, "ab") as out:
+            while data:
+                if self._inflater is None or self._inflater.eof:
+                    self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip member
+                try:
+                    decoded = self._inflater.decompress(data, 8 * 1024 * 1024)
+                except zlib.error as e:
+                    raise ValueError(f"Corrupt gzip data: {e}")
+                out.write(decoded)
+                self._decoded += len(decoded)
+                if not self.validated:
+                    self._probe(decoded)
+                data = self._inflater.unconsumed_tail or self._inflater.unused_data
+                if self._inflater.eof and not data.strip(b"\0"):
+                    break  # zero padding after the last member
+
+    def _probe(self, data):
+        if len(self._head) < HEADER_PROBE_BYTES:
+            self._head += data[:HEADER_PROBE_BYTES - len(self._head)]
+        check = check_dicom_zip if self.kind == "dicom_zip" else check_nifti_header
+        verdict = check(self._head)
+        if verdict is None and len(self._head) >= HEADER_PROBE_BYTES:
+            verdict = True  # nothing wrong in the probe window; the loader has the final say
+        if verdict:
+            self.validated = True
+            self._head = b""
+
+    def finish(self):
+        """Check the upload is whole; returns the path the pipeline should open."""
+        if self.size is not None and self.received != self.size:
+            raise UploadOffsetError(self.received)
+        if self.received == 0:
+            raise ValueError("Upload is empty.")
+        if self.kind == "nifti_gz" and (self._inflater is None or not self._inflater.eof):
+            raise ValueError("Truncated gzip data.")
+        if not self.validated:
+            raise ValueError("File ended before its header was complete.")
+        if self.kind != "nifti_gz" and not os.path.exists(self.volume_path):
+            os.link(self.raw_path, self.volume_path)  # same bytes under the name the loader expects
+        return self.volume_path
+
+
+class UploadStore:
+    """
+    Resumable uploads under root, one folder per upload (meta.json plus the
+    received bytes). Sessions live in memory; after a restart they are
+    rebuilt from disk by re-reading what was received, so clients can resume
+    from GET .../offset either way. Uploads idle for longer than ttl_s are
+    removed by purge().
+    """
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3, ttl_s: float = 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _folder(self, upload_id):
+        return os.path.join(self.root, upload_id)
+
+    def create(self, filename: str, size: int = None) -> UploadSession:
+        if not filename or not (filename.endswith((".nii", ".nii.gz")) or filename.lower().endswith(".zip")):
+            raise ValueError("Unsupported format. Use .nii, .nii.gz or a .zip of .dcm files.")
+        if size is not None and not 0 < size <= self.max_bytes:
+            raise ValueError(f"Upload size must be between 1 and {self.max_bytes} bytes.")
+        upload_id = uuid.uuid4().hex
+        folder = self._folder(upload_id)
+        os.makedirs(folder)
+        session = UploadSession(upload_id, folder, os.path.basename(filename), size)
+        with open(os.path.join(folder, "meta.json"), "w") as f:
+            json.dump({"filename": session.filename, "size": size, "created_at": session.created_at}, f)
+        with self._lock:
+            self._sessions[upload_id] = session
+        return session
+
+    def get(self, upload_id: str):
+        """The session, or None (unknown id); rebuilt from disk if needed."""
+        if not _UPLOAD_ID.fullmatch(upload_id):
+            return None
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                session = self._restore(upload_id)
+                if session is not None:
+                    self._sessions[upload_id] = session
+            return session
+
+    def _restore(self, upload_id):
+        folder = self._folder(upload_id)
+        try:
+            with open(os.path.join(folder, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        session = UploadSession(upload_id, folder, meta["filename"], meta.get("size"), meta.get("created_at"))
+        raw_path = session.raw_path
+        for name in ("volume.nii", "volume.zip"):
+            if os.path.exists(os.path.join(folder, name)):
+                os.remove(os.path.join(folder, name))
+        if os.path.exists(raw_path):
+            os.rename(raw_path, raw_path + ".part")
+            try:
+                with open(raw_path + ".part", "rb") as f:
+                    while chunk := f.read(8 * 1024 * 1024):
+                        session.consume(chunk)
+            except ValueError:
+                shutil.rmtree(folder, ignore_errors=True)
+                return None
+            os.remove(raw_path + ".part")
+        return session
+
+    def append(self, upload_id: str, offset: int, data: bytes) -> UploadSession:
+        """
+        Add one chunk at offset. Raises KeyError (unknown upload),
+        UploadOffsetError (chunk doesn't continue the upload) or ValueError
+        (bad content or size; the upload is discarded).
+        """
+        session = self.get(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        with session.lock:
+            if offset != session.received:
+                raise UploadOffsetError(session.received)
+            limit = session.size if session.size is not None else self.max_bytes
+            try:
+                if session.received + len(data) > limit:
+                    raise ValueError(f"Upload exceeds {limit} bytes.")
+                session.consume(data)
+            except ValueError:
+                self.discard(upload_id)
+                raise
+        return session
+
+    def discard(self, upload_id: str):
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        if _UPLOAD_ID.fullmatch(upload_id):
+            shutil.rmtree(self._folder(upload_id), ignore_errors=True)
+
+    def purge(self, now: float = None):
+        """Remove uploads idle for longer than ttl_s; returns how many."""
+        now = now or time.time()
+        removed = 0
+        for name in os.listdir(self.root):
+            folder = self._folder(name)
+            if not _UPLOAD_ID.fullmatch(name) or not os.path.isdir(folder):
+                continue
+            session = self._sessions.get(name)
+            updated = session.updated_at if session is not None else os.stat(folder).st_mtime
+            if now - updated > self.ttl_s:
+                self.discard(name)
+                removed += 1
+        return removed
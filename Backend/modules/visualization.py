@@ -1,63 +1,223 @@
+import gzip
+import threading
+from contextlib import contextmanager
+
 import torch
+import torch.nn.functional as F
 import numpy as np
-import cv2  
+import cv2
+import nibabel as nib
 
 
-def generate_gradcam(model, input_tensor, target_class=1):
+def find_cam_layer(model):
     """
-    Generate Grad-CAM heatmap for MONAI DenseNet-121.
+    Layer Grad-CAM explains: the last DenseBlock, at index -2 in model.features
+    (same position in MONAI and torchvision DenseNet121). Unwraps backend
+    wrappers such as ChannelsLastModel; returns None for models without
+    Python-level submodules (TorchScript, INT8 graph modules).
+    """
+    model = getattr(model, "model", model)
+    features = getattr(model, "features", None)
+    if isinstance(features, torch.nn.Sequential) and not isinstance(model, torch.jit.ScriptModule):
+        return features[-2]
+    return None
+
+
+@contextmanager
+def capture_activations(layer):
+    """
+    Record layer's forward output while the block is active.
+
+    The hook handle is always removed on exit, and only forwards running on
+    the calling thread are recorded, so concurrent users of a shared model
+    neither see each other's activations nor leave hooks behind.
+    """
+    store = {}
+    owner = threading.get_ident()
+
+    def forward_hook(module, input, output):
+        if threading.get_ident() == owner:
+            store["output"] = output
+
+    handle = layer.register_forward_hook(forward_hook)
+    try:
+        yield store
+    finally:
+        handle.remove()
+
+
+def densenet_head(model, activations):
+    """
+    Run the part of a torchvision DenseNet after the last DenseBlock:
+    norm5 → ReLU → global average pool → classifier.
+    """
+    out = model.features[-1](activations)
+    out = F.relu(out)
+    out = F.adaptive_avg_pool2d(out, (1, 1))
+    out = torch.flatten(out, 1)
+    return model.classifier(out)
+
+
+def cam_from_gradients(activations, gradients, size=(224, 224)):
+    """Weight (1, C, h, w) activations by pooled gradients → normalized (224, 224) heatmap."""
+    cam = cams_from_gradients(activations[:1], gradients[:1], size)[0]
+    return cam / (cam.max() + 1e-8)
+
+
+def cams_from_gradients(activations, gradients, size=(224, 224)):
+    """
+    Batched Grad-CAM: (B, C, h, w) activations and gradients → (B, 224, 224)
+    float32 heatmaps after ReLU, not normalized (so slices stay comparable).
+    Channel weighting is one einsum and the resize one bilinear interpolate
+    for the whole batch.
+    """
+    # Global-average-pool gradients → per-channel weights, then weighted channel sum
+    weights = gradients.mean(dim=(2, 3))
+    cams = F.relu(torch.einsum("bc,bchw->bhw", weights, activations))
+
+    # (h, w) → size, half-pixel centred like cv2.resize
+    cams = F.interpolate(cams[:, None], size=(size[1], size[0]), mode="bilinear", align_corners=False)
+    return cams[:, 0].cpu().numpy().astype(np.float32)
+
+
+def gradcam_from_activations(model, activations, target_class=1):
+    """
+    Grad-CAM from last-DenseBlock activations captured during a forward pass.
+    Only the classifier head is re-run, so the single backward pass touches
+    a handful of layers instead of the whole network.
     """
     model.eval()
-    gradients = []
+    acts = activations.detach().requires_grad_(True)
+    with torch.enable_grad():
+        class_score = densenet_head(model, acts)[0, target_class]
+        gradients, = torch.autograd.grad(class_score, acts)
+    return cam_from_gradients(acts.detach(), gradients)
+
+
+def gradcams_from_activations(model, activations, target_class=1, batch_size=32):
+    """
+    Raw (N, 224, 224) Grad-CAMs for N slices' last-DenseBlock activations.
+    In eval mode every sample's class score depends only on its own
+    activations, so the gradient of the summed scores gives each slice its
+    own gradients: one backward pass through the head per batch_size slices.
+    """
+    model.eval()
+    cams = []
+    for start in range(0, len(activations), batch_size):
+        acts = activations[start:start + batch_size].detach().requires_grad_(True)
+        with torch.enable_grad():
+            class_scores = densenet_head(model, acts)[:, target_class]
+            gradients, = torch.autograd.grad(class_scores.sum(), acts)
+        cams.append(cams_from_gradients(acts.detach(), gradients))
+    return np.concatenate(cams)
+
+
+def generate_gradcams(model, slices, target_class=1, device="cpu", batch_size=16):
+    """
+    Raw (N, 224, 224) Grad-CAMs for an (N, 3, 224, 224) batch without captured
+    activations: a no-grad forward per chunk records them, then
+    gradcams_from_activations runs the backward passes through the head.
+    """
+    model.eval()
+    layer = find_cam_layer(model)
+    if layer is None:
+        raise ValueError("Grad-CAM needs an eager DenseNet model (model.features[-2]).")
+
     activations = []
+    with torch.no_grad(), capture_activations(layer) as store:
+        for start in range(0, len(slices), batch_size):
+            model(slices[start:start + batch_size].to(device))
+            activations.append(store["output"])
+    return gradcams_from_activations(model, torch.cat(activations), target_class, batch_size)
 
-    # In MONAI DenseNet121, the last DenseBlock is at index -2 in model.features
-    last_conv_layer = model.features[-2]
 
-    def forward_hook(module, input, output):
-        activations.append(output.detach())  # ✅ detach here
+def explain_volume(model, slices, activations=None, device="cpu", batch_size=16):
+    """
+    Grad-CAM for every analyzed slice of a scan.
 
-    def backward_hook(module, grad_input, grad_output):
-        gradients.append(grad_output[0].detach())  # ✅ detach here
+    Returns:
+        tuple: (cams (N, 224, 224) float32 scaled to [0, 1] by the scan's
+        maximum, saliency (N,) mean raw activation of each slice's heatmap)
+    """
+    if activations is not None:
+        cams = gradcams_from_activations(model, activations.to(device), batch_size=batch_size)
+    else:
+        cams = generate_gradcams(model, slices, device=device, batch_size=batch_size)
+    saliency = cams.mean(axis=(1, 2))
+    return cams / (cams.max() + 1e-8), saliency
 
-    # Register hooks
-    last_conv_layer.register_forward_hook(forward_hook)
-    last_conv_layer.register_backward_hook(backward_hook)
 
-    # Forward pass
-    output = model(input_tensor)
-    class_score = output[0, target_class]
+def heatmap_volume(cams, indices, shape, bbox=None):
+    """
+    Assemble per-slice heatmaps into a float32 (H, W, D) volume aligned with
+    the source scan: each cam is resized back to the slice (or its bbox crop)
+    and placed at its depth index; slices that were not analyzed stay 0.
+    """
+    height, width, depth = shape[:3]
+    y0, y1, x0, x1 = bbox if bbox is not None else (0, height, 0, width)
+    volume = np.zeros((height, width, depth), dtype=np.float32)
+    for cam, index in zip(cams, indices):
+        volume[y0:y1, x0:x1, int(index)] = cv2.resize(cam.astype(np.float32), (x1 - x0, y1 - y0))
+    return volume
 
-    # Backward pass
-    model.zero_grad()
-    class_score.backward()
 
-    # Extract activations and gradients
-    grads = gradients[0].cpu().numpy()[0]
-    acts = activations[0].cpu().numpy()[0]
+def heatmap_to_nifti(volume, affine=None):
+    """Gzipped NIfTI bytes for a heatmap volume (affine of the source scan when known)."""
+    image = nib.Nifti1Image(volume.astype(np.float32), np.eye(4) if affine is None else affine)
+    return gzip.compress(image.to_bytes(), compresslevel=6)
 
-    # Global-average-pool gradients → weights
-    weights = np.mean(grads, axis=(1, 2))
-    cam = np.zeros(acts.shape[1:], dtype=np.float32)
 
-    for i, w in enumerate(weights):
-        cam += w * acts[i, :, :]
+def generate_gradcam(model, input_tensor, target_class=1):
+    """
+    Generate Grad-CAM heatmap for MONAI DenseNet-121.
+    Standalone path: one forward pass with a scoped activation hook, then the
+    gradient of the class score with respect to those activations.
+    """
+    model.eval()
+    last_conv_layer = find_cam_layer(model)
+    if last_conv_layer is None:
+        raise ValueError("Grad-CAM needs an eager DenseNet model (model.features[-2]).")
+
+    with torch.enable_grad(), capture_activations(last_conv_layer) as store:
+        # Forward pass
+        output = model(input_tensor)
+        class_score = output[0, target_class]
+        activations = store["output"]
+
+        # Backward pass (gradients w.r.t. activations only; parameter .grad untouched)
+        gradients, = torch.autograd.grad(class_score, activations)
 
-    # ReLU and normalize
-    cam = np.maximum(cam, 0)
-    cam = cv2.resize(cam, (224, 224))
-    cam = cam / (cam.max() + 1e-8)
-    return cam
+    return cam_from_gradients(activations.detach(), gradients)
 
 
-def overlay_heatmap_on_slice(slice_2d, heatmap, alpha=0.4):
-    """Overlay Grad-CAM heatmap on grayscale MRI slice."""
+def explain_slice(model, slice_tensor, activations=None, device="cpu"):
+    """
+    Grad-CAM heatmap for one (1, 3, 224, 224) slice: from activations
+    captured during a batched pass when available, otherwise with a full
+    forward/backward pass of the eager model.
+    """
+    if activations is not None:
+        return gradcam_from_activations(model, activations.to(device))
+    return generate_gradcam(model, slice_tensor.to(device))
+
+
+def overlay_heatmap_on_slice(slice_2d, heatmap, alpha=0.4, bbox=None):
+    """
+    Overlay Grad-CAM heatmap on grayscale MRI slice.
+    bbox (y0, y1, x0, x1) is the crop the model saw; the heatmap is mapped
+    back into that region of the full slice.
+    """
     # Normalize grayscale slice
     slice_norm = cv2.normalize(slice_2d, None, 0, 255, cv2.NORM_MINMAX)
     slice_rgb = cv2.cvtColor(slice_norm.astype(np.uint8), cv2.COLOR_GRAY2BGR)
 
-    # Resize heatmap to match the MRI slice shape
-    heatmap_resized = cv2.resize(heatmap, (slice_rgb.shape[1], slice_rgb.shape[0]))
+    # Resize heatmap to match the MRI slice shape (or the cropped region of it)
+    if bbox is None:
+        heatmap_resized = cv2.resize(heatmap, (slice_rgb.shape[1], slice_rgb.shape[0]))
+    else:
+        y0, y1, x0, x1 = bbox
+        heatmap_resized = np.zeros(slice_rgb.shape[:2], dtype=np.float32)
+        heatmap_resized[y0:y1, x0:x1] = cv2.resize(heatmap.astype(np.float32), (x1 - x0, y1 - y0))
 
     # Apply color map
     heatmap_color = cv2.applyColorMap(np.uint8(255 * heatmap_resized), cv2.COLORMAP_JET)
@@ -0,0 +1,83 @@
+# modules/workers.py
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+class PipelineBusyError(RuntimeError):
+    """Raised when the pipeline already has max_pending requests in flight."""
+
+
+class StagedExecutor:
+    """
+    Runs blocking pipeline stages off the event loop.
+
+    - run_cpu: CPU-bound, picklable module-level functions (loading,
+      preprocessing). Uses a process pool when pool_kind="process",
+      otherwise a thread pool (numpy, OpenCV and torch release the GIL).
+      Arguments and results are pickled across processes, so pass paths
+      rather than volumes and return compact results (e.g. uint8 slices).
+    - run_thread: CPU-bound stages that need in-process state such as the
+      shared model (Grad-CAM, report rendering).
+    - run_io: blocking network/disk calls (storage uploads, DB writes).
+
+    admit() bounds how many requests may be in the pipeline at once; beyond
+    that new requests are rejected instead of queueing without limit.
+
+    initializer(*initargs) runs once in every run_cpu worker (e.g. to set
+    per-process thread limits).
+    """
+
+    def __init__(self, cpu_workers=4, io_workers=8, max_pending=64, pool_kind="thread", initializer=None,
+                 initargs=()):
+        self.pool_kind = pool_kind
+        self.max_pending = max_pending
+        self._pending = 0
+
+        if pool_kind == "process":
+            # spawn avoids forking a parent that already runs torch/OpenMP threads
+            self._cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=initializer, initargs=initargs)
+        elif pool_kind == "thread":
+            self._cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="pipeline-cpu",
+                                                initializer=initializer, initargs=initargs)
+        else:
+            raise ValueError(f"Unknown pool kind '{pool_kind}'. Use 'thread' or 'process'.")
+
+        self._thread_pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="pipeline-model")
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="pipeline-io")
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a pipeline slot for the duration of one request."""
+        if self.max_pending and self._pending >= self.max_pending:
+            raise PipelineBusyError(f"Pipeline is at capacity ({self.max_pending} requests in flight).")
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+
+    async def _run(self, pool, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        return await self._run(self._cpu_pool, fn, *args, **kwargs)
+
+    async def run_thread(self, fn, *args, **kwargs):
+        return await self._run(self._thread_pool, fn, *args, **kwargs)
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await self._run(self._io_pool, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        for pool in (self._cpu_pool, self._thread_pool, self._io_pool):
+            pool.shutdown(wait=wait)
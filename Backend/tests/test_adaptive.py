@@ -0,0 +1,74 @@
+# tests/test_adaptive.py
+import asyncio
+
+import torch
+import torch.nn.functional as F
+
+from modules.adaptive import AdaptiveSelector, adaptive_predict
+from modules.inference import load_model, predict_scan
+from modules.scheduler import InferenceScheduler
+
+
+def fake_probs(tumor):
+    """(B, 2) probabilities from per-slice tumor probabilities."""
+    tumor = torch.tensor(tumor, dtype=torch.float32)
+    return torch.stack([1 - tumor, tumor], dim=1)
+
+
+def drive(selector, tumor_prob):
+    while (positions := selector.next_batch()) is not None:
+        selector.update(positions, fake_probs([tumor_prob(p) for p in positions]))
+    return selector.result()
+
+
+def test_clear_scan_exits_after_the_coarse_pass():
+    selector = AdaptiveSelector(40, stride=4, min_confidence=90.0, min_slices=6, batch_size=64)
+    assert selector.next_batch() == list(range(2, 40, 4))
+
+    result = drive(selector, lambda p: 0.02)
+    assert result.label == "No Tumor"
+    assert result.exited_early
+    assert result.forward_passes == 10
+    assert result.savings == 0.75
+
+
+def test_suspicious_slices_are_refined_around_their_neighbours():
+    # One bright slice among clear ones: its neighbours are scored next
+    selector = AdaptiveSelector(40, stride=4, min_confidence=99.9, min_slices=6, batch_size=64,
+                                exhaustive_fallback=False)
+    coarse = selector.next_batch()
+    selector.update(coarse, fake_probs([0.95 if p == 18 else 0.1 for p in coarse]))
+    assert selector.next_batch() == [17, 19, 16, 20, 15, 21]
+
+
+def test_unclear_scan_falls_back_to_the_exhaustive_result():
+    torch.manual_seed(0)
+    model = load_model()
+    slices = torch.randn(11, 3, 224, 224)
+    label, confidence = predict_scan(model, slices)
+
+    # An unreachable margin forces every slice to be scored
+    result = adaptive_predict(model, slices, stride=3, min_confidence=101.0, batch_size=4)
+    assert result.forward_passes == 11
+    assert not result.exited_early
+    assert result.label == label
+    assert abs(result.confidence - confidence) < 1e-4
+
+
+def test_scheduler_predict_slices_returns_per_slice_probabilities():
+    torch.manual_seed(0)
+    model = load_model().eval()
+    slices = torch.randn(5, 3, 224, 224)
+    with torch.no_grad():
+        expected = F.softmax(model(slices), dim=1)
+
+    async def run():
+        scheduler = InferenceScheduler(model, max_batch_size=2, max_wait_ms=10)
+        scheduler.start()
+        probs = await scheduler.predict_slices(slices)
+        await scheduler.stop()
+        return probs
+
+    probs = asyncio.run(run())
+    assert probs.shape == (5, 2)
+    assert torch.allclose(probs, expected, atol=1e-5)
@@ -0,0 +1,36 @@
+# tests/test_backends.py
+import pytest
+import torch
+
+from modules.backends import prepare_backend, quantize_static_int8
+from modules.inference import load_model, predict_scan
+
+
+@pytest.fixture(scope="module")
+def model_and_batch():
+    torch.manual_seed(0)
+    return load_model(), torch.randn(6, 3, 224, 224)
+
+
+@pytest.mark.parametrize("backend", ["fp32", "channels_last", "int8_dynamic"])
+def test_backend_agrees_with_fp32(model_and_batch, backend):
+    model, batch = model_and_batch
+    label, conf = predict_scan(model, batch)
+    other_label, other_conf = predict_scan(prepare_backend(model, backend), batch)
+    assert other_label == label
+    assert abs(other_conf - conf) < 2.0
+
+
+def test_static_int8_runs_after_calibration(model_and_batch):
+    model, batch = model_and_batch
+    quantized = quantize_static_int8(model, [batch[:3], batch[3:]])
+    with torch.no_grad():
+        assert quantized(batch).shape == (6, 2)
+
+
+def test_static_int8_requires_calibration_data(model_and_batch):
+    model, _ = model_and_batch
+    with pytest.raises(ValueError):
+        prepare_backend(model, "int8_static")
+    with pytest.raises(ValueError):
+        prepare_backend(model, "fp16")
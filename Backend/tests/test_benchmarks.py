@@ -0,0 +1,39 @@
+# tests/test_benchmarks.py
+import numpy as np
+
+from benchmarks.run_benchmarks import compare, run_suite, summarize
+from benchmarks.synthetic import synthetic_volume, write_inputs
+from modules.input_loader import load_mri
+
+
+def test_synthetic_formats_load_to_the_same_volume(tmp_path):
+    paths = write_inputs(str(tmp_path), (32, 32, 8), formats=("nifti", "nifti_gz", "dicom"))
+    expected = synthetic_volume((32, 32, 8))
+    for fmt, path in paths.items():
+        volume = load_mri(path)
+        assert volume.shape == (32, 32, 8)
+        # DICOM stores uint16 with a rescale slope, so allow quantisation error
+        assert np.allclose(volume, expected, atol=0.1 if fmt == "dicom" else 1e-5), fmt
+
+
+def test_summarize_and_compare_flag_real_slowdowns_only():
+    stats = summarize([0.010, 0.012, 0.020, 0.011], units=40, unit="slices")
+    assert stats["p50_ms"] == np.percentile([10, 12, 20, 11], 50)
+    assert stats["p99_ms"] > stats["p95_ms"] > stats["p50_ms"]
+    assert abs(stats["throughput_per_s"] - 40 / 0.01325) < 1e-6
+
+    baseline = {"stages": {"predict": {"p50_ms": 100.0, "peak_rss_mb": 500.0},
+                           "tiny": {"p50_ms": 0.2, "peak_rss_mb": 500.0}}}
+    current = {"stages": {"predict": {"p50_ms": 130.0, "peak_rss_mb": 505.0},
+                          "tiny": {"p50_ms": 0.4, "peak_rss_mb": 500.0},
+                          "new_stage": {"p50_ms": 1.0, "peak_rss_mb": 1.0}}}
+    flagged = {(stage, metric) for stage, metric, *_, regressed in compare(current, baseline) if regressed}
+    assert flagged == {("predict", "p50_ms")}
+
+
+def test_run_suite_times_requested_stages(tmp_path):
+    results = run_suite((48, 48, 10), formats=("nifti",), stages=("load_mri", "extract_slices", "create_pdf_report"),
+                        repeats=2, warmup=0, workdir=str(tmp_path))
+    assert set(results) == {"load_mri[nifti]", "extract_slices", "create_pdf_report"}
+    assert results["load_mri[nifti]"]["units"] == 10
+    assert all(stats["peak_rss_mb"] > 0 and stats["repeats"] == 2 for stats in results.values())
@@ -0,0 +1,85 @@
+# tests/test_bulk_score.py
+import csv
+
+import nibabel as nib
+import numpy as np
+import torch
+
+from modules.inference import load_model, predict_scan
+from modules.pipeline import prepare_scan
+from tools.bulk_score import bulk_score, prefetch_scans, read_manifest, walk_scans
+
+
+def write_scan(path, depth, seed):
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(200, 50, (48, 48, depth)).astype(np.float32)
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+
+
+def test_walk_and_manifest_find_the_same_scans(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "series").mkdir()
+    write_scan(tmp_path / "a" / "one.nii", 10, 0)
+    (tmp_path / "series" / "0001.dcm").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("not a scan")
+
+    scans = walk_scans(str(tmp_path))
+    assert scans == [str(tmp_path / "a" / "one.nii"), str(tmp_path / "series")]
+
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("a/one.nii\n# comment\nseries\n")
+    assert read_manifest(str(manifest)) == scans
+
+
+def test_cross_study_batches_match_predict_scan_and_resume(tmp_path):
+    torch.manual_seed(0)
+    model = load_model()
+    paths = []
+    for i, depth in enumerate((12, 9, 15)):
+        write_scan(tmp_path / f"scan{i}.nii", depth, i)
+        paths.append(str(tmp_path / f"scan{i}.nii"))
+    (tmp_path / "broken.nii").write_bytes(b"junk")
+    paths.insert(1, str(tmp_path / "broken.nii"))
+    output = str(tmp_path / "scores.csv")
+
+    # Batches of 4 slices cut across study boundaries
+    scored, failed, skipped = bulk_score(paths, output, model, "v1", batch_size=4, workers=2, pool_kind="thread")
+    assert (scored, failed, skipped) == (3, 1, 0)
+
+    with open(output, newline="") as f:
+        rows = {row["path"]: row for row in csv.DictReader(f)}
+    assert rows[str(tmp_path / "broken.nii")]["error"]
+    for path in paths[:1] + paths[2:]:
+        label, confidence = predict_scan(model, prepare_scan(path).slices)
+        assert rows[path]["label"] == label
+        assert abs(float(rows[path]["confidence"]) - confidence) < 1e-3
+
+    # Workers hand back uint8 slices, with or without a slice store
+    (_, scan, error), = prefetch_scans(paths[:1], workers=1, pool_kind="thread")
+    assert error is None and scan.slices.dtype == np.uint8 and scan.slices.ndim == 3
+
+    # Only the failed study is retried; a new model version rescores everything
+    assert bulk_score(paths, output, model, "v1", batch_size=4, pool_kind="thread") == (0, 1, 3)
+    assert bulk_score(paths, output, model, "v2", batch_size=4, pool_kind="thread") == (3, 1, 0)
+
+
+def test_rescoring_from_the_slice_store_skips_decoding(tmp_path):
+    from modules.slice_store import SliceStore
+
+    torch.manual_seed(0)
+    model = load_model()
+    paths = []
+    for i, depth in enumerate((10, 13)):
+        write_scan(tmp_path / f"scan{i}.nii", depth, i)
+        paths.append(str(tmp_path / f"scan{i}.nii"))
+    store = SliceStore(str(tmp_path / "slices"))
+
+    bulk_score(paths, str(tmp_path / "a.csv"), model, "v1", batch_size=4, pool_kind="thread", slice_store=store)
+    assert store.stats()["entries"] == 2
+
+    # Second pass reads the stored uint8 slices and reproduces the scores
+    bulk_score(paths, str(tmp_path / "b.csv"), model, "v1", batch_size=4, pool_kind="thread", slice_store=store)
+    with open(tmp_path / "a.csv", newline="") as a, open(tmp_path / "b.csv", newline="") as b:
+        first = [(row["label"], row["confidence"]) for row in csv.DictReader(a)]
+        second = [(row["label"], row["confidence"]) for row in csv.DictReader(b)]
+    assert first == second and all(label for label, _ in first)
@@ -0,0 +1,34 @@
+# tests/test_database.py
+import pytest
+
+from modules.database import SQLiteDatabase
+
+
+def test_sqlite_rows_get_unique_ids_and_survive_a_reopen(tmp_path):
+    path = str(tmp_path / "db" / "local.sqlite3")
+    db = SQLiteDatabase(path)
+    first = db.insert("analysis_results", {"tumor_type": "Tumor", "confidence": 91.5, "recommendations": ["a", "b"]})
+    second = db.insert("analysis_results", {"tumor_type": "No Tumor", "confidence": 60.0})
+    report = db.insert("reports", {"id": "r1", "analysis_id": second, "patient_id": "p1"})
+    assert first != second and report == "r1"
+    db.close()
+
+    reopened = SQLiteDatabase(path)
+    assert reopened.get("analysis_results", first)["recommendations"] == ["a", "b"]
+    assert [row["id"] for row in reopened.rows("analysis_results")] == [first, second]
+    assert reopened.rows("reports") == [{"analysis_id": second, "patient_id": "p1", "id": "r1"}]
+    assert reopened.get("reports", 99) is None
+
+
+def test_sqlite_insert_with_a_known_id_is_idempotent(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "local.sqlite3"))
+    assert db.insert("reports", {"id": "r1", "patient_id": "p1"}) == "r1"
+    # A retry after a committed-but-timed-out insert keeps the first row
+    assert db.insert("reports", {"id": "r1", "patient_id": "p1"}) == "r1"
+    assert db.rows("reports") == [{"patient_id": "p1", "id": "r1"}]
+
+
+def test_sqlite_rejects_unsafe_table_names(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "local.sqlite3"))
+    with pytest.raises(ValueError):
+        db.insert('reports"; DROP TABLE reports; --', {})
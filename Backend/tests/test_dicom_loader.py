@@ -0,0 +1,91 @@
+# tests/test_dicom_loader.py
+import io
+import zipfile
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+from modules import dicom_loader
+from modules.dicom_loader import load_dicom_folder, load_dicom_zip
+from modules.input_loader import load_mri
+
+
+def make_slice(pixels: np.ndarray, z: float, instance: int, slope=2.0, intercept=-10.0):
+    """Minimal single-frame MR slice as DICOM Part 10 bytes."""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = MRImageStorage
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = "MR"
+    ds.InstanceNumber = instance
+    ds.ImagePositionPatient = [0.0, 0.0, z]
+    ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    ds.RescaleSlope = slope
+    ds.RescaleIntercept = intercept
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.astype(np.uint16).tobytes()
+
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def make_series(depth=6, shape=(16, 12)):
+    """Slices whose file names are in reverse anatomical order."""
+    rng = np.random.default_rng(0)
+    stack = rng.integers(0, 1000, size=shape + (depth,)).astype(np.uint16)
+    files = {f"IM{depth - k:03d}.dcm": make_slice(stack[:, :, k], z=2.5 * k, instance=k + 1) for k in range(depth)}
+    expected = stack.astype(np.float32) * 2.0 - 10.0
+    return files, expected
+
+
+def test_folder_is_ordered_by_position_and_rescaled(tmp_path):
+    files, expected = make_series()
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+
+    volume = load_dicom_folder(str(tmp_path), max_workers=3)
+    assert volume.dtype == np.float32
+    assert np.array_equal(volume, expected)
+    assert np.array_equal(load_mri(str(tmp_path)), expected)
+
+
+def test_zipped_series_from_memory():
+    files, expected = make_series()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(f"series/{name}", data)
+        archive.writestr("series/README.txt", b"not a slice")
+
+    assert np.array_equal(load_dicom_zip(buffer.getvalue()), expected)
+    assert np.array_equal(load_mri(buffer.getvalue(), filename="study.zip"), expected)
+
+
+def test_each_slice_is_parsed_once(tmp_path, monkeypatch):
+    files, expected = make_series()
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+
+    parsed = []
+    real_dcmread = dicom_loader.pydicom.dcmread
+
+    def counting_dcmread(source, **kwargs):
+        parsed.append(source)
+        return real_dcmread(source, **kwargs)
+
+    monkeypatch.setattr(dicom_loader.pydicom, "dcmread", counting_dcmread)
+    assert np.array_equal(load_dicom_folder(str(tmp_path)), expected)
+    assert len(parsed) == len(files)
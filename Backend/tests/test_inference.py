@@ -0,0 +1,81 @@
+# tests/test_inference.py
+import gzip
+
+import nibabel as nib
+import numpy as np
+import torch
+
+from modules.inference import LABELS, load_model, predict_and_explain, predict_scan, resolve_batch_size
+from modules.preprocessing import uint8_input_to_tensor
+from modules.visualization import explain_volume, generate_gradcam, heatmap_to_nifti, heatmap_volume
+
+
+def test_micro_batches_match_single_pass():
+    torch.manual_seed(0)
+    model = load_model()
+    batch = torch.randn(10, 3, 224, 224)
+
+    full_label, full_conf = predict_scan(model, batch, batch_size=0)
+    for size in (1, 3, 4):
+        label, conf = predict_scan(model, batch, batch_size=size)
+        assert label == full_label
+        assert abs(conf - full_conf) < 1e-4
+
+    # List input takes the same path
+    label, conf = predict_scan(model, list(batch), batch_size=4)
+    assert label in LABELS and abs(conf - full_conf) < 1e-4
+
+
+def test_memory_budget_caps_batch_size():
+    assert resolve_batch_size(100, batch_size=0, max_memory_mb=0) == 100
+    assert resolve_batch_size(100, batch_size=32, max_memory_mb=0) == 32
+    assert resolve_batch_size(100, batch_size=32, max_memory_mb=100) == 4
+    assert resolve_batch_size(100, batch_size=32, max_memory_mb=1) == 1
+    assert resolve_batch_size(3, batch_size=32, max_memory_mb=0) == 3
+
+
+def test_predict_and_explain_matches_separate_passes():
+    torch.manual_seed(0)
+    model = load_model()
+    batch = torch.randn(5, 3, 224, 224)
+
+    label, conf, cam = predict_and_explain(model, batch, explain_index=3, batch_size=2)
+    exp_label, exp_conf = predict_scan(model, batch)
+    exp_cam = generate_gradcam(model, batch[3:4])
+
+    assert label == exp_label and abs(conf - exp_conf) < 1e-4
+    assert cam.shape == (224, 224)
+    assert np.allclose(cam, exp_cam, atol=1e-4)
+    # Hooks are scoped: nothing is left registered on the shared model
+    assert not model.features[-2]._forward_hooks
+    assert not model.features[-2]._backward_hooks
+
+    # uint8 slices (SliceStore / model-server form) are expanded per micro-batch
+    stack = np.random.default_rng(0).integers(0, 256, (5, 224, 224), dtype=np.uint8)
+    label, conf, cam = predict_and_explain(model, stack, explain_index=3, batch_size=2)
+    exp_label, exp_conf = predict_scan(model, uint8_input_to_tensor(stack))
+    assert label == exp_label and abs(conf - exp_conf) < 1e-4
+    assert np.allclose(cam, generate_gradcam(model, uint8_input_to_tensor(stack[3:4])), atol=1e-4)
+
+
+def test_volume_gradcam_matches_per_slice_gradcam():
+    torch.manual_seed(0)
+    model = load_model()
+    batch = torch.randn(5, 3, 224, 224)
+
+    cams, saliency = explain_volume(model, batch, batch_size=2)
+    assert cams.shape == (5, 224, 224) and saliency.shape == (5,)
+    assert abs(cams.max() - 1.0) < 1e-5  # scaled by the scan's maximum
+    for i in range(5):
+        assert np.allclose(cams[i] / (cams[i].max() + 1e-8), generate_gradcam(model, batch[i:i + 1]), atol=1e-4)
+
+
+def test_heatmap_volume_places_each_cam_at_its_depth():
+    cams = np.stack([np.full((224, 224), 0.5, np.float32), np.ones((224, 224), np.float32)])
+    volume = heatmap_volume(cams, indices=[3, 6], shape=(40, 50, 10), bbox=(5, 35, 10, 40))
+    assert volume.shape == (40, 50, 10)
+    assert np.allclose(volume[5:35, 10:40, 3], 0.5) and np.allclose(volume[5:35, 10:40, 6], 1.0)
+    assert volume[:5].max() == 0 and volume[:, :, [0, 1, 2, 4, 5, 7, 8, 9]].max() == 0
+
+    image = nib.Nifti1Image.from_bytes(gzip.decompress(heatmap_to_nifti(volume)))
+    assert np.array_equal(np.asarray(image.dataobj), volume)
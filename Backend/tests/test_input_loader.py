@@ -0,0 +1,59 @@
+# tests/test_input_loader.py
+import gzip
+import io
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from modules.input_loader import load_mri, load_nifti_stream
+
+
+def make_nifti(image_class=nib.Nifti1Image, shape=(12, 10, 6)):
+    data = np.arange(np.prod(shape), dtype=np.float32).reshape(shape)
+    return data, image_class(data, np.eye(4)).to_bytes()
+
+
+@pytest.mark.parametrize("image_class", [nib.Nifti1Image, nib.Nifti2Image])
+def test_nifti_from_bytes_and_gzip_stream(image_class):
+    data, raw = make_nifti(image_class)
+
+    assert np.array_equal(load_nifti_stream(raw), data)
+    assert np.array_equal(load_nifti_stream(io.BytesIO(gzip.compress(raw))), data)
+
+
+def test_load_mri_accepts_file_like_with_filename():
+    data, raw = make_nifti()
+    volume = load_mri(io.BytesIO(gzip.compress(raw)), filename="scan.nii.gz")
+    assert volume.dtype == np.float32
+    assert np.array_equal(volume, data)
+
+
+def test_in_memory_rejects_non_nifti():
+    with pytest.raises(ValueError):
+        load_nifti_stream(b"not a nifti file at all")
+    with pytest.raises(ValueError):
+        load_mri(b"...", filename="scan.png")
+
+
+def test_lazy_volume_reads_match_eager(tmp_path):
+    data, raw = make_nifti(shape=(16, 14, 20))
+    path = tmp_path / "scan.nii"
+    path.write_bytes(raw)
+
+    volume = load_mri(str(path), lazy=True)
+    assert volume.shape == data.shape
+    assert np.array_equal(volume[:, :, 6:14], data[:, :, 6:14])
+    assert np.array_equal(volume[:, :, 9], data[:, :, 9])
+    assert np.array_equal(volume[:, :, [7, 9, 12]], data[:, :, [7, 9, 12]])
+    assert volume[:, :, 9].dtype == np.float32
+    assert np.array_equal(np.asarray(volume), data)
+
+
+def test_lazy_volume_picks_one_volume_from_4d():
+    data4d = np.random.default_rng(0).random((8, 8, 6, 4)).astype(np.float32)
+    raw = nib.Nifti1Image(data4d, np.eye(4)).to_bytes()
+
+    volume = load_mri(gzip.compress(raw), filename="brats.nii.gz", lazy=True)
+    assert volume.shape == (8, 8, 6)
+    assert np.allclose(volume[:, :, 2:5], data4d[:, :, 2:5, 0])
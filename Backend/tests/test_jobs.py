@@ -0,0 +1,82 @@
+# tests/test_jobs.py
+import asyncio
+import io
+import threading
+
+from modules.jobs import JobRunner, JobStore
+from modules.workers import StagedExecutor
+
+
+def make_store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "files"))
+
+
+def test_store_queues_claims_and_survives_restart(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.create_job([("a.nii", io.BytesIO(b"aaa")), ("b.nii", io.BytesIO(b"bbb"))], patient_id="p1")
+
+    first = store.claim_next()
+    assert (first["idx"], first["patient_id"]) == (0, "p1")
+    assert open(first["path"], "rb").read() == b"aaa"
+    store.finish_item(job_id, 0, result={"label": "No Tumor"})
+    assert store.claim_next()["idx"] == 1
+    assert store.claim_next() is None
+    store.close()
+
+    # A restart puts the interrupted item back in the queue
+    store = make_store(tmp_path)
+    assert store.requeue_running() == 1
+    job = store.get_job(job_id)
+    assert job["status"] == "running"
+    assert job["counts"] == {"queued": 1, "running": 0, "done": 1, "failed": 0}
+    assert job["items"][0]["result"] == {"label": "No Tumor"}
+
+    store.finish_item(job_id, store.claim_next()["idx"], error="bad scan")
+    assert store.get_job(job_id)["status"] == "failed"
+    assert store.get_job("missing") is None
+
+
+def test_runner_reports_every_stage_and_records_results(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.create_job([("a.nii", io.BytesIO(b"a")), ("bad.nii", io.BytesIO(b"b"))])
+    set_stage, stage_threads = store.set_stage, set()
+
+    def record_set_stage(*args):
+        stage_threads.add(threading.current_thread().name)
+        set_stage(*args)
+
+    store.set_stage = record_set_stage
+
+    async def process(item, progress):
+        for stage in ("load", "preprocess", "inference", "explain", "publish"):
+            progress(stage)
+            await asyncio.sleep(0)
+        if item["filename"] == "bad.nii":
+            raise ValueError("Not a NIfTI file")
+        return {"label": "Tumor"}
+
+    async def run():
+        executor = StagedExecutor(cpu_workers=1, io_workers=2)
+        runner = JobRunner(store, process, run_io=executor.run_io, workers=2, poll_interval_s=0.05)
+        events = runner.subscribe(job_id)
+        runner.start()
+        finished = []
+        while len(finished) < 2:
+            event = await asyncio.wait_for(events.get(), timeout=5)
+            if event["status"] != "running":
+                finished.append(event)
+        await runner.stop()
+        executor.shutdown()
+        return finished
+
+    finished = asyncio.run(run())
+    assert sorted(e["status"] for e in finished) == ["done", "failed"]
+
+    job = store.get_job(job_id)
+    assert job["counts"]["done"] == 1 and job["counts"]["failed"] == 1
+    assert job["items"][0]["stage"] == "publish" and job["items"][0]["result"] == {"label": "Tumor"}
+    assert job["items"][1]["error"] == "Not a NIfTI file"
+    # Scans are removed whatever the outcome, and the job folder with the last one
+    assert not (tmp_path / "files" / job_id).exists()
+    # Stage writes ran on the I/O pool, not on the event loop
+    assert stage_threads and all(name.startswith("pipeline-io") for name in stage_threads)
@@ -0,0 +1,105 @@
+# tests/test_mesh.py
+import importlib.util
+import os
+
+import nibabel as nib
+import numpy as np
+
+from modules.mesh import (
+    MeshCache,
+    build_and_cache_meshes,
+    build_meshes,
+    decimate,
+    extract_label_meshes,
+    mesh_key,
+    pack_mesh,
+    unpack_mesh,
+)
+
+
+def sphere_labels(shape=(64, 64, 48)):
+    """Edema shell (2) around a core (1), the way BraTS nests its labels."""
+    grid = np.indices(shape).astype(np.float32)
+    centre = np.array([32, 30, 24], dtype=np.float32).reshape(3, 1, 1, 1)
+    radius = np.sqrt(((grid - centre) ** 2).sum(axis=0))
+    labels = np.zeros(shape, dtype=np.int16)
+    labels[radius < 16] = 2
+    labels[radius < 8] = 1
+    return labels
+
+
+def test_one_surface_per_label_around_the_labelled_voxels():
+    labels = sphere_labels()
+    meshes = extract_label_meshes(labels, downsample=2)
+    assert set(meshes) == {1, 2}
+
+    for label, radius in ((1, 8), (2, 16)):
+        verts, faces = meshes[label]
+        assert faces.max() < len(verts)
+        distance = np.linalg.norm(verts - np.array([32, 30, 24]), axis=1)
+        assert abs(np.median(distance) - radius) < 2.5
+
+
+def test_decimation_reduces_vertices_and_keeps_valid_faces():
+    verts, faces = extract_label_meshes(sphere_labels(), downsample=1)[2]
+    coarse_verts, coarse_faces = decimate(verts, faces, cell_size=6.0)
+
+    assert 0 < len(coarse_verts) < len(verts) // 4
+    assert coarse_faces.max() < len(coarse_verts)
+    assert (coarse_faces[:, 0] != coarse_faces[:, 1]).all()
+    assert decimate(verts, faces, 0)[0] is verts
+
+
+def test_packed_mesh_round_trips_within_quantization_error():
+    verts, faces = extract_label_meshes(sphere_labels(), downsample=2)[2]
+    data = pack_mesh(verts, faces)
+    assert len(data) < verts.nbytes + faces.nbytes  # uint16 coordinates and indices
+
+    unpacked_verts, unpacked_faces = unpack_mesh(data)
+    extent = verts.max(axis=0) - verts.min(axis=0)
+    assert np.abs(unpacked_verts - verts).max() <= extent.max() / 65535.0
+    np.testing.assert_array_equal(unpacked_faces, faces)
+
+
+def test_cache_serves_every_level_and_rejects_foreign_keys(tmp_path):
+    manifest, blobs = build_meshes(sphere_labels(), downsample=2, lod_cells=(8.0, 0.0))
+    levels = manifest["labels"][1]["levels"]
+    assert levels[0]["vertices"] < levels[1]["vertices"]  # coarse first
+
+    cache = MeshCache(str(tmp_path))
+    key = mesh_key("0" * 64, {"downsample": 2})
+    cache.store(key, manifest, blobs)
+
+    assert cache.manifest(key)["shape"] == [64, 64, 48]
+    assert cache.read(key, 2, 0) == blobs[(2, 0)]
+    assert cache.read(key, 2, 5) is None
+    assert cache.manifest("..") is None
+
+
+def test_meshes_from_nifti_use_the_header_voxel_size(tmp_path):
+    labels = sphere_labels()
+    path = tmp_path / "seg.nii.gz"
+    nib.save(nib.Nifti1Image(labels, np.diag([1.0, 1.0, 2.5, 1.0])), str(path))
+
+    manifest = build_and_cache_meshes(str(path), "seg.nii.gz", "a" * 64, str(tmp_path / "cache"),
+                                      downsample=1, lod_cells=(0.0,))
+    assert manifest["spacing"] == [1.0, 1.0, 2.5]
+
+    verts, _ = unpack_mesh(MeshCache(str(tmp_path / "cache")).read("a" * 64, 2, 0))
+    extent = verts.max(axis=0) - verts.min(axis=0)
+    # The shell is a sphere in voxels, stretched along z in millimetres
+    assert abs(extent[2] / extent[0] - 2.5) < 0.1
+
+
+def test_display_script_meshes_a_nifti_segmentation(tmp_path):
+    # 3D_Visualization/display.py without the plotly window
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "3D_Visualization", "display.py")
+    spec = importlib.util.spec_from_file_location("display", script)
+    display = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(display)
+
+    path = tmp_path / "seg.nii.gz"
+    nib.save(nib.Nifti1Image(sphere_labels(), np.diag([1.0, 1.0, 2.0, 1.0])), str(path))
+    meshes = display.label_meshes(str(path))
+    assert [label for label, _, _ in meshes] == [1, 2]
+    assert all(len(verts) and len(faces) for _, verts, faces in meshes)
@@ -0,0 +1,135 @@
+# tests/test_model_registry.py
+import os
+import re
+
+import pytest
+import torch
+from torchvision import models
+
+from modules import model_registry
+from modules.model_registry import file_sha256, load_densenet, load_scripted_densenet, remap_monai_state_dict
+
+
+def monai_style_state_dict(model):
+    """Rename torchvision keys the way MONAI's DenseNet121 stores them."""
+    state = {}
+    for key, value in model.state_dict().items():
+        key = re.sub(r"(denselayer\d+)\.", r"\1.layers.", key)
+        key = key.replace("classifier.", "class_layers.out.")
+        state[key] = value.clone()
+    return state
+
+
+@pytest.fixture
+def reference_model():
+    torch.manual_seed(0)
+    model = models.densenet121(weights=None)
+    model.classifier = torch.nn.Linear(model.classifier.in_features, 2)
+    return model.eval()
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, "MODEL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(model_registry, "MODEL_SHA256", "")
+    monkeypatch.setattr(model_registry, "_VERIFIED", {})
+    return tmp_path / "cache"
+
+
+def write_sidecar(checkpoint):
+    (checkpoint.parent / (checkpoint.name + ".sha256")).write_text(f"{file_sha256(str(checkpoint))}  {checkpoint.name}\n")
+
+
+def test_remap_monai_keys(reference_model):
+    remapped = remap_monai_state_dict({"module." + k: v for k, v in monai_style_state_dict(reference_model).items()})
+    assert remapped.keys() == reference_model.state_dict().keys()
+
+
+def test_single_channel_stem_is_spread_over_rgb():
+    weight = torch.randn(64, 1, 7, 7)
+    remapped = remap_monai_state_dict({"features.conv0.weight": weight})
+    assert remapped["features.conv0.weight"].shape == (64, 3, 7, 7)
+    assert torch.allclose(remapped["features.conv0.weight"].sum(dim=1, keepdim=True), weight)
+
+
+def test_checkpoint_loads_verifies_and_caches(tmp_path, cache_dir, reference_model):
+    checkpoint = tmp_path / "densenet121_monai.pth"
+    torch.save({"state_dict": monai_style_state_dict(reference_model)}, checkpoint)
+    write_sidecar(checkpoint)
+    x = torch.randn(2, 3, 224, 224)
+
+    model, info = load_densenet(2, checkpoint=str(checkpoint))
+    assert info.sha256 == file_sha256(str(checkpoint))
+    with torch.no_grad():
+        assert torch.allclose(model(x), reference_model(x), atol=1e-5)
+
+    # Second load reuses the cached remapped state dict; TorchScript is cached too
+    assert list(cache_dir.glob("*.pt"))
+    scripted, _ = load_scripted_densenet(2, checkpoint=str(checkpoint))
+    assert list(cache_dir.glob("*.ts"))
+    scripted, info = load_scripted_densenet(2, checkpoint=str(checkpoint))
+    assert info.source == "torchscript"
+    with torch.no_grad():
+        assert torch.allclose(scripted(x), reference_model(x), atol=1e-5)
+
+
+def test_checksum_mismatch_is_rejected(tmp_path, cache_dir, monkeypatch, reference_model):
+    checkpoint = tmp_path / "model.pth"
+    torch.save(reference_model.state_dict(), checkpoint)
+    monkeypatch.setattr(model_registry, "MODEL_SHA256", "0" * 64)
+    with pytest.raises(RuntimeError):
+        load_densenet(2, checkpoint=str(checkpoint))
+
+
+def test_tampered_or_stale_cache_artifacts_are_rebuilt(tmp_path, cache_dir, monkeypatch, reference_model):
+    checkpoint = tmp_path / "model.pth"
+    torch.save(reference_model.state_dict(), checkpoint)
+    write_sidecar(checkpoint)
+    load_scripted_densenet(2, checkpoint=str(checkpoint))
+    script_path = next(cache_dir.glob("*.ts"))
+    assert (cache_dir / (script_path.name + ".sha256")).exists()
+
+    # Changed bytes in a fresh process: not loaded, rebuilt from the checkpoint
+    script_path.write_bytes(script_path.read_bytes() + b"\0")
+    model_registry._VERIFIED.clear()
+    with pytest.warns(UserWarning, match="integrity"):
+        _, info = load_scripted_densenet(2, checkpoint=str(checkpoint))
+    assert info.source == "torchscript"
+    assert model_registry._artifact_is_intact(str(script_path))
+
+    # A new remap version never reads the old cached state dict
+    monkeypatch.setattr(model_registry, "REMAP_VERSION", model_registry.REMAP_VERSION + 1)
+    assert model_registry._cache_paths(file_sha256(str(checkpoint)))[0] not in map(str, cache_dir.glob("*.pt"))
+
+
+def test_checkpoint_without_checksum_is_refused(tmp_path, cache_dir, reference_model):
+    checkpoint = tmp_path / "model.pth"
+    torch.save(reference_model.state_dict(), checkpoint)
+    with pytest.raises(RuntimeError, match="No checksum"):
+        load_densenet(2, checkpoint=str(checkpoint))
+
+
+def test_each_process_rehashes_before_trusting_a_checkpoint(tmp_path, cache_dir, reference_model):
+    checkpoint = tmp_path / "model.pth"
+    torch.save(reference_model.state_dict(), checkpoint)
+    write_sidecar(checkpoint)
+    load_densenet(2, checkpoint=str(checkpoint))
+
+    # Same size and mtime, different bytes: a fresh process must notice
+    stat = checkpoint.stat()
+    data = bytearray(checkpoint.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    checkpoint.write_bytes(bytes(data))
+    os.utime(checkpoint, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    model_registry._VERIFIED.clear()
+    with pytest.raises(RuntimeError, match="mismatch"):
+        load_densenet(2, checkpoint=str(checkpoint))
+
+
+def test_missing_checkpoint_falls_back_to_untrained(tmp_path, cache_dir):
+    empty = tmp_path / "empty.pth"
+    empty.write_bytes(b"")
+    with pytest.warns(UserWarning):
+        model, info = load_densenet(2, checkpoint=str(empty))
+    assert info.version == model_registry.UNTRAINED_VERSION
+    assert model.classifier.out_features == 2
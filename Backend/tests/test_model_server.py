@@ -0,0 +1,119 @@
+# tests/test_model_server.py
+import asyncio
+import os
+import stat
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from modules.inference import load_model, predict_scan
+from modules.model_server import ModelClient, ModelServer, check_authkey, slices_from_shm, slices_to_shm
+from modules.preprocessing import uint8_input_to_tensor
+
+AUTHKEY = b"test-model-server"
+
+
+@pytest.fixture
+def server(tmp_path):
+    torch.manual_seed(0)
+    model = load_model().eval()
+    address = str(tmp_path / "model.sock")
+    server = ModelServer(model, explain_model=model, model_version="test:fp32:eager", max_batch_size=4,
+                         max_wait_ms=20)
+    thread = threading.Thread(target=server.serve, args=(address, AUTHKEY), daemon=True)
+    thread.start()
+    yield model, address
+    server.stop()
+    thread.join(timeout=10)
+
+
+def test_shared_memory_round_trip_releases_the_block():
+    tensor = torch.randn(3, 3, 8, 8)
+    block, header = slices_to_shm(tensor)
+    try:
+        assert torch.equal(slices_from_shm(header), tensor)
+    finally:
+        block.close()
+        block.unlink()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=header["shm"])
+
+
+def test_uint8_slices_travel_compact_and_arrive_as_model_input():
+    stack = np.random.default_rng(0).integers(0, 256, (4, 224, 224), dtype=np.uint8)
+    block, header = slices_to_shm(stack)
+    try:
+        assert header["dtype"] == "uint8" and block.size < 4 * 3 * 224 * 224 * 4 // 10
+        assert torch.equal(slices_from_shm(header), uint8_input_to_tensor(stack))
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_foreign_shared_memory_names_and_weak_keys_are_refused():
+    foreign = SharedMemory(create=True, size=64)
+    try:
+        with pytest.raises(ValueError):
+            slices_from_shm({"shm": foreign.name, "shape": (1, 4, 4), "dtype": "uint8"})
+        with pytest.raises(ValueError):
+            slices_from_shm({"shm": "brainalyze_" + "0" * 32, "shape": (1, -4, 4), "dtype": "uint8"})
+    finally:
+        foreign.close()
+        foreign.unlink()
+
+    for weak in (b"", b"brainalyze"):
+        with pytest.raises(ValueError):
+            check_authkey(weak)
+
+
+def test_client_results_match_the_in_process_model(server):
+    model, address = server
+    scans = [torch.randn(n, 3, 224, 224) for n in (3, 5)]
+    stack = np.random.default_rng(1).integers(0, 256, (4, 224, 224), dtype=np.uint8)
+    expected = [predict_scan(model, s) for s in scans]
+    expected_uint8 = predict_scan(model, uint8_input_to_tensor(stack))
+    with torch.no_grad():
+        expected_probs = F.softmax(model(scans[0]), dim=1)
+
+    async def run():
+        client = ModelClient(address, authkey=AUTHKEY)
+        version = await client.wait_ready(poll_s=0.1, timeout_s=60)
+        results = await asyncio.gather(client.predict(scans[0]), client.predict(scans[1], explain_index=2))
+        probs = await client.predict_slices(scans[0])
+        compact = await client.predict(stack)
+        metrics = client.metrics()
+        await client.stop()
+        return version, results, probs, metrics, compact
+
+    version, (plain, explained), probs, metrics, compact = asyncio.run(run())
+    assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+
+    assert version == "test:fp32:eager"
+    assert plain[0] == expected[0][0] and abs(plain[1] - expected[0][1]) < 1e-4
+    assert explained[0] == expected[1][0] and abs(explained[1] - expected[1][1]) < 1e-4
+    cam = explained[2]
+    assert cam.shape == (224, 224) and np.isfinite(cam).all()
+    assert torch.allclose(probs, expected_probs, atol=1e-5)
+    assert compact[0] == expected_uint8[0] and abs(compact[1] - expected_uint8[1]) < 1e-4
+    assert metrics["slices_run"] >= 11  # warm-up batch plus both scans
+    assert metrics["in_flight"] == 0
+
+
+def test_client_reports_unreachable_server(tmp_path):
+    async def run():
+        client = ModelClient(str(tmp_path / "missing.sock"), authkey=AUTHKEY)
+        statuses = await client.ping()
+        start = time.monotonic()
+        with pytest.raises(RuntimeError):
+            await client.wait_ready(poll_s=0.05, timeout_s=0.2)
+        return statuses, client.ready, time.monotonic() - start
+
+    statuses, ready, waited = asyncio.run(run())
+    assert not ready
+    assert "Error" in next(iter(statuses.values()))
+    assert waited < 5
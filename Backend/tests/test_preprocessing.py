@@ -0,0 +1,151 @@
+# tests/test_preprocessing.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import nibabel as nib
+import numpy as np
+import torch
+
+from modules.pipeline import prepare_scan
+from modules.preprocessing import (
+    extract_slices,
+    foreground_bbox,
+    PreprocessingContext,
+    configure_preprocessing,
+    get_preprocessing_context,
+    preprocess_slice,
+    preprocess_slice_torch,
+    preprocess_volume,
+    preprocess_volume_batch,
+    preprocessing_params,
+    select_slice_indices,
+)
+from modules.visualization import overlay_heatmap_on_slice
+from utils.config import CROP_TO_FOREGROUND
+
+
+def make_volume(shape=(96, 80, 40), seed=0):
+    """Synthetic MRI-like volume: bright ellipsoid on a dark background."""
+    rng = np.random.default_rng(seed)
+    h, w, d = shape
+    yy, xx, zz = np.meshgrid(np.linspace(-1, 1, h), np.linspace(-1, 1, w), np.linspace(-1, 1, d), indexing="ij")
+    brain = (yy ** 2 / 0.7 + xx ** 2 / 0.6 + zz ** 2 / 0.9) < 1
+    volume = brain * 400.0 + rng.normal(0, 20, shape)
+    return volume.astype(np.float32)
+
+
+def test_select_slice_indices_matches_extract_slices():
+    volume = make_volume()
+    indices = select_slice_indices(volume)
+    slices = extract_slices(volume)
+    assert len(indices) == len(slices)
+    for i, s in zip(indices, slices):
+        assert np.array_equal(volume[:, :, i], s)
+
+
+def test_batch_matches_per_slice_reference():
+    volume = make_volume()
+    batch = preprocess_volume_batch(volume)
+    reference = torch.stack(preprocess_volume(volume))
+
+    assert batch.shape == reference.shape
+    assert batch.dtype == torch.float32
+    # Resize rounding may differ by about one grey level after normalization
+    assert torch.allclose(batch, reference, atol=0.05)
+
+
+def test_blank_volume_falls_back_to_middle_slice():
+    volume = np.zeros((64, 64, 20), dtype=np.float32)
+    batch = preprocess_volume_batch(volume)
+    assert batch.shape == (1, 3, 224, 224)
+    assert torch.allclose(batch[0], preprocess_slice(volume[:, :, 10]), atol=0.05)
+
+
+def test_prepare_scan_lazy_matches_eager_batch():
+    volume = make_volume()
+    scan = prepare_scan(nib.Nifti1Image(volume, np.eye(4)).to_bytes(), filename="scan.nii", crop=True)
+
+    assert scan.shape == volume.shape
+    assert np.array_equal(scan.indices, select_slice_indices(volume))
+    slices, bbox = preprocess_volume_batch(volume, crop=True, return_bbox=True)
+    assert torch.equal(scan.slices, slices)
+    assert scan.bbox == bbox
+    explained = scan.indices[scan.explain_position]
+    assert abs(explained - volume.shape[-1] // 2) == np.min(np.abs(scan.indices - volume.shape[-1] // 2))
+    assert np.array_equal(scan.explain_slice, volume[:, :, explained])
+
+
+def test_crop_is_off_by_default_everywhere():
+    # The cache-key parameters must describe the crop the tensors really had
+    volume = np.pad(make_volume(), ((40, 40), (30, 30), (0, 0)))
+    scan = prepare_scan(nib.Nifti1Image(volume, np.eye(4)).to_bytes(), filename="scan.nii")
+
+    assert preprocessing_params()["crop"] is False
+    assert scan.bbox is None
+    assert torch.equal(scan.slices, preprocess_volume_batch(volume))
+    assert not CROP_TO_FOREGROUND or os.getenv("CROP_TO_FOREGROUND")
+
+
+def test_foreground_bbox_is_a_padded_square_around_the_brain():
+    volume = np.zeros((120, 100, 10), dtype=np.float32)
+    volume[30:70, 20:50, :] = 400.0
+    volume[5, 90, 3] = 400.0  # isolated bright voxel is ignored
+    stack = np.moveaxis(volume, -1, 0)
+
+    y0, y1, x0, x1 = foreground_bbox(stack)
+    assert y1 - y0 == x1 - x0
+    assert y0 <= 30 and y1 >= 70 and x0 <= 20 and x1 >= 50
+    assert y1 - y0 < 60
+    assert foreground_bbox(np.zeros((3, 16, 16), dtype=np.float32)) == (0, 16, 0, 16)
+
+
+def test_cropped_batch_matches_cropped_reference():
+    volume = np.pad(make_volume(), ((40, 40), (30, 30), (0, 0)))
+    batch = preprocess_volume_batch(volume, crop=True)
+    reference = torch.stack(preprocess_volume(volume, crop=True))
+    assert torch.allclose(batch, reference, atol=0.05)
+
+
+def test_overlay_maps_cropped_heatmap_back_to_the_box():
+    slice_2d = np.zeros((100, 80), dtype=np.float32)
+    heatmap = np.ones((7, 7), dtype=np.float32)
+    overlay = overlay_heatmap_on_slice(slice_2d, heatmap, bbox=(20, 60, 10, 50))
+    plain = overlay_heatmap_on_slice(slice_2d, np.zeros((7, 7), dtype=np.float32))
+
+    assert overlay.shape == (100, 80, 3)
+    assert not np.array_equal(overlay[40, 30], plain[40, 30])  # inside the box: hot
+    assert np.array_equal(overlay[5, 5], plain[5, 5])  # outside: no heat
+
+
+def test_context_keeps_one_clahe_per_thread():
+    context = PreprocessingContext()
+    assert context.clahe() is context.clahe()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(context.clahe).result() is not context.clahe()
+
+    slice_2d = make_volume()[:, :, 20]
+    assert torch.equal(preprocess_slice(slice_2d, context), preprocess_slice(slice_2d))
+
+
+def test_torch_slice_path_matches_pil_reference():
+    volume = make_volume()
+    for depth in (5, 20, 35):
+        reference = preprocess_slice(volume[:, :, depth])
+        fast = preprocess_slice_torch(volume[:, :, depth])
+        assert fast.shape == reference.shape == (3, 224, 224)
+        # Resize rounding: about one grey level after ImageNet normalization
+        assert (fast - reference).abs().max() < 0.05
+
+
+def test_configure_preprocessing_applies_thread_limits():
+    previous = cv2.getNumThreads(), torch.get_num_threads()
+    try:
+        context = configure_preprocessing(cv2_threads=1, torch_threads=2)
+        assert get_preprocessing_context() is context
+        assert cv2.getNumThreads() == 1
+        assert torch.get_num_threads() == 2
+    finally:
+        cv2.setNumThreads(previous[0])
+        torch.set_num_threads(previous[1])
+        configure_preprocessing()
@@ -0,0 +1,109 @@
+# tests/test_publisher.py
+import asyncio
+
+from modules.publisher import Artifact, ArtifactPublisher
+from modules.storage import LocalStorage
+from modules.workers import StagedExecutor
+
+
+class FlakyTable:
+    """
+    insert_row stand-in whose first call to each table commits the row and
+    then times out; rows with an id that already exists are ignored.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.failed = set()
+
+    def __call__(self, table, row):
+        rows = self.rows.setdefault(table, [])
+        if all(existing["id"] != row["id"] for existing in rows):
+            rows.append(row)
+        if table not in self.failed:
+            self.failed.add(table)
+            raise TimeoutError("committed, then timed out")
+        return row["id"]
+
+
+def publish(storage, insert_row, **kwargs):
+    async def run():
+        executor = StagedExecutor(cpu_workers=1, io_workers=4)
+        publisher = ArtifactPublisher(storage, insert_row, run_io=executor.run_io, retries=3, backoff_s=0.01)
+        job = publisher.submit(**kwargs)
+        urls_at_submit = dict(job.urls)
+        await publisher.drain()
+        executor.shutdown()
+        return job, urls_at_submit, publisher
+
+    return asyncio.run(run())
+
+
+def test_uploads_and_rows_are_written_in_the_background_with_retries(tmp_path):
+    storage = LocalStorage(str(tmp_path), base_url="http://files")
+    table = FlakyTable()
+    published = []
+
+    job, urls_at_submit, publisher = publish(
+        storage, table,
+        artifacts=[Artifact("reports", "r.pdf", b"%PDF", "application/pdf", "report_pdf_url"),
+                   Artifact("gradcam", "g.png", b"PNG", "image/png", "gradcam_url")],
+        analysis_row={"tumor_type": "Glioma"},
+        report_row={"patient_id": "p1"},
+        on_published=published.append,
+    )
+
+    # URLs were final before anything was uploaded
+    assert urls_at_submit == {"report_pdf_url": "http://files/reports/r.pdf", "gradcam_url": "http://files/gradcam/g.png"}
+    assert job.status == "published" and published == [job]
+    assert publisher.get(job.job_id) is job
+    assert (tmp_path / "reports" / "r.pdf").read_bytes() == b"%PDF"
+    # Retried after the timeout, yet one row per table
+    analysis, = table.rows["analysis_results"]
+    report, = table.rows["reports"]
+    assert job.analysis_id == analysis["id"]
+    assert report == {"patient_id": "p1", "analysis_id": analysis["id"], "id": report["id"], **urls_at_submit}
+
+
+def test_unlinked_urls_stay_out_of_the_report_row(tmp_path):
+    table = FlakyTable()
+    awaited = []
+
+    async def on_published(job):
+        await asyncio.sleep(0)
+        awaited.append(job.job_id)
+
+    job, _, _ = publish(
+        LocalStorage(str(tmp_path), base_url="http://files"), table,
+        artifacts=[Artifact("gradcam", "g.png", b"PNG", "image/png", "gradcam_url"),
+                   Artifact("gradcam", "h.nii.gz", b"NII", "application/gzip", "heatmap_url", in_report=False)],
+        analysis_row={}, report_row={"patient_id": "p1"}, on_published=on_published,
+    )
+    assert awaited == [job.job_id]  # coroutine callbacks are awaited
+    assert job.urls["heatmap_url"] == "http://files/gradcam/h.nii.gz"
+    assert (tmp_path / "gradcam" / "h.nii.gz").read_bytes() == b"NII"
+    assert "heatmap_url" not in table.rows["reports"][0]
+
+
+def test_failed_upload_is_reported_as_partial_and_failed_rows_fail_the_job(tmp_path):
+    class BrokenStorage(LocalStorage):
+        def upload(self, bucket, name, data, content_type):
+            if bucket == "gradcam":
+                raise OSError("bucket unavailable")
+            return super().upload(bucket, name, data, content_type)
+
+    rows = []
+    job, _, _ = publish(
+        BrokenStorage(str(tmp_path)), lambda table, row: rows.append(row) or 7,
+        artifacts=[Artifact("reports", "r.pdf", b"%PDF", "application/pdf", "report_pdf_url"),
+                   Artifact("gradcam", "g.png", b"PNG", "image/png", "gradcam_url")],
+        analysis_row={}, report_row={"patient_id": "p1"},
+    )
+    assert job.status == "partial" and "gradcam/g.png" in job.error
+    assert job.urls["gradcam_url"] is None and rows[-1]["gradcam_url"] is None
+
+    def down(table, row):
+        raise ConnectionError("database down")
+
+    job, _, _ = publish(LocalStorage(str(tmp_path)), down, analysis_row={}, report_row={"patient_id": "p1"})
+    assert job.status == "failed" and "database down" in job.error
@@ -0,0 +1,44 @@
+# tests/test_result_cache.py
+import io
+import os
+import time
+
+from modules.result_cache import ResultCache, hash_source, make_cache_key
+
+
+def test_key_depends_on_content_model_and_params():
+    sha = hash_source(b"scan bytes")
+    assert sha == hash_source(io.BytesIO(b"scan bytes"))
+
+    key = make_cache_key(sha, "abc:fp32:eager", {"version": 1})
+    assert key == make_cache_key(sha, "abc:fp32:eager", {"version": 1})
+    assert key != make_cache_key(sha, "abc:int8_static:eager", {"version": 1})
+    assert key != make_cache_key(sha, "abc:fp32:eager", {"version": 2})
+
+
+def test_memory_tier_is_lru():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    cache.get("a")
+    cache.put("c", {"v": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.get("c") == {"v": 3}
+
+
+def test_disk_tier_survives_restart_and_evicts_by_size(tmp_path):
+    cache = ResultCache(max_entries=1, disk_dir=str(tmp_path), max_disk_bytes=10_000)
+    cache.put("a", {"payload": "x" * 4000})
+    assert ResultCache(disk_dir=str(tmp_path)).get("a") == {"payload": "x" * 4000}
+
+    old = time.time() - 60
+    os.utime(tmp_path / "a.json", (old, old))
+    cache.put("b", {"payload": "y" * 4000})
+    cache.put("c", {"payload": "z" * 4000})
+
+    # Oldest entry went first; the tier stays under its byte budget
+    assert not (tmp_path / "a.json").exists()
+    assert (tmp_path / "c.json").exists()
+    assert sum(p.stat().st_size for p in tmp_path.glob("*.json")) <= 10_000
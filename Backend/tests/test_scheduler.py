@@ -0,0 +1,77 @@
+# tests/test_scheduler.py
+import asyncio
+
+import numpy as np
+import torch
+
+from modules.inference import load_model, predict_scan
+from modules.scheduler import InferenceScheduler
+from modules.visualization import generate_gradcam, generate_gradcams, gradcam_from_activations, gradcams_from_activations
+
+
+def test_concurrent_scans_share_batches_and_match_predict_scan():
+    torch.manual_seed(0)
+    model = load_model()
+    scans = [torch.randn(n, 3, 224, 224) for n in (3, 5, 2)]
+    expected = [predict_scan(model, s) for s in scans]
+
+    async def run():
+        scheduler = InferenceScheduler(model, max_batch_size=4, max_wait_ms=50)
+        scheduler.start()
+        results = await asyncio.gather(*(scheduler.predict(s) for s in scans))
+        metrics = scheduler.metrics()
+        await scheduler.stop()
+        return results, metrics
+
+    results, metrics = asyncio.run(run())
+
+    for (label, conf), (exp_label, exp_conf) in zip(results, expected):
+        assert label == exp_label
+        assert abs(conf - exp_conf) < 1e-4
+
+    # 10 slices in batches of at most 4 → 3 forward passes
+    assert metrics["slices_run"] == 10
+    assert metrics["batches_run"] == 3
+    assert metrics["scans_completed"] == 3
+    assert metrics["queue_depth"] == 0
+
+
+def test_explain_index_returns_captured_activations():
+    torch.manual_seed(0)
+    model = load_model()
+    scans = [torch.randn(3, 3, 224, 224), torch.randn(4, 3, 224, 224)]
+
+    async def run():
+        scheduler = InferenceScheduler(model, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(scheduler.predict(scans[0]), scheduler.predict(scans[1], explain_index=2))
+        await scheduler.stop()
+        return results
+
+    plain, explained = asyncio.run(run())
+    assert len(plain) == 2
+    label, conf, activations = explained
+    exp_label, exp_conf = predict_scan(model, scans[1])
+    assert label == exp_label and abs(conf - exp_conf) < 1e-4
+
+    cam = gradcam_from_activations(model, activations)
+    assert np.allclose(cam, generate_gradcam(model, scans[1][2:3]), atol=1e-4)
+
+
+def test_predict_volume_captures_every_slice_across_batches():
+    torch.manual_seed(0)
+    model = load_model()
+    scans = [torch.randn(3, 3, 224, 224), torch.randn(6, 3, 224, 224)]
+
+    async def run():
+        scheduler = InferenceScheduler(model, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(scheduler.predict(scans[0], explain_index=1), scheduler.predict_volume(scans[1]))
+        await scheduler.stop()
+        return results
+
+    (_, _, single), (label, conf, activations) = asyncio.run(run())
+    exp_label, exp_conf = predict_scan(model, scans[1])
+    assert label == exp_label and abs(conf - exp_conf) < 1e-4
+    assert single.shape[0] == 1 and activations.shape[0] == 6
+
+    cams = gradcams_from_activations(model, activations)
+    assert np.allclose(cams, generate_gradcams(model, scans[1]), atol=1e-4)
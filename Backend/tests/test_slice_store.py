@@ -0,0 +1,83 @@
+# tests/test_slice_store.py
+import nibabel as nib
+import numpy as np
+import torch
+
+from modules.inference import load_model, predict_scan
+from modules.pipeline import prepare_scan
+from modules.preprocessing import preprocess_volume_batch, preprocess_volume_uint8, uint8_input_to_tensor
+from modules.result_cache import hash_source
+from modules.slice_store import SliceStore
+
+
+def write_scan(path, depth=14, seed=0):
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(200, 50, (64, 56, depth)).astype(np.float32)
+    volume[:8] = 0  # background for the foreground crop
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), str(path))
+    return volume
+
+
+def test_uint8_slices_expand_to_the_float_batch_bit_for_bit():
+    volume = np.random.default_rng(1).normal(200, 50, (64, 56, 10)).astype(np.float32)
+    volume[:8] = 0
+    expected, expected_bbox = preprocess_volume_batch(volume, crop=True, return_bbox=True)
+    stack, bbox = preprocess_volume_uint8(volume, crop=True)
+
+    assert stack.dtype == np.uint8 and stack.shape == (len(expected), 224, 224)
+    assert bbox == expected_bbox
+    assert torch.equal(uint8_input_to_tensor(stack), expected)
+
+
+def test_second_prepare_reads_the_store_and_predicts_the_same(tmp_path):
+    path = tmp_path / "scan.nii"
+    write_scan(path)
+    store = SliceStore(str(tmp_path / "slices"))
+
+    first = prepare_scan(str(path), slice_store=store, keep_overlay_slices=True)
+    assert [span.name for span in first.spans] == ["slice_store", "load", "preprocess"]
+
+    second = prepare_scan(str(path), slice_store=store, keep_overlay_slices=True)
+    assert [span.name for span in second.spans] == ["slice_store"]
+    assert torch.equal(second.slices, first.slices)
+    assert np.array_equal(second.indices, first.indices) and second.bbox == first.bbox
+    assert second.explain_position == first.explain_position
+    assert np.array_equal(second.overlay_slices, first.overlay_slices)
+
+    # predict_scan reads the memory-mapped uint8 slices directly
+    torch.manual_seed(0)
+    model = load_model()
+    stored = prepare_scan(str(path), slice_store=store, uint8=True)
+    assert isinstance(stored.slices, np.memmap)
+    label, confidence = predict_scan(model, stored.slices, batch_size=4)
+    expected_label, expected_confidence = predict_scan(model, first.slices, batch_size=4)
+    assert label == expected_label and abs(confidence - expected_confidence) < 1e-5
+
+
+def test_stale_entries_miss_and_are_rebuilt(tmp_path):
+    path = tmp_path / "scan.nii"
+    write_scan(path)
+    store = SliceStore(str(tmp_path / "slices"))
+    sha = hash_source(str(path))
+
+    prepare_scan(str(path), slice_store=store, crop=False)
+    assert store.get(sha, {"version": "old"}) is None
+    assert store.get("../" + sha, {}) is None
+
+    # Other preprocessing parameters: rebuilt and replaced
+    rebuilt = prepare_scan(str(path), slice_store=store, crop=True)
+    assert [span.name for span in rebuilt.spans] == ["slice_store", "load", "preprocess"]
+    assert rebuilt.bbox is not None
+    assert store.stats()["entries"] == 1
+    assert [span.name for span in prepare_scan(str(path), slice_store=store, crop=True).spans] == ["slice_store"]
+
+
+def test_store_evicts_least_recently_used_entries(tmp_path):
+    store = SliceStore(str(tmp_path), max_bytes=3 * 224 * 224 + 1024)
+    slices = np.zeros((2, 224, 224), dtype=np.uint8)
+    explain = np.zeros((8, 8), dtype=np.uint8)
+    store.put("a" * 64, {}, slices, {}, explain)
+    store.put("b" * 64, {}, slices, {}, explain)
+
+    assert store.get("a" * 64, {}) is None
+    assert store.get("b" * 64, {}) is not None
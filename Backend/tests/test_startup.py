@@ -0,0 +1,33 @@
+# tests/test_startup.py
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: this test process has long imported torch
+CHECK = """
+import sys
+import app
+from fastapi.testclient import TestClient
+
+heavy = [m for m in ("torch", "torchvision", "cv2", "nibabel", "reportlab", "supabase") if m in sys.modules]
+client = TestClient(app.app)  # no lifespan: nothing is loading
+health = client.get("/health", headers={"Origin": "http://localhost:5173"})
+# Resumable upload clients read Upload-Offset from cross-origin 409 responses
+assert "upload-offset" in health.headers["access-control-expose-headers"].lower()
+print(heavy, app.STORAGE_KIND, app.DB_KIND, health.json()["runtime_loaded"])
+"""
+
+
+def test_app_imports_without_heavy_dependencies_or_supabase(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k not in ("SUPABASE_URL", "SUPABASE_KEY", "STORAGE_BACKEND")}
+    for name in ("JOBS_DIR", "RESULT_CACHE_DIR", "SLICE_STORE_DIR", "MESH_CACHE_DIR", "UPLOADS_DIR",
+                 "LOCAL_STORAGE_DIR"):
+        env[name] = str(tmp_path / name.lower())
+    env.update(LOCAL_DB_PATH=str(tmp_path / "db.sqlite3"), STARTUP_MODE="lazy", SUPABASE_URL="", SUPABASE_KEY="")
+
+    result = subprocess.run([sys.executable, "-c", CHECK], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[] local sqlite False"
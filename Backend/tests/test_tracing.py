@@ -0,0 +1,85 @@
+# tests/test_tracing.py
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import torch
+
+from modules.inference import load_model
+from modules.scheduler import InferenceScheduler
+from modules.tracing import StageMetrics, Trace, measure, run_traced
+
+
+def busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+    return "done"
+
+
+def test_fan_out_stages_count_cpu_of_helper_threads():
+    def fan_out():
+        helper = threading.Thread(target=busy, args=(0.05,))
+        helper.start()
+        helper.join()
+
+    with measure("preprocess") as process_span:
+        fan_out()
+    with measure("report") as thread_span:
+        fan_out()
+    assert process_span.cpu_s >= 0.05 and process_span.as_dict()["cpu_scope"] == "process"
+    assert thread_span.cpu_s < 0.02 and thread_span.as_dict()["cpu_scope"] == "thread"
+
+
+def test_spans_record_wall_cpu_and_memory():
+    with measure("sleep") as idle:
+        time.sleep(0.05)
+    assert idle.wall_s >= 0.05 and idle.cpu_s < 0.02
+
+    result, span = run_traced("spin", busy, 0.03)
+    assert result == "done"
+    assert span.cpu_s >= 0.03 and span.peak_rss_bytes > 0
+
+
+def test_trace_logs_json_and_feeds_prometheus_metrics(caplog):
+    trace = Trace(filename="scan.nii")
+    with trace.stage("preprocess", slices=12, tensor_bytes=1024):
+        pass
+    with trace.stage("inference", cpu=False, slices=12) as span:
+        span.cpu_s = 0.5
+
+    with caplog.at_level(logging.INFO, logger="brainalyze.trace"):
+        trace.log()
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["filename"] == "scan.nii"
+    assert [s["stage"] for s in record["stages"]] == ["preprocess", "inference"]
+    assert record["stages"][1]["cpu_ms"] == 500.0
+
+    metrics = StageMetrics()
+    metrics.observe_trace(trace)
+    text = metrics.render({"queue_depth": ("Scans waiting.", 3)})
+    assert 'brainalyze_stage_duration_seconds_count{stage="total"} 1' in text
+    assert 'brainalyze_stage_duration_seconds_bucket{stage="preprocess",le="+Inf"} 1' in text
+    assert 'brainalyze_stage_slices_total{stage="inference"} 12' in text
+    assert 'brainalyze_stage_cpu_seconds_total{stage="inference"} 0.5' in text
+    assert "brainalyze_queue_depth 3" in text
+
+
+def test_scheduler_reports_each_scans_share_of_cpu():
+    torch.manual_seed(0)
+    model = load_model()
+
+    async def run():
+        scheduler = InferenceScheduler(model, max_batch_size=4, max_wait_ms=50)
+        stats = [{}, {}]
+        await asyncio.gather(scheduler.predict(torch.randn(3, 3, 224, 224), stats=stats[0]),
+                             scheduler.predict(torch.randn(3, 3, 224, 224), stats=stats[1]))
+        await scheduler.stop()
+        return stats
+
+    first, second = asyncio.run(run())
+    # 6 slices in batches of 4: the first scan fits in batch 1, the second spans both
+    assert first["batches"] == 1 and second["batches"] == 2
+    assert first["cpu_s"] > 0 and second["cpu_s"] > 0
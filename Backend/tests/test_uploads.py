@@ -0,0 +1,110 @@
+# tests/test_uploads.py
+import gzip
+import hashlib
+import io
+import os
+import zipfile
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from modules.input_loader import load_mri
+from modules.uploads import UploadOffsetError, UploadStore, check_dicom_zip
+
+
+def nifti_bytes(compress=True):
+    volume = np.random.default_rng(0).normal(100, 20, (32, 28, 12)).astype(np.float32)
+    data = nib.Nifti1Image(volume, np.eye(4)).to_bytes()
+    return volume, gzip.compress(data) if compress else data
+
+
+def send(store, upload_id, data, chunk_size, start=0, stop=None):
+    """PUT data[start:stop] in chunks, as a client would."""
+    stop = len(data) if stop is None else stop
+    for offset in range(start, stop, chunk_size):
+        session = store.append(upload_id, offset, data[offset:min(offset + chunk_size, stop)])
+    return session
+
+
+def test_chunked_gzip_upload_is_hashed_and_decompressed_as_it_arrives(tmp_path):
+    volume, data = nifti_bytes()
+    store = UploadStore(str(tmp_path))
+    session = store.create("scan.nii.gz", size=len(data))
+
+    first = store.append(session.upload_id, 0, data[:1000])
+    assert first.kind == "nifti_gz" and first.validated  # header checked on the first chunk
+    send(store, session.upload_id, data, 4096, start=1000)
+
+    path = session.finish()
+    assert path.endswith(".nii") and session.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert np.array_equal(load_mri(path), volume)
+
+
+def test_bad_header_is_rejected_on_the_first_chunk(tmp_path):
+    store = UploadStore(str(tmp_path))
+    session = store.create("scan.nii", size=10_000)
+    with pytest.raises(ValueError):
+        store.append(session.upload_id, 0, b"\x00" * 400)
+    assert store.get(session.upload_id) is None
+    assert not os.listdir(tmp_path)
+
+    with pytest.raises(ValueError):
+        store.create("notes.txt")
+
+
+def test_upload_resumes_at_the_stored_offset_after_a_restart(tmp_path):
+    volume, data = nifti_bytes(compress=False)
+    store = UploadStore(str(tmp_path))
+    session = store.create("scan.nii")
+    send(store, session.upload_id, data, 2048, stop=5000)
+
+    with pytest.raises(UploadOffsetError) as error:
+        store.append(session.upload_id, 8000, data[8000:9000])
+    assert error.value.offset == 5000
+
+    # A new process rebuilds the session (offset, hash) from disk
+    restarted = UploadStore(str(tmp_path))
+    resumed = restarted.get(session.upload_id)
+    assert resumed.received == 5000 and resumed.validated
+    send(restarted, session.upload_id, data, 2048, start=5000)
+
+    path = resumed.finish()
+    assert resumed.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert np.array_equal(load_mri(path), volume)
+
+
+def test_stale_chunk_reports_the_server_offset_and_changes_nothing(tmp_path):
+    volume, data = nifti_bytes(compress=False)
+    store = UploadStore(str(tmp_path))
+    session = store.create("scan.nii")
+    send(store, session.upload_id, data, 2048, stop=6144)
+    digest = session.sha256.copy().hexdigest()
+
+    # A client that lost the response re-sends its first chunk
+    for offset in (0, 2048, 6144 + 1):
+        with pytest.raises(UploadOffsetError) as error:
+            store.append(session.upload_id, offset, data[offset:offset + 2048])
+        assert error.value.offset == 6144
+    assert session.received == 6144 and session.sha256.hexdigest() == digest
+
+    # Resyncing to the reported offset finishes the upload intact
+    send(store, session.upload_id, data, 2048, start=error.value.offset)
+    assert np.array_equal(load_mri(session.finish()), volume)
+
+
+def test_zip_header_check_skips_folders_and_needs_a_dicom_member():
+    def archive(members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+            for name, data in members:
+                z.writestr(name, data)
+        return buffer.getvalue()
+
+    dicom = b"\x00" * 128 + b"DICM" + os.urandom(4096)
+    data = archive([("series/", b""), ("series/readme.txt", b"hello"), ("series/IM0001", dicom)])
+    assert check_dicom_zip(data[:20]) is None  # not enough bytes yet
+    assert check_dicom_zip(data[:400]) is True
+
+    with pytest.raises(ValueError):
+        check_dicom_zip(archive([("a.txt", b"x" * 300), ("b.txt", b"y" * 300)]))
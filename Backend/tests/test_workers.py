@@ -0,0 +1,65 @@
+# tests/test_workers.py
+import asyncio
+import os
+import threading
+
+import pytest
+
+from modules.workers import PipelineBusyError, StagedExecutor
+
+
+def test_admit_rejects_requests_beyond_max_pending():
+    executor = StagedExecutor(cpu_workers=1, io_workers=1, max_pending=2)
+
+    async def scenario():
+        async with executor.admit():
+            async with executor.admit():
+                assert executor.pending == 2
+                with pytest.raises(PipelineBusyError):
+                    async with executor.admit():
+                        pass
+        # Slots are released, also when the request fails
+        with pytest.raises(ValueError):
+            async with executor.admit():
+                raise ValueError("bad scan")
+        assert executor.pending == 0
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+
+
+def test_thread_pool_runs_every_stage_in_process():
+    executor = StagedExecutor(cpu_workers=2, io_workers=2, pool_kind="thread")
+
+    async def scenario():
+        names = [await executor.run_cpu(lambda: threading.current_thread().name),
+                 await executor.run_thread(lambda: threading.current_thread().name),
+                 await executor.run_io(lambda: threading.current_thread().name)]
+        return names, await executor.run_cpu(os.getpid)
+
+    try:
+        names, pid = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert [name.rsplit("_", 1)[0] for name in names] == ["pipeline-cpu", "pipeline-model", "pipeline-io"]
+    assert pid == os.getpid()
+
+
+def test_process_pool_runs_cpu_stages_in_workers_and_shuts_down():
+    executor = StagedExecutor(cpu_workers=1, io_workers=1, pool_kind="process")
+
+    async def scenario():
+        return await executor.run_cpu(os.getpid), await executor.run_thread(os.getpid)
+
+    cpu_pid, thread_pid = asyncio.run(scenario())
+    executor.shutdown()
+    assert cpu_pid != os.getpid() and thread_pid == os.getpid()
+    with pytest.raises(RuntimeError):
+        asyncio.run(executor.run_cpu(os.getpid))
+
+
+def test_unknown_pool_kind_is_rejected():
+    with pytest.raises(ValueError):
+        StagedExecutor(pool_kind="fork")
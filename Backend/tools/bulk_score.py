@@ -0,0 +1,289 @@
+# tools/bulk_score.py
+"""
+Score a whole archive of studies offline.
+
+Scans are loaded and preprocessed in worker processes (bounded prefetch),
+their slices are packed into full batches across study boundaries, and one
+row per study is appended to a CSV journal as soon as it is scored, so an
+interrupted run resumes where it stopped.
+
+Usage (from Backend/):
+    python -m tools.bulk_score /data/archive --output scores.csv
+    python -m tools.bulk_score manifest.txt --output scores.parquet --workers 8 --batch-size 64
+    python -m tools.bulk_score /data/archive --output scores_v2.csv --slice-store /data/slices
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import torch
+import torch.nn.functional as F
+
+from modules.backends import BACKENDS, SCAN_EXTENSIONS, prepare_backend
+from modules.inference import ScanAccumulator, load_model
+from modules.pipeline import prepare_scan
+from modules.preprocessing import as_model_input, configure_preprocessing
+from modules.slice_store import SliceStore
+from utils.config import CROP_TO_FOREGROUND
+
+COLUMNS = ["path", "label", "confidence", "slices", "model_version", "error", "scored_at"]
+
+
+# === Inputs ===
+def walk_scans(root: str):
+    """NIfTI files, zipped series and DICOM folders anywhere under root, sorted."""
+    scans = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        if any(name.lower().endswith(".dcm") for name in files):
+            scans.append(folder)  # one DICOM series; don't descend further
+            dirs[:] = []
+            continue
+        scans.extend(os.path.join(folder, name) for name in sorted(files) if name.endswith(SCAN_EXTENSIONS))
+    return scans
+
+
+def read_manifest(path: str):
+    """Paths from a text file (one per line) or a CSV with a 'path' column; relative to the manifest."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            entries = [row["path"] for row in csv.DictReader(f)]
+        else:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [entry if os.path.isabs(entry) else os.path.join(base, entry) for entry in entries]
+
+
+def collect_inputs(source: str):
+    return walk_scans(source) if os.path.isdir(source) else read_manifest(source)
+
+
+# === Loading (worker processes) ===
+def _init_worker():
+    # Each worker decodes one study at a time; keep OpenCV/torch from oversubscribing cores
+    configure_preprocessing(cv2_threads=1, torch_threads=1)
+
+
+def prefetch_scans(paths, workers=4, prefetch=8, pool_kind="process", slice_store=None):
+    """
+    Yield (path, PreparedScan or None, error) in input order while at most
+    `prefetch` studies are being loaded or waiting to be consumed.
+
+    Workers hand back uint8 slices, a twelfth of the float tensor's size
+    to pickle; score_scans expands them per batch. With a SliceStore,
+    studies preprocessed before are read back from it (no decoding or
+    CLAHE) and new ones are added.
+    """
+    if pool_kind == "process":
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   mp_context=multiprocessing.get_context("spawn"))
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-load")
+
+    paths = iter(paths)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < prefetch:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pending.append((path, pool.submit(prepare_scan, path, crop=CROP_TO_FOREGROUND,
+                                                  slice_store=slice_store, uint8=True)))
+            if not pending:
+                return
+            path, future = pending.popleft()
+            try:
+                yield path, future.result(), None
+            except Exception as e:
+                yield path, None, f"{type(e).__name__}: {e}"
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+# === Scoring ===
+class _ActiveScan:
+    def __init__(self, path, scan):
+        self.path = path
+        self.slices = scan.slices
+        self.offset = 0
+        self.accumulator = ScanAccumulator()
+
+
+def score_scans(model, scans, batch_size=32, device="cpu"):
+    """
+    Score a stream of (path, PreparedScan, error) with full batches.
+
+    Slices from consecutive studies share forward passes; only the final
+    batch of the run can be partial. Yields (path, label, confidence,
+    num_slices, error) as each study completes.
+    """
+    model.eval()
+    active = deque()
+    scans = iter(scans)
+    exhausted = False
+
+    with torch.no_grad():
+        while True:
+            # Step 1: Pull studies until a full batch of slices is waiting
+            while not exhausted and sum(len(s.slices) - s.offset for s in active) < batch_size:
+                item = next(scans, None)
+                if item is None:
+                    exhausted = True
+                    break
+                path, scan, error = item
+                if error is not None or scan is None or len(scan) == 0:
+                    yield path, None, None, 0, error or "No slices selected"
+                else:
+                    active.append(_ActiveScan(path, scan))
+            if not active:
+                return
+
+            # Step 2: Pack one batch across study boundaries
+            parts, owners = [], []
+            room = batch_size
+            for scan in active:
+                if room == 0:
+                    break
+                take = min(room, len(scan.slices) - scan.offset)
+                parts.append(as_model_input(scan.slices[scan.offset:scan.offset + take]))
+                owners.append((scan, take))
+                scan.offset += take
+                room -= take
+
+            # Step 3: One forward pass, split the probabilities back per study
+            probs = F.softmax(model(torch.cat(parts).to(device)), dim=1)
+            start = 0
+            for scan, take in owners:
+                scan.accumulator.update(probs[start:start + take])
+                start += take
+
+            while active and active[0].offset == len(active[0].slices):
+                scan = active.popleft()
+                label, confidence = scan.accumulator.result()
+                yield scan.path, label, confidence, len(scan.slices), None
+
+
+# === Output ===
+def journal_path(output: str) -> str:
+    """Rows are always journaled as CSV; Parquet is written from the journal at the end."""
+    return output if output.endswith(".csv") else output + ".csv"
+
+
+def load_scored(journal: str, model_version: str):
+    """Paths already scored successfully by this model version."""
+    if not os.path.exists(journal):
+        return set()
+    with open(journal, newline="") as f:
+        return {row["path"] for row in csv.DictReader(f)
+                if row["model_version"] == model_version and not row["error"]}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow), or use a .csv output.")
+
+
+def write_parquet(journal: str, output: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Last row per path wins (a retried failure replaces its error row)
+    with open(journal, newline="") as f:
+        rows = {row["path"]: row for row in csv.DictReader(f)}
+    table = {column: [row[column] for row in rows.values()] for column in COLUMNS}
+    table["confidence"] = [float(v) if v else None for v in table["confidence"]]
+    table["slices"] = [int(v) for v in table["slices"]]
+    pq.write_table(pa.table(table), output)
+
+
+def bulk_score(paths, output, model, model_version, batch_size=32, workers=4, prefetch=8, pool_kind="process",
+               device="cpu", resume=True, slice_store=None):
+    """Score paths into output; returns (scored, failed, skipped) counts."""
+    journal = journal_path(output)
+    if output != journal:
+        _require_pyarrow()
+    done = load_scored(journal, model_version) if resume else set()
+    todo = [path for path in paths if path not in done]
+    if not resume and os.path.exists(journal):
+        os.remove(journal)
+
+    scored = failed = 0
+    new_file = not os.path.exists(journal)
+    with open(journal, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+
+        started = time.perf_counter()
+        scans = prefetch_scans(todo, workers=workers, prefetch=prefetch, pool_kind=pool_kind,
+                               slice_store=slice_store)
+        for path, label, confidence, slices, error in score_scans(model, scans, batch_size, device):
+            writer.writerow({
+                "path": path, "label": label or "", "confidence": f"{confidence:.4f}" if error is None else "",
+                "slices": slices, "model_version": model_version, "error": error or "",
+                "scored_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            })
+            f.flush()  # every finished study survives an interruption
+            if error:
+                failed += 1
+                print(f"⚠️ {path}: {error}")
+            else:
+                scored += 1
+            if (scored + failed) % 50 == 0:
+                rate = (scored + failed) / (time.perf_counter() - started)
+                print(f"📊 {scored + failed}/{len(todo)} studies ({rate:.2f}/s)")
+
+    if output != journal:
+        write_parquet(journal, output)
+    return scored, failed, len(paths) - len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory or manifest of MRI studies.")
+    parser.add_argument("source", help="Folder to walk, or a manifest (.txt with one path per line, or .csv with 'path')")
+    parser.add_argument("--output", default="scores.csv", help=".csv or .parquet (needs pyarrow)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Slices per forward pass")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Loader processes")
+    parser.add_argument("--prefetch", type=int, help="Studies loaded ahead of the model (default: 2 × workers)")
+    parser.add_argument("--pool", choices=("process", "thread"), default="process")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32")
+    parser.add_argument("--calibration-dir", help="Sample scans for int8_static")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads for the model")
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of skipping scored studies")
+    parser.add_argument("--slice-store", help="Folder of preprocessed uint8 slices: read when present, filled otherwise "
+                                              "(re-scoring with a new model then skips decoding and preprocessing)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    paths = collect_inputs(args.source)
+    if not paths:
+        raise SystemExit(f"❌ No scans found in {args.source}")
+
+    device = "cuda" if torch.cuda.is_available() and args.backend in ("fp32", "channels_last") else "cpu"
+    model, info = load_model(device=device, with_info=True)
+    model = prepare_backend(model, args.backend, args.calibration_dir, device=device)
+    model_version = f"{info.version}:{args.backend}"
+    print(f"🧠 Scoring {len(paths)} studies with {model_version} on {device}")
+
+    scored, failed, skipped = bulk_score(
+        paths, args.output, model, model_version,
+        batch_size=args.batch_size, workers=args.workers, prefetch=args.prefetch or 2 * args.workers,
+        pool_kind=args.pool, device=device, resume=not args.no_resume,
+        slice_store=SliceStore(args.slice_store) if args.slice_store else None,
+    )
+    print(f"✅ {scored} scored, {failed} failed, {skipped} already done → {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# tools/compare_backends.py
+"""
+Compare inference backends against the fp32 eager baseline.
+
+Usage (from Backend/):
+    python -m tools.compare_backends data/samples --calibration-dir data/calibration
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from modules.backends import BACKENDS, find_scans, prepare_backend, quantize_static_int8
+from modules.inference import load_model, predict_scan
+from modules.pipeline import prepare_scan
+from utils.config import CROP_TO_FOREGROUND
+
+
+def compare_backends(scan_paths, backends, calibration_dir=None, device="cpu"):
+    """
+    Run predict_scan for every scan with every backend.
+
+    Returns a dict per backend with label agreement vs fp32, confidence
+    deltas (percentage points) and throughput (slices per second).
+    """
+    base_model = load_model(device=device)
+    scans = [(path, prepare_scan(path, crop=CROP_TO_FOREGROUND)) for path in scan_paths]
+
+    models = {}
+    for backend in backends:
+        if backend == "int8_static" and not calibration_dir:
+            # Calibrate on the scans being compared when no folder is given
+            models[backend] = quantize_static_int8(base_model, scan_batches(scans))
+        else:
+            models[backend] = prepare_backend(base_model, backend, calibration_dir, device=device)
+
+    baseline = {path: predict_scan(base_model, scan.slices, device=device) for path, scan in scans}
+
+    report = {}
+    for backend, model in models.items():
+        agree, deltas, slices, elapsed = 0, [], 0, 0.0
+        per_scan = []
+        for path, scan in scans:
+            start = time.perf_counter()
+            label, confidence = predict_scan(model, scan.slices, device=device)
+            elapsed += time.perf_counter() - start
+            slices += len(scan)
+
+            base_label, base_conf = baseline[path]
+            agree += int(label == base_label)
+            deltas.append(abs(confidence - base_conf))
+            per_scan.append({"scan": path, "label": label, "confidence": confidence,
+                             "fp32_label": base_label, "fp32_confidence": base_conf})
+
+        report[backend] = {
+            "label_agreement": agree / len(scans),
+            "mean_confidence_delta": sum(deltas) / len(deltas),
+            "max_confidence_delta": max(deltas),
+            "slices_per_second": slices / elapsed if elapsed else 0.0,
+            "scans": per_scan,
+        }
+    return report
+
+
+def scan_batches(scans, batch_size=16):
+    """Yield (B, 3, 224, 224) batches from already prepared scans."""
+    for _, scan in scans:
+        for start in range(0, len(scan), batch_size):
+            yield scan.slices[start:start + batch_size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference backends with the fp32 baseline.")
+    parser.add_argument("scan_dir", help="Folder with .nii/.nii.gz/.zip scans or DICOM folders")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--calibration-dir", help="Sample scans for int8_static (default: the scans themselves)")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    scan_paths = find_scans(args.scan_dir)
+    if not scan_paths:
+        raise SystemExit(f"❌ No scans found in {args.scan_dir}")
+
+    report = compare_backends(scan_paths, args.backends, calibration_dir=args.calibration_dir)
+
+    print(f"\n{'backend':<15}{'agreement':>10}{'mean Δconf':>12}{'max Δconf':>11}{'slices/s':>10}")
+    for backend, stats in report.items():
+        print(f"{backend:<15}{stats['label_agreement']:>10.1%}{stats['mean_confidence_delta']:>12.2f}"
+              f"{stats['max_confidence_delta']:>11.2f}{stats['slices_per_second']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# tools/evaluate_adaptive.py
+"""
+Measure what adaptive slice selection saves and what it costs.
+
+Every scan is scored exhaustively (predict_scan) and adaptively for each
+(stride, min_confidence) setting; the table shows the forward passes saved,
+how often the label disagrees with the exhaustive result and how far the
+confidence moves.
+
+Usage (from Backend/):
+    python -m tools.evaluate_adaptive /data/validation
+    python -m tools.evaluate_adaptive manifest.txt --strides 2 4 8 --confidences 80 90 95 --json sweep.json
+"""
+import argparse
+import json
+
+import numpy as np
+import torch
+
+from modules.adaptive import adaptive_predict
+from modules.inference import load_model, predict_scan
+from modules.pipeline import prepare_scan
+from tools.bulk_score import collect_inputs
+from utils.config import CROP_TO_FOREGROUND
+
+
+def evaluate(scans, model, strides=(4,), confidences=(90.0,), min_slices=6, batch_size=16, device="cpu"):
+    """
+    scans: iterable of (path, processed slices). Returns one summary dict per
+    (stride, min_confidence) plus the per-scan rows behind it.
+    """
+    exhaustive = []
+    rows = {(s, c): [] for s in strides for c in confidences}
+
+    for path, slices in scans:
+        label, confidence = predict_scan(model, slices, device=device, batch_size=batch_size)
+        exhaustive.append((path, label, confidence, len(slices)))
+        for stride in strides:
+            for min_confidence in confidences:
+                result = adaptive_predict(model, slices, device=device, stride=stride, min_confidence=min_confidence,
+                                          min_slices=min_slices, batch_size=batch_size)
+                rows[(stride, min_confidence)].append({
+                    "path": path,
+                    "exhaustive_label": label,
+                    "exhaustive_confidence": confidence,
+                    **result.as_dict(),
+                })
+
+    summaries = []
+    for (stride, min_confidence), scan_rows in rows.items():
+        if not scan_rows:
+            continue
+        total = sum(row["num_slices"] for row in scan_rows)
+        passes = sum(row["forward_passes"] for row in scan_rows)
+        deltas = [abs(row["confidence"] - row["exhaustive_confidence"]) for row in scan_rows]
+        summaries.append({
+            "stride": stride,
+            "min_confidence": min_confidence,
+            "scans": len(scan_rows),
+            "forward_passes": passes,
+            "exhaustive_passes": total,
+            "savings": 1.0 - passes / total if total else 0.0,
+            "early_exit_rate": float(np.mean([row["exited_early"] for row in scan_rows])),
+            "disagreement_rate": float(np.mean([row["label"] != row["exhaustive_label"] for row in scan_rows])),
+            "mean_confidence_delta": float(np.mean(deltas)),
+            "max_confidence_delta": float(np.max(deltas)),
+            "rows": scan_rows,
+        })
+    return summaries
+
+
+def load_scans(paths):
+    """Yield (path, processed slices), skipping scans that fail to load."""
+    for path in paths:
+        try:
+            scan = prepare_scan(path, crop=CROP_TO_FOREGROUND)
+        except Exception as e:
+            print(f"⚠️ {path}: {type(e).__name__}: {e}")
+            continue
+        if len(scan) == 0:
+            print(f"⚠️ {path}: No slices selected")
+            continue
+        yield path, scan.slices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare adaptive slice selection with exhaustive scoring.")
+    parser.add_argument("source", help="Folder to walk, or a manifest (.txt with one path per line, or .csv with 'path')")
+    parser.add_argument("--strides", type=int, nargs="+", default=[4])
+    parser.add_argument("--confidences", type=float, nargs="+", default=[90.0], help="Early-exit confidence (%%)")
+    parser.add_argument("--min-slices", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--json", help="Write summaries and per-scan rows to this file")
+    args = parser.parse_args()
+
+    paths = collect_inputs(args.source)
+    if not paths:
+        raise SystemExit(f"❌ No scans found in {args.source}")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = load_model(device=device)
+    print(f"🧠 Evaluating {len(paths)} scans on {device}")
+
+    summaries = evaluate(load_scans(paths), model, args.strides, args.confidences, args.min_slices,
+                         args.batch_size, device)
+
+    print(f"\n{'stride':>6}{'min conf':>10}{'scans':>7}{'passes':>9}{'saved':>8}{'early':>8}"
+          f"{'disagree':>10}{'Δconf':>8}{'max Δ':>8}")
+    for s in summaries:
+        print(f"{s['stride']:>6}{s['min_confidence']:>10.1f}{s['scans']:>7}{s['forward_passes']:>9}"
+              f"{s['savings']:>8.1%}{s['early_exit_rate']:>8.1%}{s['disagreement_rate']:>10.1%}"
+              f"{s['mean_confidence_delta']:>8.2f}{s['max_confidence_delta']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
+        print(f"\n✅ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
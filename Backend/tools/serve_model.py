@@ -0,0 +1,67 @@
+# tools/serve_model.py
+"""
+Run a model server that HTTP workers share instead of each loading DenseNet.
+
+Start one (or several, on different sockets) and point the API at them:
+
+    export MODEL_SERVER_AUTHKEY=$(python -c 'import secrets; print(secrets.token_hex(32))')
+    python -m tools.serve_model --address /tmp/brainalyze-model.sock
+    MODEL_SERVER_ADDRESSES=/tmp/brainalyze-model.sock \
+        gunicorn app:app -k uvicorn.workers.UvicornWorker -w 8
+
+The backend, model format and batching settings come from the usual
+environment variables (INFERENCE_BACKEND, MODEL_FORMAT, SCHEDULER_*). The
+socket is owner-only (0600) and every connection must present
+MODEL_SERVER_AUTHKEY, which has no default.
+"""
+import argparse
+import signal
+
+import torch
+
+from modules.backends import load_serving_models
+from modules.model_server import ModelServer, check_authkey
+from utils.config import (
+    INFERENCE_BACKEND,
+    MODEL_FORMAT,
+    MODEL_SERVER_AUTHKEY,
+    MODEL_SERVER_SOCKET,
+    QUANT_CALIBRATION_DIR,
+    SCHEDULER_MAX_BATCH_SIZE,
+    SCHEDULER_MAX_WAIT_MS,
+    TORCH_THREADS,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the DenseNet model to API workers over a unix socket.")
+    parser.add_argument("--address", default=MODEL_SERVER_SOCKET, help="Unix socket path to listen on")
+    parser.add_argument("--threads", type=int, default=TORCH_THREADS or None, help="torch intra-op threads")
+    parser.add_argument("--max-batch-size", type=int, default=SCHEDULER_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=SCHEDULER_MAX_WAIT_MS)
+    args = parser.parse_args()
+    check_authkey(MODEL_SERVER_AUTHKEY)  # before spending seconds on the model
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    model, inference_model, info, model_version = load_serving_models(
+        device, INFERENCE_BACKEND, MODEL_FORMAT, QUANT_CALIBRATION_DIR)
+    print(f"🧠 Model loaded: {info.as_dict()} → {model_version} on {device}")
+
+    server = ModelServer(inference_model, explain_model=model, model_version=model_version, info=info.as_dict(),
+                         device=device, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+
+    # SIGTERM/SIGINT finish the current batch, close the socket and exit
+    def shutdown(signum, frame):
+        print(f"🛑 Received signal {signum}, shutting down")
+        server.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    server.serve(args.address, MODEL_SERVER_AUTHKEY)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# utils/config.py
+import os
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Settings are read from the environment (and the .env file loaded by app.py)
+# so deployments can tune them without code changes.
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+# === Inference ===
+# Slices per DenseNet forward pass (0 = whole scan in one pass)
+INFERENCE_BATCH_SIZE = _env_int("INFERENCE_BATCH_SIZE", 16)
+# Peak activation memory budget per forward pass in MB (0 = no budget)
+INFERENCE_MAX_MEMORY_MB = _env_int("INFERENCE_MAX_MEMORY_MB", 0)
+
+# === Cross-request dynamic batching (modules/scheduler.py) ===
+SCHEDULER_MAX_BATCH_SIZE = _env_int("SCHEDULER_MAX_BATCH_SIZE", 32)
+SCHEDULER_MAX_WAIT_MS = _env_int("SCHEDULER_MAX_WAIT_MS", 10)
+
+# === Staged /analyze pipeline (modules/workers.py) ===
+# "thread" or "process" pool for CPU-bound loading/preprocessing stages.
+# "process" only pays off when decoding is the bottleneck (e.g. big DICOM
+# series): /analyze uploads are pickled to the worker as bytes (/uploads and
+# /jobs pass a path) and the slices come back as uint8
+PIPELINE_POOL = os.getenv("PIPELINE_POOL", "thread")
+PIPELINE_CPU_WORKERS = _env_int("PIPELINE_CPU_WORKERS", os.cpu_count() or 4)
+PIPELINE_IO_WORKERS = _env_int("PIPELINE_IO_WORKERS", 8)
+# Requests allowed in the pipeline at once; more get HTTP 503 (0 = unlimited)
+PIPELINE_MAX_PENDING = _env_int("PIPELINE_MAX_PENDING", 64)
+
+# === DICOM ingestion (modules/dicom_loader.py) ===
+DICOM_DECODE_WORKERS = _env_int("DICOM_DECODE_WORKERS", min(8, os.cpu_count() or 4))
+
+# === Model checkpoint and artifact cache (modules/model_registry.py) ===
+MODEL_CHECKPOINT = os.getenv("MODEL_CHECKPOINT", os.path.join(BACKEND_DIR, "models", "densenet121_monai.pth"))
+# Expected SHA-256 of the checkpoint (required for a non-empty checkpoint;
+# a "<checkpoint>.sha256" sidecar file next to it also works)
+MODEL_SHA256 = os.getenv("MODEL_SHA256", "")
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(BACKEND_DIR, "models", "cache"))
+# "eager" or "torchscript" (inference-only; Grad-CAM always uses the eager model)
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "eager")
+
+# === Inference backend (modules/backends.py) ===
+# "fp32", "channels_last", "int8_dynamic" or "int8_static"
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "fp32")
+# Sample scans used to calibrate int8_static
+QUANT_CALIBRATION_DIR = os.getenv("QUANT_CALIBRATION_DIR", "")
+
+# === Result cache for repeated uploads (modules/result_cache.py) ===
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") not in ("0", "false", "False")
+RESULT_CACHE_ENTRIES = _env_int("RESULT_CACHE_ENTRIES", 256)
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(BACKEND_DIR, "cache", "results"))
+RESULT_CACHE_MAX_MB = _env_int("RESULT_CACHE_MAX_MB", 256)
+
+# === Preprocessed slice store (modules/slice_store.py) ===
+# uint8 model-ready slices per scan, reused when a scan is analyzed or re-scored again
+SLICE_STORE_ENABLED = os.getenv("SLICE_STORE_ENABLED", "1") not in ("0", "false", "False")
+SLICE_STORE_DIR = os.getenv("SLICE_STORE_DIR", os.path.join(BACKEND_DIR, "cache", "slices"))
+SLICE_STORE_MAX_MB = _env_int("SLICE_STORE_MAX_MB", 2048)
+
+# === Artifact publishing (modules/publisher.py, modules/storage.py, modules/database.py) ===
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
+# "supabase", "local" (files under LOCAL_STORAGE_DIR, for tests and offline
+# runs) or "auto" (supabase when SUPABASE_URL and SUPABASE_KEY are set)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto")
+# Where analysis/report rows go: "supabase", "sqlite" (LOCAL_DB_PATH) or
+# "auto" (sqlite with local storage, otherwise supabase)
+DB_BACKEND = os.getenv("DB_BACKEND", "auto")
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", os.path.join(BACKEND_DIR, "db", "brainalyze.sqlite3"))
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", os.path.join(BACKEND_DIR, "storage"))
+# Base URL that serves LOCAL_STORAGE_DIR (default: file:// URLs)
+LOCAL_STORAGE_URL = os.getenv("LOCAL_STORAGE_URL", "")
+STORAGE_MAX_CONNECTIONS = _env_int("STORAGE_MAX_CONNECTIONS", 16)
+# Attempts per upload/DB write, with exponential backoff starting at PUBLISH_RETRY_BACKOFF_MS
+PUBLISH_RETRIES = _env_int("PUBLISH_RETRIES", 3)
+PUBLISH_RETRY_BACKOFF_MS = _env_int("PUBLISH_RETRY_BACKOFF_MS", 500)
+
+# === Job queue for large or batched studies (modules/jobs.py) ===
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(BACKEND_DIR, "jobs"))
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(JOBS_DIR, "jobs.sqlite3"))
+# Scans from the queue processed at once (they share the pipeline pools and scheduler)
+JOB_WORKERS = _env_int("JOB_WORKERS", 2)
+JOB_POLL_MS = _env_int("JOB_POLL_MS", 1000)
+
+# === Resumable chunked uploads (modules/uploads.py) ===
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", os.path.join(BACKEND_DIR, "uploads"))
+# Largest chunk one PUT may carry, and largest upload
+UPLOAD_CHUNK_MAX_MB = _env_int("UPLOAD_CHUNK_MAX_MB", 16)
+UPLOAD_MAX_MB = _env_int("UPLOAD_MAX_MB", 2048)
+# Unfinished uploads idle for longer than this are removed
+UPLOAD_TTL_H = _env_int("UPLOAD_TTL_H", 24)
+
+# === Logging and tracing (modules/tracing.py) ===
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# === Adaptive slice selection (modules/adaptive.py) ===
+# Coarse-to-fine scanning with early exit instead of running every slice
+ADAPTIVE_INFERENCE = os.getenv("ADAPTIVE_INFERENCE", "0") not in ("0", "false", "False")
+ADAPTIVE_STRIDE = _env_int("ADAPTIVE_STRIDE", 4)
+# Stop once the weighted confidence (%) reaches this, after at least ADAPTIVE_MIN_SLICES slices
+ADAPTIVE_MIN_CONFIDENCE = _env_int("ADAPTIVE_MIN_CONFIDENCE", 90)
+ADAPTIVE_MIN_SLICES = _env_int("ADAPTIVE_MIN_SLICES", 6)
+
+# === Grad-CAM (modules/visualization.py) ===
+# Explain every analyzed slice (activations captured in the inference pass,
+# one backward through the head), publish the (H, W, D) heatmap as NIfTI and
+# show the most salient slice in the report. Adaptive scans keep the
+# single middle-slice explanation so they don't run every slice anyway.
+GRADCAM_VOLUME = os.getenv("GRADCAM_VOLUME", "1") not in ("0", "false", "False")
+
+# === Preprocessing (modules/preprocessing.py) ===
+# Crop slices to the brain's bounding box before resizing to the model input
+CROP_TO_FOREGROUND = os.getenv("CROP_TO_FOREGROUND", "0") not in ("0", "false", "False")
+# OpenCV threads per preprocessing worker (the pool itself already uses the cores)
+PREPROCESS_CV2_THREADS = _env_int("PREPROCESS_CV2_THREADS", 1)
+# torch intra-op threads per preprocessing worker (PIPELINE_POOL=process only;
+# thread workers share the model's torch pool)
+PREPROCESS_TORCH_THREADS = _env_int("PREPROCESS_TORCH_THREADS", 1)
+# torch intra-op threads for the model in the server process (0 = torch default)
+TORCH_THREADS = _env_int("TORCH_THREADS", 0)
+
+# === Shared model server (modules/model_server.py, tools/serve_model.py) ===
+# Unix sockets of running model servers, comma-separated. When set, HTTP
+# workers don't load the model and send slices to these servers instead.
+MODEL_SERVER_ADDRESSES = [a.strip() for a in os.getenv("MODEL_SERVER_ADDRESSES", "").split(",") if a.strip()]
+# Default socket for tools/serve_model.py
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "/tmp/brainalyze-model.sock")
+# Shared secret of the model server and its workers (required, 16+ bytes; no default)
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "").encode()
+# How long /analyze waits for the model to finish warming up before answering 503
+MODEL_READY_TIMEOUT_S = _env_int("MODEL_READY_TIMEOUT_S", 30)
+
+# === Startup (app.py) ===
+# "lazy": torch, OpenCV, nibabel, reportlab and the model are loaded after the
+# app is up (by the warm-up or the first request), so /health answers within
+# a second; "eager": loaded while importing app.py, as before
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+# Load the model and push a dummy batch through it in the background right
+# after startup (/ready turns 200 when done); 0 = load on the first request
+MODEL_WARM_UP = os.getenv("MODEL_WARM_UP", "1") not in ("0", "false", "False")
+
+# === 3D tumor meshes (modules/mesh.py) ===
+MESH_CACHE_DIR = os.getenv("MESH_CACHE_DIR", os.path.join(BACKEND_DIR, "cache", "meshes"))
+MESH_CACHE_MAX_MB = _env_int("MESH_CACHE_MAX_MB", 512)
+# Marching cubes runs on a grid this many times coarser than the segmentation
+MESH_DOWNSAMPLE = _env_int("MESH_DOWNSAMPLE", 2)
+# Vertex-clustering cell size (voxels) per level of detail, coarse first; 0 = undecimated
+MESH_LOD_CELLS = [float(c) for c in os.getenv("MESH_LOD_CELLS", "8,4,0").split(",") if c.strip()]
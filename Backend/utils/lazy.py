@@ -0,0 +1,39 @@
+# utils/lazy.py
+import importlib
+import sys
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, then imports
+    it. Lets app.py start without paying for torch, OpenCV, nibabel or
+    reportlab; importlib's per-module locks make a first use from several
+    threads at once safe.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def load(self):
+        return importlib.import_module(self._name)
+
+    @property
+    def loaded(self):
+        return self._name in sys.modules
+
+
+class LazyFunction:
+    """
+    Picklable reference to module.name, imported when called — e.g. as a
+    worker-process initializer the parent process never has to import.
+    """
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(importlib.import_module(self.module), self.name)(*args, **kwargs)
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { supabase } from '../lib/supabaseClient';
+import { uploadAndAnalyze } from '../lib/chunkedUpload';
 import {
   Brain, Upload, User, Calendar, Ruler, Weight, Droplet,
   MapPin, Phone, Mail, LogOut, Menu, X, Loader2 ,CheckCircle2
@@ -106,21 +107,8 @@ const handleFileChange = (e) => {
       return;
     }
 
-    // ✅ Prepare data to send to FastAPI backend
-    const formData = new FormData();
-    formData.append("file", file);
-    formData.append("patient_id", patientData.id); // Send actual UUID from Supabase
-    formData.append("patient_name", profile.full_name);
-
-    // ✅ Call FastAPI backend
-    const response = await fetch("http://127.0.0.1:8000/analyze", {
-      method: "POST",
-      body: formData,
-    });
-
-    if (!response.ok) throw new Error(`Backend error: ${response.statusText}`);
-
-    const result = await response.json();
+    // ✅ Upload in resumable chunks, then analyze (patient_id is the actual UUID from Supabase)
+    const result = await uploadAndAnalyze(file, patientData.id);
     console.log("✅ Analysis result from backend:", result);
 
     // ✅ Save analysis metadata to Supabase
@@ -287,7 +275,7 @@ const handleFileChange = (e) => {
               </div>
               <div>
                 <h2 className="text-2xl font-bold text-gray-800">Upload MRI Scan</h2>
-                <p className="text-sm text-gray-500">Upload .nii, .nii.gz, DICOM, or standard image formats</p>
+                <p className="text-sm text-gray-500">Upload .nii, .nii.gz, DICOM (.zip series), or standard image formats</p>
               </div>
             </div>
 
@@ -308,7 +296,7 @@ const handleFileChange = (e) => {
                 id="file-upload"
                 className="hidden"
                 onChange={handleFileChange}
-                accept=".nii,.nii.gz,.dcm,.jpg,.jpeg,.png"
+                accept=".nii,.nii.gz,.dcm,.zip,.jpg,.jpeg,.png"
               />
               
               {!uploadedFile ? (
@@ -322,7 +310,7 @@ const handleFileChange = (e) => {
                         Drop your MRI scan here or click to browse
                       </p>
                       <p className="text-sm text-gray-500">
-                        Supports: .nii, .nii.gz, DICOM, JPG, PNG (Max 100MB)
+                        Supports: .nii, .nii.gz, DICOM (.zip series), JPG, PNG (Max 100MB)
                       </p>
                     </div>
                     <button className="px-8 py-3 bg-gradient-to-r from-blue-600 via-purple-600 to-pink-600 text-white rounded-xl font-bold hover:shadow-xl transition-all transform hover:scale-105">
@@ -0,0 +1,81 @@
+// Resumable chunked upload to the FastAPI backend (see Backend/modules/uploads.py)
+const API_URL = "http://127.0.0.1:8000";
+const MAX_RETRIES = 5;
+
+// Remember unfinished uploads so a page reload can resume them
+const storageKey = (file) => `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Bytes the server has received so far (null if it can't be asked right now)
+async function serverOffset(uploadId) {
+  const response = await fetch(`${API_URL}/uploads/${uploadId}`).catch(() => null);
+  return response?.ok ? (await response.json()).offset : null;
+}
+
+async function startOrResume(file) {
+  const saved = localStorage.getItem(storageKey(file));
+  if (saved) {
+    const response = await fetch(`${API_URL}/uploads/${saved}`);
+    if (response.ok) return response.json();
+    localStorage.removeItem(storageKey(file));
+  }
+
+  const form = new FormData();
+  form.append("filename", file.name);
+  form.append("size", String(file.size));
+  const response = await fetch(`${API_URL}/uploads`, { method: "POST", body: form });
+  if (!response.ok) throw new Error((await response.json()).detail || response.statusText);
+  const upload = await response.json();
+  localStorage.setItem(storageKey(file), upload.upload_id);
+  return upload;
+}
+
+// Upload file in chunks, retrying dropped chunks from the server's offset,
+// then analyze it. onProgress(fraction) is called after every chunk.
+export async function uploadAndAnalyze(file, patientId, onProgress = () => {}) {
+  const upload = await startOrResume(file);
+  let offset = upload.offset;
+  let retries = 0;
+
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + upload.chunk_size);
+    try {
+      const response = await fetch(`${API_URL}/uploads/${upload.upload_id}?offset=${offset}`, {
+        method: "PUT",
+        body: chunk,
+      });
+      if (response.status === 409) {
+        // Server has a different offset (e.g. an earlier chunk did land): continue from there.
+        // Counts as a retry, so a server that keeps disagreeing can't loop us forever.
+        if (++retries > MAX_RETRIES) {
+          throw Object.assign(new Error("Upload offset keeps changing; giving up."), { fatal: true });
+        }
+        const header = response.headers.get("Upload-Offset");
+        const resumeAt = (await serverOffset(upload.upload_id)) ?? (header === null ? NaN : Number(header));
+        if (Number.isInteger(resumeAt) && resumeAt >= 0 && resumeAt <= file.size) offset = resumeAt;
+        else await sleep(1000 * 2 ** retries); // offset unknown right now: try again later
+        continue;
+      }
+      if (!response.ok) {
+        // Rejected file (bad header, too large): nothing to resume
+        localStorage.removeItem(storageKey(file));
+        throw Object.assign(new Error((await response.json()).detail || response.statusText), { fatal: true });
+      }
+      offset = (await response.json()).offset;
+      retries = 0;
+      onProgress(offset / file.size);
+    } catch (error) {
+      if (error.fatal || ++retries > MAX_RETRIES) throw error;
+      await sleep(1000 * 2 ** retries);
+      offset = (await serverOffset(upload.upload_id)) ?? offset;
+    }
+  }
+
+  const form = new FormData();
+  form.append("patient_id", patientId);
+  const response = await fetch(`${API_URL}/uploads/${upload.upload_id}/analyze`, { method: "POST", body: form });
+  if (!response.ok) throw new Error(`Backend error: ${response.statusText}`);
+  localStorage.removeItem(storageKey(file));
+  return response.json();
+}